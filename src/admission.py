@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import time
+    import asyncio
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from aux import *
+
+
+quotaKeys = ["instances", "vCPUs", "GPUs"]
+defaultExpectedHours = 1 # hours of cost reserved per cluster for the budget
+clusterPrices = {"dlTest": "GPUInstancePrice",
+                 "proGANTest": "GPUInstancePrice",
+                 "hpcTest": "HPCInstancePrice"} # generalInstancePrice if not
+
+
+def clusterDemand(cluster, nodes, flavor, configs):
+    """ Resources the cluster of a test takes from the quotas.
+
+    Parameters:
+        cluster (str): Cluster ID (shared or the name of the test).
+        nodes (int): Number of nodes.
+        flavor (str): Flavor of the VMs.
+        configs (dict): Object containing configs.yaml's configurations.
+
+    Returns:
+        dict: instances, vCPUs, GPUs and price per hour of the cluster. vCPUs
+              and GPUs are 0 if the flavor is not in quotas.flavors, price is
+              0 if not set in costCalculation.
+    """
+
+    quotas = configs.get("quotas") or {}
+    size = (quotas.get("flavors") or {}).get(flavor, {})
+    price = (configs.get("costCalculation") or {}).get(
+        clusterPrices.get(cluster, "generalInstancePrice"))
+    return {"instances": nodes,
+            "vCPUs": size.get("vCPUs", 0) * nodes,
+            "GPUs": size.get("GPUs", 0) * nodes,
+            "price": (price or 0) * nodes}
+
+
+class Admission:
+    """ Admission control of the clusters of a run against the quotas of the
+        account (configs.yaml 'quotas': instances, vCPUs, GPUs and budget).
+        A cluster is only provisioned if it fits in what the clusters
+        holding capacity left; otherwise it waits until one of them releases
+        it (it is destroyed or failed to provision). A cluster that could
+        never fit, or that waits when nothing can release capacity anymore,
+        is rejected before creating anything.
+        For the budget, every cluster costs its price per hour times the
+        hours it has been held, at least expectedHours while it is held.
+    """
+
+    def __init__(self, quotas):
+        quotas = quotas or {}
+        self.limits = {key: quotas.get(key) for key in quotaKeys}
+        self.budget = quotas.get("budget")
+        self.expectedHours = quotas.get("expectedHours") or defaultExpectedHours
+        self.holders = {}
+        self.spent = 0 # cost of the clusters already released
+        self.condition = None # asyncio.Condition, created by the running loop
+
+    def enabled(self):
+        return self.budget is not None or any(
+            limit is not None for limit in self.limits.values())
+
+    def cost(self, holder, now):
+        hours = (now - holder["since"]) / 3600
+        return holder["demand"]["price"] * max(hours, self.expectedHours)
+
+    def exceeds(self, demand, holders=()):
+        """ Returns the quotas the demand would exceed on top of holders. """
+
+        exceeded = []
+        for key, limit in self.limits.items():
+            used = sum(h["demand"][key] for h in holders)
+            if limit is not None and used + demand[key] > limit:
+                exceeded.append(key)
+        if self.budget is not None:
+            now = time.time()
+            spent = self.spent + sum(self.cost(h, now) for h in holders)
+            if spent + demand["price"] * self.expectedHours > self.budget:
+                exceeded.append("budget")
+        return exceeded
+
+    def blocked(self):
+        """ True if no cluster holding capacity can release it anymore. """
+
+        return all(h["pinned"] for h in self.holders.values())
+
+    async def admit(self, cluster, demand, toLog):
+        """ Waits until the cluster fits in the quotas and takes its share.
+
+        Parameters:
+            cluster (str): Cluster ID (shared or the name of the test).
+            demand (dict): See clusterDemand.
+            toLog (str): File to which write the log msg.
+
+        Returns:
+            str: None if admitted, the quotas it exceeds otherwise.
+        """
+
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        never = self.exceeds(demand)
+        if never:
+            return ", ".join(never)
+        async with self.condition:
+            exceeded = self.exceeds(demand, self.holders.values())
+            if exceeded and not self.blocked():
+                writeToFile(toLog, "Waiting for quota (%s) to provision %s..."
+                            % (", ".join(exceeded), cluster), True)
+                await self.condition.wait_for(
+                    lambda: not self.exceeds(demand, self.holders.values())
+                    or self.blocked())
+                exceeded = self.exceeds(demand, self.holders.values())
+            if exceeded:
+                return ", ".join(exceeded)
+            self.holders[cluster] = {"demand": demand,
+                                     "since": time.time(),
+                                     "pinned": False}
+            return None
+
+    def reserve(self, cluster, demand):
+        """ Takes the share of a cluster that already exists (i.e. leased
+            from the pool), held until the end of the run.
+        """
+
+        self.holders[cluster] = {"demand": demand,
+                                 "since": time.time(),
+                                 "pinned": True}
+
+    async def pin(self, cluster):
+        """ Marks the cluster as held until the end of the run. """
+
+        if cluster in self.holders:
+            async with self.condition:
+                self.holders[cluster]["pinned"] = True
+                self.condition.notify_all()
+
+    async def release(self, cluster):
+        """ Gives back the share of the cluster (destroyed or not created). """
+
+        if cluster in self.holders:
+            async with self.condition:
+                holder = self.holders.pop(cluster)
+                self.spent += holder["demand"]["price"] * \
+                    (time.time() - holder["since"]) / 3600
+                self.condition.notify_all()
+
+    def held(self, cluster):
+        return cluster in self.holders
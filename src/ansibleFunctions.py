@@ -13,7 +13,6 @@ try:
     from ansible.cli import CLI
     from ansible.executor.playbook_executor import PlaybookExecutor
     from configparser import ConfigParser
-    from multiprocessing import Process, Queue
     import contextlib
     import io
 except ModuleNotFoundError as ex:
@@ -21,10 +20,10 @@ except ModuleNotFoundError as ex:
     sys.exit(1)
 from aux import *
 from init import *
+from tracing import traced
 
 
 def createHostsFile(mainTfDir,
-                    baseCWD,
                     provider,
                     destination,
                     configs,
@@ -36,7 +35,6 @@ def createHostsFile(mainTfDir,
 
     Parameters:
         mainTfDir (str): Location of the .tf file.
-        baseCWD (str): Original location, used to go back.
         provider (str): Provider name.
         destination (str): Destination of hosts file.
         configs (dict): Content of configs.yaml.
@@ -48,21 +46,14 @@ def createHostsFile(mainTfDir,
     IPs = []
 
     if noTerraform is not True:
-        os.chdir(mainTfDir)
-
-        tfShowJson = json.loads(runCMD("terraform show -json", read=True))
-        resources = tfShowJson["values"]["root_module"]["resources"]
-
-        os.chdir(baseCWD)
-
-        for resource in resources:
+        for resource in stateResources(mainTfDir):
 
             if usePrivateIPs is True:
                 ip = getIP(resource, provider)
             else:
                 ip = getIP(resource, provider, public=True) # no bastion method
 
-            if ip is not None:
+            if ip: # not None, nor empty (dynamic IP not known yet)
                 IPs.append(ip)
     else:
         IPs = configs["clusters"][test]  # one of shared, dlTest, hpcTest, proGANTest
@@ -77,8 +68,8 @@ def createHostsFile(mainTfDir,
         config.write(hostsfile)
 
 
+@traced("ansible", label="test")
 def ansiblePlaybook(mainTfDir,
-                    baseCWD,
                     providerName,
                     kubeconfig,
                     noTerraform,
@@ -89,7 +80,6 @@ def ansiblePlaybook(mainTfDir,
 
     Parameters:
         mainTfDir (str): Path where the .tf file is.
-        baseCWD (str): Path to go back.
         providerName (str): Provider name.
         kubeconfig (str): Path to kubeconfig file.
         noTerraform (bool): Specifies whether current run uses terraform.
@@ -107,7 +97,6 @@ def ansiblePlaybook(mainTfDir,
     hostsFilePath = "%s/hosts" % mainTfDir
 
     createHostsFile(mainTfDir,
-                    baseCWD,
                     providerName,
                     hostsFilePath,
                     configs,
@@ -144,11 +133,10 @@ def ansiblePlaybook(mainTfDir,
                                            gitinfo=False))
 
     # ----- to hide ansible logs
-    if aggregateLogs:
-        p = Process(target=subprocPrint, args=(test,))
-        p.start()
+    follower = FileFollower(ansibleLogs % test, test) if aggregateLogs \
+        else contextlib.nullcontext()
 
-    with open(ansibleLogs % test, 'a') as f: # from now on, logs go to ansibleLogs
+    with follower, open(ansibleLogs % test, 'a') as f: # from now on, logs go to ansibleLogs
         with contextlib.redirect_stdout(f):
             with contextlib.redirect_stderr(f):
 
@@ -168,6 +156,4 @@ def ansiblePlaybook(mainTfDir,
                                        loader=loader,
                                        passwords=None).run(), masterIP
 
-    if aggregateLogs:
-        p.terminate()
     return res
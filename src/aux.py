@@ -7,19 +7,25 @@ try:
     import os
     import datetime
     import time
-    import subprocess
     import jsonschema
     import shutil
     import random
     import string
+    import threading
     from configparser import ConfigParser
 
 except ModuleNotFoundError as ex:
     print(ex)
     sys.exit(1)
 
+from logWriter import writeLog
+from executor import runCommand
+
 yaml.warnings({'YAMLLoadWarning': False}) # https://github.com/yaml/pyyaml/wiki/PyYAML-yaml.load(input)-Deprecation
 
+followerSleepMin = 0.05 # seconds slept at the end of a followed file, at first
+followerSleepMax = 1 # upper bound of that sleep while nothing new is written
+
 
 def getRandomID():
     """ Returns a random ID """
@@ -45,28 +51,32 @@ def getMasterIP(hosts):
     return config.items('master')[0][0]
 
 
-def runCMD(cmd, hideLogs=None, read=None):
-    """ Run the command.
+def runCMD(cmd, hideLogs=None, read=None, timeout=None, cwd=None):
+    """ Run the command (see runCommand).
 
     Parameters:
         cmd (str): Command to be run.
         hideLogs (bool): Indicates whether cmd logs should be hidden.
         read (bool): Indicates whether logs of the command should be returned.
+        timeout (float): Seconds after which the command is killed.
+        cwd (str): Directory to run the command in.
 
     Returns:
         int or str: Command's exit code. Logs of the command if read=True
     """
 
-    #print(cmd)
-
     if read is True:
-        return os.popen(cmd).read().strip()
-    if hideLogs is True:
-        return subprocess.call(
-            cmd, shell=True, stdout=open(
-                os.devnull, 'w'), stderr=subprocess.STDOUT)
-    else:
-        return os.system(cmd)
+        lines = []
+
+        def onLine(line, stream):
+            if stream == "stdout":
+                lines.append(line)
+            else:
+                print(line, file=sys.stderr)
+
+        runCommand(cmd, cwd=cwd, timeout=timeout, onLine=onLine)
+        return "\n".join(lines).strip()
+    return runCommand(cmd, cwd=cwd, timeout=timeout, hideLogs=hideLogs is True)
 
 
 def stop(code):
@@ -148,7 +158,9 @@ def loadYAML(loadThis, required=None):
 
 
 def writeToFile(filePath, content, append):
-    """ Writes stuff to a file.
+    """ Writes stuff to a file. Once the run started logging (see
+        startLogging), the content of log files (src/logging) is buffered and
+        written by the log writer. Any other file is written right away.
 
     Parameters:
         filePath (str): Path to the file to load
@@ -157,6 +169,8 @@ def writeToFile(filePath, content, append):
                        False overrides the file or creates if not existing
     """
 
+    if writeLog(filePath, content, append is True) is True:
+        return
     mode = 'w'
     if append is True:
         mode = 'a'
@@ -204,10 +218,8 @@ def logger(text, sym, file, override=None):
         toPrint += "\n" + sym + "  " + text + \
             " " * (size - len(text)) + "  " + sym
     toPrint += "\n" + blank + "\n" + frame
-    if file and override is True:
-        runCMD("echo \"%s\" > %s" % (toPrint, file))
-    elif file and override is not True:
-        runCMD("echo \"%s\" >> %s" % (toPrint, file))
+    if file:
+        writeToFile(file, toPrint, override is not True)
     else:
         print(toPrint)
 
@@ -320,20 +332,107 @@ def getNodeName(configs, test, randomId):
     return nodeName.lower()
 
 
-def subprocPrint(test):
-    """ Runs on a child process. Reads the ansible log file, adds clusterID
-        to each line and prints it.
+class FileFollower:
+    """ Follows a log file from a thread, writing the lines appended to it
+        -prefixed with the cluster ID- to the stdout it had when created
+        (so redirecting stdout to the followed file doesn't loop). At the
+        end of the file it sleeps, doubling the sleep while nothing new is
+        written. The lines read at once are written in one go. Used as a
+        context manager: on exit, the rest of the file is written and the
+        thread finishes.
+    """
+
+    def __init__(self, path, test):
+        self.path = path
+        self.test = test
+        self.out = sys.stdout
+        self.offset = os.path.getsize(path) if os.path.isfile(path) else 0
+        self.partial = b""
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.follow, daemon=True)
+
+    def read(self):
+        """ Writes what was appended since the last call.
+
+        Returns:
+            bool: True if anything was appended.
+        """
+
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        if not data:
+            return False
+        self.offset += len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        toWrite = "".join("[ %s ] %s\n" % (self.test,
+                                            line.decode(errors="replace"))
+                          for line in lines if line)
+        if toWrite:
+            self.out.write(toWrite)
+            self.out.flush()
+        return True
+
+    def follow(self):
+        sleepTime = followerSleepMin
+        while not self.stopped.is_set():
+            if self.read() is True:
+                sleepTime = followerSleepMin
+            else:
+                self.stopped.wait(sleepTime)
+                sleepTime = min(sleepTime * 2, followerSleepMax)
+        self.read()
+        if self.partial:
+            self.out.write("[ %s ] %s\n" %
+                           (self.test, self.partial.decode(errors="replace")))
+            self.out.flush()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+def stateResources(mainTfDir):
+    """ Reads the resources of a cluster straight from its Terraform state,
+        described as 'terraform show -json' would, without running Terraform.
 
     Parameters:
-        test (str): Cluster identification.
+        mainTfDir (str): Path where the .tf file (and its state) is.
+
+    Returns:
+        Array<object>: Managed resources of the root module, one per
+                       instance.
     """
 
-    line = None
-    with open(ansibleLogs % test, 'r') as f:
-        while True:
-            line = f.readline()
-            if len(line) > 0 and line != '\n':
-                print("[ %s ] %s" % (test, line.replace('\n', '')))
+    try:
+        with open(os.path.join(mainTfDir, "terraform.tfstate"), 'r') as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+    resources = []
+    for resource in state.get("resources", []):
+        if resource.get("mode") != "managed" or "module" in resource:
+            continue
+        for instance in resource.get("instances", []):
+            description = {"address": "%s.%s" % (resource["type"],
+                                                 resource["name"]),
+                           "mode": "managed",
+                           "type": resource["type"],
+                           "name": resource["name"],
+                           "provider_name": resource.get("provider"),
+                           "values": instance.get("attributes", {})}
+            if "index_key" in instance:
+                description["index"] = instance["index_key"]
+            resources.append(description)
+    return resources
 
 
 def getIP(resource, provider, public=False):
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import json
+    import time
+    import fcntl
+    import contextlib
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from aux import *
+from kubernetesFunctions import *
+
+
+poolIdleTTL = 4 * 3600 # seconds a kept cluster can stay unused
+poolFile = "src/tests/%s/pool.json" # state of the kept cluster
+poolLock = "src/tests/%s/pool.lock"
+
+
+@contextlib.contextmanager
+def lockedEntry(cluster):
+    """ Holds the lock of a cluster's pool entry, so two runs can't lease
+        the same cluster.
+    """
+
+    os.makedirs(os.path.dirname(poolLock % cluster), exist_ok=True)
+    with open(poolLock % cluster, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def loadEntry(cluster):
+    """ Returns the pool entry of a cluster, None if it isn't kept. """
+
+    try:
+        with open(poolFile % cluster, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def saveEntry(cluster, entry):
+    tmp = poolFile % cluster + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(entry, f, indent=4, sort_keys=True)
+    os.replace(tmp, poolFile % cluster)
+
+
+def dropEntry(cluster):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(poolFile % cluster)
+
+
+def leaseAlive(lease):
+    """ Returns True if the run holding the lease is still running. """
+
+    if lease is None:
+        return False
+    try:
+        os.kill(lease["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # running as another user
+    return True
+
+
+def clusterHealthy(cluster, entry):
+    """ Fast health check of a kept cluster: reachable and with all its
+        nodes Ready.
+
+    Returns:
+        bool: True if the cluster can be used.
+    """
+
+    try:
+        nodes = listNodes("src/tests/%s/config" % cluster, timeout=10)
+    except BaseException:
+        return False
+    ready = [node for node in nodes
+             if any(c.type == "Ready" and c.status == "True"
+                    for c in (node.status.conditions or []))]
+    return len(ready) == len(nodes) == entry["k8sNodes"]
+
+
+def scrubCluster(cluster, entry):
+    """ Removes what previous runs left on a kept cluster: the namespaces
+        that didn't exist when it was bootstrapped, and the pods, MPIJobs
+        and ConfigMaps of the tests in 'default'.
+    """
+
+    apiClient = getApiClient("src/tests/%s/config" % cluster)
+    coreV1 = client.CoreV1Api(apiClient)
+    for namespace in coreV1.list_namespace().items:
+        if namespace.metadata.name not in entry["namespaces"]:
+            coreV1.delete_namespace(namespace.metadata.name)
+    coreV1.delete_collection_namespaced_pod("default")
+    coreV1.delete_collection_namespaced_config_map(
+        "default", field_selector="metadata.name!=kube-root-ca.crt")
+    with contextlib.suppress(ApiException): # MPI operator not deployed
+        customObjects = client.CustomObjectsApi(apiClient)
+        for mpijob in customObjects.list_namespaced_custom_object(
+                'kubeflow.org', 'v1alpha2', 'default', 'mpijobs')["items"]:
+            customObjects.delete_namespaced_custom_object(
+                'kubeflow.org', 'v1alpha2', 'default', 'mpijobs',
+                mpijob["metadata"]["name"])
+
+
+def leaseCluster(cluster, spec, run):
+    """ Tries to lease the kept cluster of a test to this run.
+
+    Parameters:
+        cluster (str): Cluster ID (shared or the name of the test).
+        spec (dict): provider, flavor and nodes the run needs.
+        run (str): ID of the run.
+
+    Returns:
+        str: 'leased' if the cluster can be used as is (its entry has the
+             masterIP), 'provision' if there is no cluster to reuse, 'destroy'
+             if the kept one has to be destroyed first (doesn't fit, expired
+             or broken) or 'busy' if another run is using it.
+        dict: Pool entry of the cluster, if any.
+    """
+
+    with lockedEntry(cluster):
+        entry = loadEntry(cluster)
+        if entry is None:
+            return "provision", None
+        if leaseAlive(entry.get("lease")):
+            return "busy", entry
+        fits = all(entry[key] == spec[key] for key in spec)
+        expired = time.time() - entry["idleSince"] > poolIdleTTL
+        if not fits or expired or not clusterHealthy(cluster, entry):
+            return "destroy", entry
+        scrubCluster(cluster, entry)
+        entry["lease"] = {"run": run, "pid": os.getpid(), "since": time.time()}
+        saveEntry(cluster, entry)
+        return "leased", entry
+
+
+def registerCluster(cluster, spec, masterIP, run):
+    """ Adds a cluster created by this run to the pool, leased to it.
+
+    Parameters:
+        cluster (str): Cluster ID (shared or the name of the test).
+        spec (dict): provider, flavor and nodes of the cluster.
+        masterIP (str): IP of the master node.
+        run (str): ID of the run.
+    """
+
+    coreV1 = client.CoreV1Api(getApiClient("src/tests/%s/config" % cluster))
+    entry = dict(spec)
+    entry.update({
+        "masterIP": masterIP,
+        "created": time.time(),
+        "idleSince": time.time(),
+        "k8sNodes": len(coreV1.list_node().items),
+        "namespaces": [n.metadata.name for n in coreV1.list_namespace().items],
+        "lease": {"run": run, "pid": os.getpid(), "since": time.time()}})
+    with lockedEntry(cluster):
+        saveEntry(cluster, entry)
+
+
+def releaseCluster(cluster, run):
+    """ Returns a cluster leased by this run to the pool, starting its idle
+        time.
+    """
+
+    with lockedEntry(cluster):
+        entry = loadEntry(cluster)
+        if entry is None or (entry.get("lease") or {}).get("run") != run:
+            return
+        entry["lease"] = None
+        entry["idleSince"] = time.time()
+        saveEntry(cluster, entry)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import json
+    import time
+    import shutil
+    import signal
+    import argparse
+    import collections
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+
+dashboardInterval = 0.5 # seconds between checks of the log files
+channels = ["header", "shared", "dlTest", "proGANTest", "hpcTest", "footer"]
+clusterSteps = ["lease", "admit", "provision", "bootstrap", "ready", "check",
+                "stage", "teardown"]
+linesKept = 200 # lines kept in memory per channel
+finished = ("done", "failed", "skipped", "cancelled", "resumed")
+
+
+class LogTail:
+    """ Follows a log file, reading only the bytes appended since the last
+        read. If the file is truncated or recreated, it starts over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.inode = None
+        self.head = b"" # first bytes read, to tell if it was rewritten
+        self.partial = b""
+
+    def read(self):
+        """ Returns the complete lines appended since the last call and
+            whether the file started over.
+        """
+
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return [], False
+        restarted = False
+        if st.st_ino == self.inode and st.st_size == self.offset:
+            return [], restarted
+        with open(self.path, 'rb') as f:
+            if st.st_ino != self.inode or st.st_size < self.offset or \
+                    f.read(len(self.head)) != self.head:
+                restarted = self.inode is not None
+                self.inode, self.offset, self.partial = st.st_ino, 0, b""
+            f.seek(self.offset)
+            data = f.read()
+            if self.offset == 0:
+                self.head = data[:64]
+            self.offset += len(data)
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        return [line.decode(errors="replace") for line in lines], restarted
+
+
+class RunStatus:
+    """ Status of the clusters and tests of the run, from the changes of
+        status of the steps of the run graph (src/logging/steps).
+    """
+
+    def __init__(self):
+        self.steps = {} # name: [status, started, ended]
+
+    def update(self, line):
+        try:
+            change = json.loads(line)
+        except ValueError:
+            return
+        step = self.steps.setdefault(change["step"], [None, None, None])
+        step[0] = change["status"]
+        if change["status"] == "running":
+            step[1] = change["time"]
+        elif change["status"] in finished and step[1] is not None:
+            step[2] = change["time"]
+
+    def clusters(self, now):
+        """ Returns, for every cluster: its current (or last) phase and its
+            status, the seconds since it started and its steps finished out
+            of the total.
+        """
+
+        clusters = collections.OrderedDict()
+        for name, (status, started, ended) in self.steps.items():
+            kind, _, cluster = name.partition(":")
+            if kind not in clusterSteps:
+                continue
+            row = clusters.setdefault(cluster, {"latest": None, "start": None,
+                                                "end": 0, "done": 0,
+                                                "total": 0})
+            row["total"] += 1
+            if status in finished:
+                row["done"] += 1
+            if started is None:
+                continue
+            # the phase shown is the step running, or else the last started
+            latest = (status == "running", started, kind, status)
+            row["latest"] = max(row["latest"] or latest, latest)
+            row["start"] = min(row["start"] or started, started)
+            row["end"] = None if status == "running" or row["end"] is None \
+                else max(row["end"], ended or 0)
+        return [(cluster,
+                 "-" if row["latest"] is None else row["latest"][2],
+                 "" if row["latest"] is None else row["latest"][3],
+                 0 if row["start"] is None else
+                 (row["end"] or now) - row["start"],
+                 row["done"], row["total"])
+                for cluster, row in clusters.items()]
+
+    def tests(self):
+        """ Returns the tests running, done and in total. """
+
+        tests = [(name.partition(":")[2], status)
+                 for name, (status, _, _) in self.steps.items()
+                 if name.startswith("test:")]
+        running = [test for test, status in tests if status == "running"]
+        done = [test for test, status in tests if status in finished]
+        return running, len(done), len(tests)
+
+
+def elapsed(seconds):
+    return "%dm%02ds" % divmod(int(seconds), 60)
+
+
+class Screen:
+    """ Terminal showing the frames of the dashboard. Only the rows that
+        changed since the last frame are written.
+    """
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.rows = []
+        self.size = None
+        self.out.write("\x1b[?25l") # hide the cursor
+
+    def draw(self, frame):
+        size = shutil.get_terminal_size()
+        if size != self.size: # resized: redraw everything
+            self.size, self.rows = size, []
+            self.out.write("\x1b[2J")
+        frame = [line[:size.columns] for line in frame[:size.lines]]
+        toWrite = []
+        for row, line in enumerate(frame):
+            if row >= len(self.rows) or self.rows[row] != line:
+                toWrite.append("\x1b[%d;1H%s\x1b[K" % (row + 1, line))
+        for row in range(len(frame), len(self.rows)):
+            toWrite.append("\x1b[%d;1H\x1b[K" % (row + 1))
+        self.rows = frame
+        if toWrite:
+            self.out.write("".join(toWrite))
+            self.out.flush()
+
+    def close(self):
+        self.out.write("\x1b[2J\x1b[H\x1b[?25h")
+        self.out.flush()
+
+
+class Dashboard:
+    """ Live view of a run: the status of every cluster and the tests, and
+        the last lines of every log channel. Log files are followed reading
+        only what was appended to them (see LogTail).
+    """
+
+    def __init__(self, logDir):
+        self.tails = {c: LogTail(os.path.join(logDir, c)) for c in channels}
+        self.lines = {c: collections.deque(maxlen=linesKept) for c in channels}
+        self.stepsTail = LogTail(os.path.join(logDir, "steps"))
+        self.status = RunStatus()
+
+    def poll(self):
+        """ Reads what was appended to the log files.
+
+        Returns:
+            Array<(str, str)>: New (channel, line) pairs.
+            bool: True if anything changed.
+        """
+
+        new = []
+        changed = False
+        for channel, tail in self.tails.items():
+            lines, restarted = tail.read()
+            if restarted is True:
+                self.lines[channel].clear()
+                changed = True
+            self.lines[channel].extend(lines)
+            new += [(channel, line) for line in lines]
+        changes, _ = self.stepsTail.read()
+        for line in changes:
+            self.status.update(line)
+            try:
+                change = json.loads(line)
+            except ValueError:
+                continue
+            if change["status"] != "pending":
+                new.append(("steps", "%s %s" % (change["step"],
+                                                change["status"])))
+        return new, changed or bool(new)
+
+    def frame(self, height):
+        now = time.time()
+        frame = list(self.lines["header"]) + [""]
+        clusters = self.status.clusters(now)
+        if clusters:
+            frame.append("%-12s %-10s %-10s %8s %6s" %
+                         ("CLUSTER", "PHASE", "STATUS", "ELAPSED", "STEPS"))
+            for cluster, phase, status, seconds, done, total in clusters:
+                frame.append("%-12s %-10s %-10s %8s %3d/%-2d" %
+                             (cluster, phase, status, elapsed(seconds),
+                              done, total))
+        running, done, total = self.status.tests()
+        if total:
+            frame.append("TESTS %d/%d done%s" %
+                         (done, total, ", running: " + ", ".join(running)
+                          if running else ""))
+        frame.append("")
+        footer = list(self.lines["footer"])
+        logged = [c for c in channels[1:-1] if self.lines[c]]
+        room = max(height - len(frame) - len(footer) - 2 * len(logged), 0)
+        for channel in logged:
+            perChannel = max(room // len(logged), 1)
+            frame += list(self.lines[channel])[-perChannel:] + [""]
+        return frame + footer
+
+    def run(self, screen=None, plain=None):
+        """ Refreshes the view every dashboardInterval seconds until killed.
+
+        Parameters:
+            screen (Screen): Terminal to draw on.
+            plain (str): Instead of drawing, append every new line (prefixed
+                         with its channel) to this file.
+        """
+
+        ticks = 0
+        while True:
+            new, changed = self.poll()
+            if plain is not None:
+                if new:
+                    with open(plain, 'a') as f:
+                        f.write("".join("[%s] %s\n" % line for line in new))
+            elif changed or ticks % int(1 / dashboardInterval) == 0:
+                # elapsed times change every second even if nothing is logged
+                screen.draw(self.frame(shutil.get_terminal_size().lines))
+            ticks += 1
+            time.sleep(dashboardInterval)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Live view of a test-suite run.")
+    parser.add_argument("logDir", help="Folder of the logs of the run.")
+    parser.add_argument("--plain", metavar="FILE",
+                        help="Append new log lines to FILE instead of drawing.")
+    args = parser.parse_args()
+
+    dashboard = Dashboard(args.logDir)
+    screen = None if args.plain else Screen()
+
+    def finish(signum, frame):
+        if screen is not None:
+            screen.close()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, finish)
+    signal.signal(signal.SIGINT, finish)
+    dashboard.run(screen, args.plain)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import time
+    import asyncio
+    import functools
+    import threading
+    import multiprocessing
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from aux import *
+from tests import *
+from scheduler import *
+from clusterPool import *
+from multiTarget import withSlot
+from admission import *
+import tests
+import init
+
+
+warmUpBarrier = None # held by every provisioning worker until all are forked
+warmUpTO = 60 # seconds the provisioning workers wait for each other
+
+
+def warmUp():
+    """ Runs on every worker of the provisioning pool when it starts. """
+
+    warmUpBarrier.wait(warmUpTO)
+    return os.getpid()
+
+
+class RunResults:
+    """ Results of a run. Tests report through init.queue with (entry, cost)
+        or (entry, cost, metrics) tuples -metrics being the durations and
+        counters of the test, see TestMetrics-: this object takes the place
+        of the multiprocessing Queue, so results stay in memory as they
+        arrive. If given a journal, results are also recorded in it.
+    """
+
+    def __init__(self, journal=None):
+        self.lock = threading.Lock()
+        self.journal = journal
+        self.entries = []
+        self.cost = 0
+        self.metrics = {} # test: metrics
+
+    def put(self, item, record=True):
+        entry, cost, metrics = item if len(item) == 3 else (*item, None)
+        with self.lock:
+            if entry:
+                self.entries.append(entry)
+                if metrics:
+                    self.metrics[entry.get("test")] = metrics
+            self.cost += cost
+        if record is True and self.journal is not None:
+            self.journal.record("result",
+                                entry.get("test") if entry else None,
+                                entry=entry,
+                                cost=cost,
+                                metrics=metrics)
+
+
+class RunEngine:
+    """ Drives a run from a single event loop, as a graph of steps (see
+        Scheduler): provisioning, bootstrap and readiness of every cluster,
+        staging of inputs and the tests. Ansible runs go to a small process
+        pool (they redirect stdout, which is process-wide, so they can't
+        share a process), everything else -Terraform, which runs as a
+        command in the folder of its cluster, and mostly waiting on the
+        Kubernetes API- to a thread pool.
+        If given the ID of the run as pool, clusters are leased from the pool
+        of kept clusters, and the ones created are added to it. If given the
+        provisioning slots of a multi-target run, every Terraform/Ansible job
+        holds one of them while it runs. Clusters are only provisioned when
+        they fit in the quotas of the account (see Admission).
+    """
+
+    def __init__(self, limits, journal=None, pool=None, slots=None,
+                 quotas=None):
+        self.limits = limits
+        self.journal = journal
+        self.pool = pool
+        self.slots = slots
+        self.admission = Admission(quotas)
+        self.leased = [] # clusters of the pool used by this run
+        self.destroyed = {} # cluster: exit code of its destroy
+        self.results = RunResults(journal)
+        provisioners = limits["ssh"]
+        global warmUpBarrier
+        warmUpBarrier = multiprocessing.get_context("fork").Barrier(
+            provisioners)
+        self.provisioners = ProcessPoolExecutor(
+            max_workers=provisioners,
+            mp_context=multiprocessing.get_context("fork"))
+        # fork all the workers now, before the run starts any thread: some
+        # Pythons fork them on demand, and a warm-up job holds its worker
+        # until all of them are up, so each one forks a new worker
+        warmUps = [self.provisioners.submit(warmUp)
+                   for _ in range(provisioners)]
+        for future in warmUps:
+            future.result()
+        self.workers = ThreadPoolExecutor(
+            max_workers=limits["cloud"] + limits["tests"] + limits["k8s"] +
+            limits["local"])
+
+    async def blocking(self, func, *args):
+        """ Runs func in the provisioning pool (Ansible). """
+
+        return await asyncio.wrap_future(
+            self.provisioners.submit(withSlot, self.slots, func, *args))
+
+    async def inThread(self, func, *args):
+        """ Runs func in the thread pool. """
+
+        return await asyncio.get_running_loop().run_in_executor(
+            self.workers, functools.partial(func, *args))
+
+    async def terraform(self, func, *args):
+        """ Runs func (a Terraform job) in the thread pool, holding a
+            provisioning slot.
+        """
+
+        return await self.inThread(withSlot, self.slots, func, *args)
+
+    def addCluster(self, scheduler, cluster, onlyTest, retry, noTerraform,
+                   resDir, usePrivateIPs, sharedNodes=None, teardown=False):
+        """ Adds the steps making the cluster of a test ready. They produce
+            'cluster:<cluster>'. Using the pool, a kept cluster that fits is
+            leased instead of provisioned and bootstrapped. If teardown, the
+            share of the quotas of the cluster is kept until it is destroyed
+            (see addTeardown), otherwise until the end of the run.
+
+        Returns:
+            dict: Shared with the steps, 'start' is set to the time at which
+                  the cluster started to be provisioned.
+        """
+
+        toLog = "src/logging/%s" % cluster
+        state = {"start": None, "masterIP": None, "leased": False}
+        created = None if self.journal is None \
+            else self.journal.last("cluster", cluster)
+        if created is not None: # resuming: the cluster was bootstrapped
+            state["masterIP"] = created["masterIP"]
+        if retry is True and \
+                not os.path.isfile("%s%s/main.tf" % (testsRoot, cluster)):
+            retry = None # nothing to reuse, provision from scratch
+
+        if onlyTest is True:
+            scheduler.add("check:%s" % cluster,
+                          lambda: self.inThread(checkCluster, cluster),
+                          outputs=["cluster:%s" % cluster],
+                          resource="k8s",
+                          rerun=True)
+            return state
+
+        nodes, flavor, extra = clusterSpec(cluster, noTerraform, sharedNodes)
+        pooled = self.pool is not None and noTerraform is False
+        spec = {"provider": init.configs["providerName"],
+                "flavor": flavor,
+                "nodes": nodes}
+        demand = clusterDemand(cluster, nodes, flavor, init.configs)
+        sizes = (init.configs.get("quotas") or {}).get("flavors") or {}
+        if noTerraform is False and flavor not in sizes and \
+                (self.admission.limits["vCPUs"] is not None or
+                 self.admission.limits["GPUs"] is not None):
+            writeToFile(toLog, "Flavor '%s' not in quotas.flavors: its vCPUs "
+                        "and GPUs are not checked" % flavor, True)
+
+        async def leaseStep():
+            nonlocal retry
+            state["start"] = time.time()
+            outcome, entry = await self.inThread(leaseCluster,
+                                                 cluster,
+                                                 spec,
+                                                 self.pool)
+            if outcome == "busy":
+                clusterFailed(cluster, "Cluster '%s' is leased to run %s" % (
+                    cluster, entry["lease"]["run"]), resDir)
+                return False
+            if outcome == "leased":
+                writeToFile(toLog, "Reusing kept cluster '%s' (idle %d min)" % (
+                    cluster, (time.time() - entry["idleSince"]) / 60), True)
+                state["leased"] = True
+                state["masterIP"] = entry["masterIP"]
+                self.leased.append(cluster)
+                return
+            if outcome == "destroy":
+                writeToFile(toLog, "Kept cluster '%s' doesn't fit, expired or "
+                            "is not healthy: destroying it..." % cluster, True)
+                if (await self.terraform(destroyTF, [cluster]))[0] != 0:
+                    clusterFailed(cluster, "Couldn't destroy kept cluster "
+                                  "'%s'" % cluster, resDir)
+                    return False
+                dropEntry(cluster)
+                retry = None
+
+        async def admitStep():
+            if state["leased"] is True:
+                self.admission.reserve(cluster, demand)
+                return
+            exceeded = await self.admission.admit(cluster, demand, toLog)
+            if exceeded is not None:
+                clusterFailed(cluster, "Cluster would exceed the quotas (%s): "
+                              "provision not attempted" % exceeded, resDir)
+                return False
+
+        async def provisionStep():
+            if state["leased"] is True:
+                return
+            state["start"] = time.time()
+            res, msg = await self.terraform(provision,
+                                            cluster,
+                                            nodes,
+                                            flavor,
+                                            extra,
+                                            toLog,
+                                            init.configs,
+                                            init.cfgPath,
+                                            testsRoot,
+                                            retry,
+                                            instanceDefinition,
+                                            credentials,
+                                            dependencies,
+                                            baseCWD,
+                                            extraSupportedClouds,
+                                            usePrivateIPs)
+            if res is False:
+                await self.admission.release(cluster)
+                clusterFailed(cluster, msg, resDir)
+            elif teardown is False:
+                await self.admission.pin(cluster)
+            return res
+
+        async def bootstrapStep():
+            if state["leased"] is True:
+                return
+            if state["start"] is None:
+                state["start"] = time.time()
+            res, masterIP = await self.blocking(bootstrap,
+                                                cluster,
+                                                init.configs,
+                                                testsRoot,
+                                                baseCWD,
+                                                noTerraform,
+                                                usePrivateIPs)
+            if res is False:
+                clusterFailed(cluster, masterIP, resDir)
+                return False
+            state["masterIP"] = masterIP
+            if self.journal is not None:
+                self.journal.record("cluster", cluster, masterIP=masterIP)
+
+        async def readyStep():
+            res, msg = await self.inThread(waitForCluster,
+                                           cluster,
+                                           toLog,
+                                           state["masterIP"],
+                                           baseCWD,
+                                           usePrivateIPs)
+            if res is False:
+                clusterFailed(cluster, msg, resDir)
+            elif pooled is True and state["leased"] is False:
+                await self.inThread(registerCluster,
+                                    cluster,
+                                    spec,
+                                    state["masterIP"],
+                                    self.pool)
+                state["leased"] = True
+                self.leased.append(cluster)
+            return res
+
+        if pooled is True:
+            scheduler.add("lease:%s" % cluster,
+                          leaseStep,
+                          outputs=["lease:%s" % cluster],
+                          resource="k8s",
+                          rerun=True)
+        if noTerraform is False:
+            # not holding a cloud slot while waiting for quota
+            scheduler.add("admit:%s" % cluster,
+                          admitStep,
+                          inputs=["lease:%s" % cluster] if pooled else [],
+                          outputs=["quota:%s" % cluster],
+                          rerun=True)
+            scheduler.add("provision:%s" % cluster,
+                          provisionStep,
+                          inputs=["quota:%s" % cluster],
+                          outputs=["vms:%s" % cluster],
+                          resource="cloud")
+        scheduler.add("bootstrap:%s" % cluster,
+                      bootstrapStep,
+                      inputs=[] if noTerraform is True else ["vms:%s" % cluster],
+                      outputs=["k8s:%s" % cluster],
+                      resource="ssh")
+        scheduler.add("ready:%s" % cluster,
+                      readyStep,
+                      inputs=["k8s:%s" % cluster],
+                      outputs=["cluster:%s" % cluster],
+                      resource="k8s",
+                      rerun=True)
+        return state
+
+    def addTeardown(self, scheduler, cluster, inputs):
+        """ Adds the step destroying the cluster of a test once what uses it
+            is done, giving back its share of the quotas.
+
+        Parameters:
+            cluster (str): Cluster ID (shared or the name of the test).
+            inputs (Array<str>): Outputs of the steps using the cluster.
+        """
+
+        async def teardownStep():
+            provisioned = scheduler.steps["provision:%s" % cluster]
+            if provisioned.status not in ("done", "resumed"):
+                return # nothing created
+            res = (await self.terraform(destroyTF, [cluster]))[0]
+            self.destroyed[cluster] = res
+            if res != 0:
+                await self.admission.pin(cluster) # VMs may still be there
+                writeToFile("src/logging/footer", "   ...destroy failed. "
+                            "Check 'logs' file for details", True)
+                return False
+            await self.admission.release(cluster)
+            writeToFile("src/logging/footer", "   ...cluster destroyed", True)
+
+        scheduler.add("teardown:%s" % cluster,
+                      teardownStep,
+                      inputs=inputs,
+                      resource="cloud",
+                      always=True)
+
+    def plan(self, sharedTests, customTests, onlyTest, retry, noTerraform,
+             resDir, sharedNodes, usePrivateIPs, resume=False, destroy=()):
+        """ Builds the graph of the run.
+
+        Parameters:
+            sharedTests (Array<str>): Tests to run on the shared cluster.
+            customTests (Array<str>): Tests to run on their own clusters.
+            sharedNodes (int): Number of nodes of the shared cluster.
+            resume (bool): If True, skip what the journal shows as completed.
+            destroy (Array<str>): Clusters to destroy as soon as their tests
+                                  are done.
+            See provisionAndBootstrap for the rest.
+
+        Returns:
+            Scheduler: The graph, ready to run.
+        """
+
+        scheduler = Scheduler(self.limits, self.journal,
+                              statusLog="src/logging/steps")
+        planned = time.time()
+        teardown = [] if onlyTest is True or noTerraform is True or \
+            self.pool is not None else destroy
+
+        if sharedTests:
+            shared = self.addCluster(scheduler, "shared", onlyTest, retry,
+                                     noTerraform, resDir, usePrivateIPs,
+                                     sharedNodes=sharedNodes,
+                                     teardown="shared" in teardown)
+            for test in sharedTests:
+                scheduler.add("test:%s" % test,
+                              functools.partial(self.inThread,
+                                                getattr(tests, test),
+                                                resDir),
+                              inputs=["cluster:shared"],
+                              outputs=["done:%s" % test],
+                              resource="tests")
+
+            async def sharedCost():
+                ready = scheduler.steps[scheduler.producers["cluster:shared"]]
+                if ready.status != "done":
+                    return # failure already recorded or cluster not reachable
+                if init.obtainCost is True: # duration * price * instances
+                    start = shared["start"] if shared["start"] else planned
+                    self.results.put((None,
+                        ((time.time() - start) / 3600) *
+                        init.configs["costCalculation"]["generalInstancePrice"] *
+                        len(sharedTests)))
+
+            scheduler.add("cost:shared",
+                          sharedCost,
+                          inputs=["done:%s" % test for test in sharedTests],
+                          outputs=["cost:shared"],
+                          always=True)
+            if "shared" in teardown:
+                self.addTeardown(scheduler, "shared", ["cost:shared"])
+
+        for test in customTests:
+            state = self.addCluster(scheduler, test, onlyTest, retry,
+                                    noTerraform, resDir, usePrivateIPs,
+                                    teardown=test in teardown)
+            inputs = ["cluster:%s" % test]
+            extra = []
+            if test == "dlTest": # the data set doesn't need the cluster
+                scheduler.add("render:dlTest",
+                              functools.partial(self.inThread, renderDataset),
+                              outputs=["manifest:dlTest"],
+                              resource="local",
+                              rerun=True)
+                scheduler.add("stage:dlTest",
+                              functools.partial(self.inThread, stageDataset),
+                              inputs=["manifest:dlTest", "cluster:dlTest"],
+                              outputs=["dataset:dlTest"],
+                              resource="k8s",
+                              rerun=True)
+                inputs.append("dataset:dlTest")
+                extra = [True] # staged
+
+            async def testStep(test=test, state=state, extra=extra):
+                await self.inThread(getattr(tests, test),
+                                    True, # cluster already checked/created
+                                    retry,
+                                    noTerraform,
+                                    resDir,
+                                    usePrivateIPs,
+                                    state["start"],
+                                    *extra)
+
+            scheduler.add("test:%s" % test,
+                          testStep,
+                          inputs=inputs,
+                          outputs=["done:%s" % test],
+                          resource="tests")
+            if test in teardown:
+                self.addTeardown(scheduler, test, ["done:%s" % test])
+        if resume is True:
+            self.resume(scheduler, resDir)
+        return scheduler
+
+    def resume(self, scheduler, resDir):
+        """ Skips the steps completed according to the journal -tests only if
+            their results are there and are not failures- and takes back the
+            results they reported.
+        """
+
+        completed = set()
+        for name, status in self.journal.steps().items():
+            if status != "done":
+                continue
+            if name.startswith("test:") and \
+                    not testCompleted(name.split(":", 1)[1], resDir):
+                continue
+            completed.add(name)
+        scheduler.resume(completed)
+        resumed = scheduler.resumed()
+        for entry, cost, metrics in self.journal.results():
+            if entry and "test:%s" % entry.get("test") not in resumed:
+                entry = None # redone: only its cost remains
+            self.results.put((entry, cost, metrics), record=False)
+        writeToFile("src/logging/header", "Resuming run, skipping: %s" %
+                    (", ".join(sorted(resumed)) or "nothing"), True)
+
+    async def main(self, scheduler):
+        try:
+            await scheduler.run()
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+    def run(self, scheduler):
+        """ Runs the graph of the run and waits for it to finish.
+
+        Parameters:
+            scheduler (Scheduler): Graph built by plan().
+
+        Returns:
+            RunResults: Results of the run.
+        """
+
+        try:
+            asyncio.run(self.main(scheduler))
+        finally:
+            # jobs not started yet were cancelled along with their steps
+            self.workers.shutdown(wait=False)
+            self.provisioners.shutdown(wait=True)
+        return self.results
+
+    def cancel(self):
+        """ Cancels what didn't start yet. Running Terraform/Ansible jobs and
+            tests are left to finish (or to be interrupted by the signal).
+        """
+
+        writeToFile("src/logging/header", "Run interrupted, cancelling...", True)
+        self.workers.shutdown(wait=False)
+        self.provisioners.shutdown(wait=False)
+
+    def releasePool(self):
+        """ Returns the clusters used by the run to the pool, to be leased by
+            the next runs.
+
+        Returns:
+            Array<str>: Clusters released.
+        """
+
+        for cluster in self.leased:
+            releaseCluster(cluster, self.pool)
+        return list(self.leased)
+
+
+def startEngine(limits, journal=None, pool=None, slots=None, quotas=None):
+    """ Creates the engine of the run and routes the results of the tests
+        (init.queue) to it. Must be called before any thread is started.
+
+    Parameters:
+        limits (dict): Steps running at once per resource: cloud (Terraform),
+                       ssh (Ansible), k8s, local and tests.
+        journal (RunJournal): Journal of the run.
+        pool (str): ID of the run, to lease clusters from the pool of kept
+                    clusters. None to not use the pool.
+        slots (str): Folder of the provisioning slots shared with the other
+                     targets of a multi-target run, see runTargets.
+        quotas (dict): 'quotas' section of configs.yaml.
+
+    Returns:
+        RunEngine: The engine.
+    """
+
+    init.engine = RunEngine(limits, journal, pool, slots, quotas)
+    init.queue = init.engine.results
+    return init.engine
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import time
+    import shlex
+    import signal
+    import threading
+    import subprocess
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from tracing import record
+
+
+toolLimits = {"terraform": 4, "kubectl": 8, "aws": 2} # processes at once
+defaultToolLimit = 8 # processes at once of a tool not in toolLimits
+killGrace = 5 # seconds between SIGTERM and SIGKILL when a deadline passes
+shellChars = set("|&;<>()$`*?~\n") # commands with these need a shell
+maxArgLength = 200 # characters of a command kept on its record
+
+toolSlots = {} # tool: BoundedSemaphore
+toolSlotsLock = threading.Lock()
+
+
+def toolSlot(tool):
+    with toolSlotsLock:
+        if tool not in toolSlots:
+            toolSlots[tool] = threading.BoundedSemaphore(
+                toolLimits.get(tool, defaultToolLimit))
+        return toolSlots[tool]
+
+
+def commandArgs(cmd):
+    """ Arguments to spawn a command with: a string is split as the shell
+        would, unless it uses shell syntax (pipes, redirections, &&...), in
+        which case it is run by /bin/sh.
+
+    Returns:
+        Array<str>: Arguments.
+        str: Tool run (name of the executable).
+    """
+
+    if not isinstance(cmd, str):
+        return list(cmd), os.path.basename(cmd[0])
+    if shellChars & set(cmd):
+        words = cmd.split()
+        return ["/bin/sh", "-c", cmd], \
+            os.path.basename(words[0]) if words else "sh"
+    args = shlex.split(cmd)
+    return args, os.path.basename(args[0])
+
+
+def pump(pipe, stream, onLine):
+    for line in iter(pipe.readline, b""):
+        onLine(line.decode(errors="replace").rstrip("\n"), stream)
+    pipe.close()
+
+
+def killGroup(process):
+    """ Stops the process and everything it started: SIGTERM to its process
+        group, SIGKILL if it is still there killGrace seconds later.
+    """
+
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(killGrace)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+
+def runCommand(cmd, cwd=None, env=None, timeout=None, onLine=None,
+               hideLogs=False, tool=None):
+    """ Runs a command, without a shell unless it needs one (see
+        commandArgs), in its own process group. At most toolLimits[tool]
+        commands of the same tool run at once in this process. Every command
+        is recorded with its duration and exit status (see commandMetrics).
+
+    Parameters:
+        cmd (str or Array<str>): Command to run.
+        cwd (str): Directory to run it in.
+        env (dict): Variables added to the environment of the command.
+        timeout (float): Seconds after which the command and everything it
+                         started are killed. None for no deadline.
+        onLine (function): If given, called with every line of output and
+                           the stream it came from ('stdout' or 'stderr').
+                           Otherwise the output goes to this process' stdout
+                           and stderr.
+        hideLogs (bool): If True (and no onLine), discard the output.
+        tool (str): Tool the command runs, for the concurrency limit. By
+                    default, the name of the executable.
+
+    Returns:
+        int: Exit code of the command, negative if killed by a signal.
+    """
+
+    args, executable = commandArgs(cmd)
+    tool = tool or executable
+    output = subprocess.DEVNULL if hideLogs is True and onLine is None \
+        else (subprocess.PIPE if onLine is not None else None)
+    timedOut = False
+    with toolSlot(tool):
+        start = time.time()
+        try:
+            process = subprocess.Popen(
+                args,
+                cwd=cwd,
+                env=None if env is None else dict(os.environ, **env),
+                stdout=output,
+                stderr=output,
+                stdin=subprocess.DEVNULL,
+                start_new_session=True) # own process group, see killGroup
+        except OSError as ex: # i.e. the executable is not installed
+            if onLine is not None:
+                onLine(str(ex), "stderr")
+            elif hideLogs is not True:
+                print(ex, file=sys.stderr)
+            exitCode = 127
+        else:
+            pumps = []
+            if onLine is not None:
+                pumps = [threading.Thread(target=pump,
+                                          args=(pipe, stream, onLine),
+                                          daemon=True)
+                         for pipe, stream in ((process.stdout, "stdout"),
+                                              (process.stderr, "stderr"))]
+                for thread in pumps:
+                    thread.start()
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                timedOut = True
+                killGroup(process)
+            except BaseException:
+                killGroup(process)
+                raise
+            finally:
+                for thread in pumps:
+                    thread.join()
+            exitCode = process.returncode
+        record(tool, "command", start, time.time(),
+               args={"command": " ".join(args)[:maxArgLength],
+                     "exitCode": exitCode,
+                     "timedOut": timedOut})
+    return exitCode
@@ -34,15 +34,19 @@ allTests = testsSharingCluster + customClustersTests
 bootstrapFailMsg = "Failed to bootstrap '%s' k8s cluster. Check 'logs' file"
 clusterCreatedMsg = "...%s CLUSTER CREATED (masterIP: %s) => STARTING TESTS\n"
 TOserviceAccountMsg = "ERROR: timed out waiting for %s cluster's service account\n"
+resourceWaitTimeout = 700 # seconds to wait for the SA and the test pods
 destroyWarning = "WARNING - destroy infrastructure (%s)? yes/no: "
 playbookPath = "src/provisionment/playbooks/bootstraper.yaml"
 aggregateLogs = False
+toolCheckTO = 60 # seconds to check that terraform and kubectl are installed
 ansibleLogs = "src/logging/ansibleLogs%s"
 
 provisionFailMsg = "Failed to provision raw VMs. Check 'logs' file for details"
 
 publicRepo = "https://eosc-testsuite.rtfd.io"
 clusters = ["shared", "dlTest", "hpcTest", "proGANTest"]
+queue = None # where tests put their (entry, cost) results
+engine = None # RunEngine of the run, see engine.py
 
 
 def initAndChecks(noTerraform,
@@ -74,10 +78,10 @@ def initAndChecks(noTerraform,
     global credentials
 
     # --------File & deps check
-    if runCMD("terraform version", hideLogs=True) != 0:
+    if runCMD("terraform version", hideLogs=True, timeout=toolCheckTO) != 0:
         print("Terraform is not installed")
         stop(1)
-    if runCMD("kubectl", hideLogs=True) != 0:
+    if runCMD("kubectl", hideLogs=True, timeout=toolCheckTO) != 0:
         print("kubectl is not installed")
         stop(1)
 
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import json
+    import time
+    import threading
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+
+class RunJournal:
+    """ Append-only journal of a run, one JSON object per line: the steps run
+        and their outcome, the clusters created and the results reported by
+        the tests. Every event is synced to disk as it is written, so the
+        journal of a run that crashed can be used to resume it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.events = loadJournal(path)
+
+    def record(self, event, name, **data):
+        """ Appends an event to the journal.
+
+        Parameters:
+            event (str): Kind of event: run, step, cluster or result.
+            name (str): What the event is about (i.e. the step name).
+            data (dict): Details of the event, must be JSON serializable.
+        """
+
+        line = {"time": round(time.time(), 3), "event": event, "name": name}
+        line.update(data)
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(line, sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.events.append(line)
+
+    def last(self, event, name):
+        """ Returns the last event of the given kind and name, None if none. """
+
+        for line in reversed(self.events):
+            if line["event"] == event and line["name"] == name:
+                return line
+        return None
+
+    def steps(self):
+        """ Returns the last status recorded for every step. """
+
+        return {line["name"]: line["status"]
+                for line in self.events if line["event"] == "step"}
+
+    def results(self):
+        """ Returns the (entry, cost, metrics) results recorded, in order. """
+
+        return [(line["entry"], line["cost"], line.get("metrics"))
+                for line in self.events if line["event"] == "result"]
+
+
+def loadJournal(path):
+    """ Reads the events of a journal.
+
+    Parameters:
+        path (str): Path to the journal file.
+
+    Returns:
+        Array<dict>: Events, empty if the journal doesn't exist. A truncated
+                     last line (run killed while writing it) is ignored.
+    """
+
+    events = []
+    if not os.path.isfile(path):
+        return events
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass
+    return events
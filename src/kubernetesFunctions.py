@@ -4,18 +4,22 @@ import sys
 try:
     import yaml
     import json
-    from kubernetes import client, config, utils
+    from kubernetes import client, config, utils, watch
     from kubernetes.stream import stream
     from kubernetes.client.rest import ApiException
-    from tempfile import NamedTemporaryFile
     import jsonschema
     import os
     import re
-    import tarfile
     from pathlib import Path
     from enum import Enum
     import contextlib
     import io
+    import time
+    import socket
+    import threading
+    from urllib3.connection import HTTPConnection
+    from urllib3.exceptions import HTTPError
+    from websocket import WebSocketException
 
 except ModuleNotFoundError as ex:
     print(ex)
@@ -23,11 +27,288 @@ except ModuleNotFoundError as ex:
 
 from aux import *
 from checker import *
+from transferFunctions import *
+from tracing import traced
 
 
 Action = Enum('Action', 'create delete cp exec')
 Type = Enum('Type', 'pod daemonset mpijob configmap pv sa')
 
+fetchBackoffStart = 2 # seconds between the first readiness checks
+fetchBackoffMax = 60 # upper bound for the readiness checks backoff
+fetchRetries = 5 # copy attempts once the result is ready on the pod
+uploadRetries = 5 # attempts to copy the script/inputs of a test to its pod
+transientErrors = (WebSocketException, HTTPError, ConnectionError, TimeoutError)
+
+apiClients = {} # kubeconfig path -> (pid, mtime, ApiClient)
+apiClientsLock = threading.Lock()
+apiClientsPoolSize = 16 # keep-alive connections per cluster
+streamClients = threading.local() # per-thread clients for exec sessions
+useInformerCache = False # serve node/pod lookups from watches (--informerCache)
+informers = {} # (kubeconfig path, kind, namespace) -> Informer
+apiCalls = {} # kubeconfig path -> requests done to the API server
+apiCallsLock = threading.Lock()
+
+
+def getApiClient(kubeconfig):
+    """ Returns the long-lived ApiClient of a cluster. Clients are kept in a
+        registry keyed by kubeconfig path, so the kubeconfig is only parsed
+        (and TLS connections established) once per cluster, and connections
+        are pooled and kept alive between calls. The client is rebuilt when
+        the kubeconfig file changes or when used from a forked process.
+
+    Parameters:
+        kubeconfig (str or ApiClient): Path to kubeconfig file. If an ApiClient
+                                       is given, it is returned as is.
+
+    Returns:
+        ApiClient: Client for the cluster the kubeconfig points to.
+    """
+
+    if isinstance(kubeconfig, client.ApiClient):
+        return kubeconfig
+
+    path = os.path.abspath(kubeconfig)
+    mtime = os.path.getmtime(path)
+    with apiClientsLock:
+        entry = apiClients.get(path)
+        if entry is None or entry[0] != os.getpid() or entry[1] != mtime:
+            configuration = client.Configuration()
+            config.load_kube_config(config_file=path,
+                                    client_configuration=configuration,
+                                    persist_config=False)
+            configuration.connection_pool_maxsize = apiClientsPoolSize
+            configuration.socket_options = \
+                HTTPConnection.default_socket_options + \
+                [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            configuration.kubeconfigPath = path # see countCalls
+            entry = (os.getpid(), mtime,
+                     countCalls(client.ApiClient(configuration)))
+            apiClients[path] = entry
+        return entry[2]
+
+
+def getStreamApi(apiClient):
+    """ Returns a CoreV1Api to be used with kubernetes.stream. stream() swaps
+        the request method of the client while the exec session is set up,
+        so sharing one client between threads isn't safe: each thread gets its
+        own client built on the (already parsed) configuration of apiClient.
+
+    Parameters:
+        apiClient (ApiClient): Client of the cluster, see getApiClient().
+
+    Returns:
+        CoreV1Api: API object for exec sessions on the cluster.
+    """
+
+    clients = streamClients.__dict__.setdefault("clients", {})
+    key = id(apiClient.configuration)
+    if key not in clients:
+        clients[key] = countCalls(client.ApiClient(apiClient.configuration))
+    return client.CoreV1Api(clients[key])
+
+
+def countCalls(apiClient):
+    """ Makes the client count the requests it does (watches and exec
+        sessions included) against the cluster of its kubeconfig.
+
+    Parameters:
+        apiClient (ApiClient): Client built by getApiClient or getStreamApi.
+
+    Returns:
+        ApiClient: The same client.
+    """
+
+    path = getattr(apiClient.configuration, "kubeconfigPath", None)
+    callApi = apiClient.call_api
+
+    def counted(*args, **kwargs):
+        with apiCallsLock:
+            apiCalls[path] = apiCalls.get(path, 0) + 1
+        return callApi(*args, **kwargs)
+
+    apiClient.call_api = counted
+    return apiClient
+
+
+def apiCallsPerCluster():
+    """ Returns the requests done to the API server of every cluster
+        (src/tests/<cluster>/config) by this process.
+    """
+
+    with apiCallsLock:
+        return {os.path.basename(os.path.dirname(path)): calls
+                for path, calls in apiCalls.items() if path is not None}
+
+
+def dropApiClient(kubeconfig):
+    """ Removes a cluster's client from the registry, i.e. after its
+        kubeconfig was rewritten or the cluster destroyed.
+
+    Parameters:
+        kubeconfig (str): Path to kubeconfig file.
+    """
+
+    path = os.path.abspath(kubeconfig)
+    with apiClientsLock:
+        apiClients.pop(path, None)
+        for key in [key for key in informers if key[0] == path]:
+            informers.pop(key).stop()
+
+
+class Informer:
+    """ Read-through cache of the nodes or pods of a cluster. A daemon thread
+        lists the objects once and then keeps the cache up to date from a
+        watch, so lookups done while polling are served from memory. Until
+        the first list completes (or while the watch is being re-established)
+        the cache is not 'synced' and lookups go to the API server.
+    """
+
+    def __init__(self, apiClient, kind, namespace):
+        self.apiClient = apiClient
+        self.kind = kind
+        self.namespace = namespace
+        self.objects = {}
+        self.lock = threading.Lock()
+        self.synced = threading.Event()
+        self.stopped = threading.Event()
+        self.watch = None
+        coreV1 = client.CoreV1Api(apiClient)
+        if kind == "nodes":
+            self.listFunction = coreV1.list_node
+            self.listArgs = ()
+        else:
+            self.listFunction = coreV1.list_namespaced_pod
+            self.listArgs = (namespace,)
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def run(self):
+        """ List + watch loop, runs on the informer's thread. """
+
+        sleepTime = fetchBackoffStart
+        while not self.stopped.is_set():
+            try:
+                items = self.listFunction(*self.listArgs)
+                with self.lock:
+                    self.objects = {o.metadata.name: o for o in items.items}
+                self.synced.set()
+                sleepTime = fetchBackoffStart
+                self.watch = watch.Watch()
+                for event in self.watch.stream(
+                        self.listFunction,
+                        *self.listArgs,
+                        resource_version=items.metadata.resource_version,
+                        timeout_seconds=300):
+                    obj = event["object"]
+                    if event["type"] == "ERROR":
+                        break # i.e. 410 Gone: list again
+                    with self.lock:
+                        if event["type"] == "DELETED":
+                            self.objects.pop(obj.metadata.name, None)
+                        else:
+                            self.objects[obj.metadata.name] = obj
+            except BaseException as ex:
+                self.synced.clear()
+                self.stopped.wait(sleepTime)
+                sleepTime = min(sleepTime * 2, fetchBackoffMax)
+
+    def stop(self):
+        """ Ends the informer's thread, once its watch returns. """
+
+        self.stopped.set()
+        self.synced.clear()
+        if self.watch is not None:
+            self.watch.stop()
+
+    def get(self, name):
+        with self.lock:
+            return self.objects.get(name)
+
+    def list(self):
+        with self.lock:
+            return list(self.objects.values())
+
+
+def getInformer(kubeconfig, kind, namespace="default"):
+    """ Returns the informer for the given cluster and kind, starting it if
+        needed. Returns None if the informer cache is disabled or not synced
+        yet, in which case callers must ask the API server. Informers are
+        kept per kubeconfig: when the client of the cluster is rebuilt (see
+        getApiClient), its informer is replaced.
+
+    Parameters:
+        kubeconfig (str or ApiClient): Kubeconfig file or client of the cluster.
+        kind (str): One of 'nodes' or 'pods'.
+        namespace (str): Namespace of the pods.
+
+    Returns:
+        Informer: Synced informer or None.
+    """
+
+    if useInformerCache is not True:
+        return None
+    apiClient = getApiClient(kubeconfig)
+    path = getattr(apiClient.configuration, "kubeconfigPath", None)
+    key = (path or id(apiClient), kind, namespace)
+    with apiClientsLock:
+        informer = informers.get(key)
+        if informer is None or informer.apiClient is not apiClient:
+            if informer is not None:
+                informer.stop()
+            informer = Informer(apiClient, kind, namespace)
+            informers[key] = informer
+    if informer.synced.is_set():
+        return informer
+    return None
+
+
+def getPod(podName, kubeconfig, namespace=None):
+    """ Gets a pod from the informer cache if enabled, from the API otherwise
+        or if it is not in the cache (it may have been created just now).
+
+    Parameters:
+        podName (str): Pod name.
+        kubeconfig (str or ApiClient): Kubeconfig file or client of the cluster.
+        namespace (str): Namespace of the pod.
+
+    Returns:
+        V1Pod: The pod, None if it doesn't exist.
+    """
+
+    if namespace is None:
+        namespace = "default"
+    informer = getInformer(kubeconfig, "pods", namespace)
+    if informer is not None:
+        pod = informer.get(podName)
+        if pod is not None:
+            return pod
+    try:
+        return client.CoreV1Api(getApiClient(kubeconfig)).read_namespaced_pod(
+            podName, namespace)
+    except ApiException as ex:
+        if ex.status == 404:
+            return None
+        raise
+
+
+def listNodes(kubeconfig, timeout=None):
+    """ Lists the nodes of a cluster, from the informer cache if enabled.
+
+    Parameters:
+        kubeconfig (str or ApiClient): Kubeconfig file or client of the cluster.
+        timeout (int): Request timeout in seconds.
+
+    Returns:
+        Array<V1Node>: Nodes of the cluster.
+    """
+
+    informer = getInformer(kubeconfig, "nodes")
+    if informer is not None:
+        return informer.list()
+    return client.CoreV1Api(getApiClient(kubeconfig)).list_node(
+        _request_timeout=timeout).items
+
 
 def checkCluster(test):
     """ Returns True if the cluster is reachable
@@ -39,11 +320,11 @@ def checkCluster(test):
         bool: True in case the cluster is reachable. False otherwise
     """
 
-    cmd = 'get nodes'
-    opts = '--request-timeout=10s'
     kubeconfig = "src/tests/%s/config" % (test)
 
-    if kubectlCLI(cmd, options=opts, kubeconfig=kubeconfig, hideLogs=True) != 0:
+    try:
+        listNodes(kubeconfig, timeout=10)
+    except BaseException:
         writeToFile(
             "src/logging/%s" % test,
             "%s cluster not reachable, was infrastructure created?" % test,
@@ -66,8 +347,11 @@ def checkPodAlive(podName, resDir, toLog, resultFile, kubeconfig):
         bool: True in case the pod is alive, False otherwise
     """
 
-    cmd = "get pod %s" % podName
-    if kubectlCLI(cmd, kubeconfig=kubeconfig, hideLogs=True) != 0:
+    try:
+        pod = getPod(podName, kubeconfig)
+    except BaseException:
+        pod = None
+    if pod is None:
         writeFail(resDir,
                   resultFile,
                   "%s pod was destroyed (did not fetch %s)" % (podName,resultFile),
@@ -76,63 +360,359 @@ def checkPodAlive(podName, resDir, toLog, resultFile, kubeconfig):
     return True
 
 
-def waitForResource(resourceName, resourceType, kubeconfig, retrials=None, sleepTime=None):
-    """ Waits until the given resource is deployed, i.e. visible by kubectl. If
-        after a specific number of retrials this does not happen, returns False.
+def listFunction(resourceType, apiClient, namespace):
+    """ Returns the API list function (and its positional arguments) for a
+        resource type, as required to list or watch resources of that type.
+
+    Parameters:
+        resourceType (Type): Resource type.
+        apiClient (ApiClient): Client of the cluster, see getApiClient().
+        namespace (str): Namespace of the resources.
+
+    Returns:
+        function: The list function.
+        tuple: Its positional arguments.
+    """
+
+    if resourceType is Type.pod:
+        return client.CoreV1Api(apiClient).list_namespaced_pod, (namespace,)
+    elif resourceType is Type.daemonset:
+        return client.AppsV1Api(apiClient).list_namespaced_daemon_set, (namespace,)
+    elif resourceType is Type.mpijob:
+        return client.CustomObjectsApi(apiClient).list_namespaced_custom_object, \
+            ('kubeflow.org', 'v1alpha2', namespace, 'mpijobs')
+    elif resourceType is Type.configmap:
+        return client.CoreV1Api(apiClient).list_namespaced_config_map, (namespace,)
+    elif resourceType is Type.pv:
+        return client.CoreV1Api(apiClient).list_persistent_volume, ()
+    elif resourceType is Type.sa:
+        return client.CoreV1Api(apiClient).list_namespaced_service_account, (namespace,)
+
+
+def resourceStatus(resource):
+    """ Returns the phase and the conditions (type -> status) of a resource,
+        which can be an API object or a dict (custom objects).
+
+    Parameters:
+        resource (object): The resource.
+
+    Returns:
+        str: Phase, None if the resource has no phase.
+        dict: Condition type -> condition status.
+    """
+
+    if isinstance(resource, dict):
+        status = resource.get("status") or {}
+        conditions = status.get("conditions") or []
+        return status.get("phase"), \
+            {c.get("type"): c.get("status") for c in conditions}
+    status = getattr(resource, "status", None)
+    phase = getattr(status, "phase", None)
+    conditions = getattr(status, "conditions", None) or []
+    return phase, {c.type: c.status for c in conditions}
+
+
+def resourceReached(resource, phase=None, condition=None):
+    """ Checks whether a resource is in the given phase and/or has the given
+        condition set to True. Raises ValueError if the resource is in a
+        terminal phase (Succeeded or Failed) other than the expected one.
+
+    Parameters:
+        resource (object): The resource, None if it doesn't exist.
+        phase (str): Expected phase, i.e. 'Running' or 'Succeeded'.
+        condition (str): Expected condition, i.e. 'Ready'.
+
+    Returns:
+        bool: True if the resource exists and reached phase and condition.
+    """
+
+    if resource is None:
+        return False
+    currentPhase, conditions = resourceStatus(resource)
+    if phase is not None and currentPhase != phase:
+        if currentPhase in ("Succeeded", "Failed"):
+            raise ValueError("resource is %s" % currentPhase)
+        return False
+    if condition is not None and conditions.get(condition) != "True":
+        return False
+    return True
+
+
+@traced("k8s", label="resourceName")
+def waitForResource(resourceName,
+                    resourceType,
+                    kubeconfig,
+                    retrials=None,
+                    sleepTime=None,
+                    deadline=None,
+                    phase=None,
+                    condition=None,
+                    namespace=None):
+    """ Waits until the given resource exists and, if given, reaches phase
+        and/or condition. Watches the resource, so it returns as soon as the
+        API server reports it. If this doesn't happen before the deadline,
+        returns False.
 
     Parameters:
         resourceName (str): Resource name.
-        resourceType (str): Resource type.
+        resourceType (Type): Resource type.
         kubeconfig (str): Path to kubeconfig file of the being managed cluster.
-        retrials (int): Number of retrials.
-        sleepTime (int): Sleep time in seconds between retrials.
+        retrials (int): Deprecated, deadline is now + retrials * sleepTime.
+        sleepTime (int): Deprecated, see retrials.
+        deadline (float): Absolute time (epoch seconds) to wait until.
+        phase (str): Phase to wait for, i.e. 'Running' or 'Succeeded'.
+        condition (str): Condition to wait for, i.e. 'Ready'.
+        namespace (str): Namespace of the resource.
 
     Returns:
-        bool: True in case the resource is present, False otherwise
+        float: Timestamp at which the resource was seen ready. False in case
+               the deadline passed (or the resource ended in another phase).
     """
 
-    if retrials is None:
-        retrials = 2
-    if sleepTime is None:
-        sleepTime = 2
-    for i in range(retrials):
-        cmd = "get %s %s" % (resourceType.name, resourceName)
-        if kubectlCLI(cmd, kubeconfig=kubeconfig, hideLogs=True) == 0:
-            return True
-        print("Rsource of type '%s' with name '%s' not ready yet..." % (resourceType, resourceName))
-        time.sleep(sleepTime)
+    if deadline is None:
+        deadline = time.time() + (retrials or 2) * (sleepTime or 2)
+    if namespace is None:
+        namespace = "default"
+    selector = "metadata.name=%s" % resourceName
+    sleepTime = 1
+
+    while time.time() < deadline:
+        try:
+            function, args = listFunction(resourceType,
+                                          getApiClient(kubeconfig),
+                                          namespace)
+            found = function(*args, field_selector=selector)
+            if isinstance(found, dict):
+                items = found.get("items") or []
+                resourceVersion = found["metadata"]["resourceVersion"]
+            else:
+                items = found.items
+                resourceVersion = found.metadata.resource_version
+            if items and resourceReached(items[0], phase, condition):
+                return time.time()
+            remaining = int(deadline - time.time())
+            if remaining <= 0:
+                break
+            w = watch.Watch()
+            for event in w.stream(function,
+                                  *args,
+                                  field_selector=selector,
+                                  resource_version=resourceVersion,
+                                  timeout_seconds=remaining,
+                                  _request_timeout=remaining + 10):
+                if event["type"] == "ERROR":
+                    break # i.e. 410 Gone: list again
+                if event["type"] != "DELETED" and \
+                        resourceReached(event["object"], phase, condition):
+                    w.stop()
+                    return time.time()
+            sleepTime = 1
+        except ValueError as ex:
+            print("Resource of type '%s' with name '%s' will not be ready: %s" %
+                  (resourceType.name, resourceName, ex))
+            return False
+        except BaseException as ex: # API not reachable yet: back off
+            print("Resource of type '%s' with name '%s' not ready yet..." %
+                  (resourceType.name, resourceName))
+            time.sleep(max(0, min(sleepTime, deadline - time.time())))
+            sleepTime = min(sleepTime * 2, fetchBackoffMax)
     return False
 
 
-def waitForPod(podName, kubeconfig, retrials=None, sleepTime=None):
-    """ Waits until the given pod is deployed, i.e. visible by kubectl. If
-        after a specific number of retrials this does not happen, returns False.
+def waitForPod(podName,
+               kubeconfig,
+               retrials=None,
+               sleepTime=None,
+               deadline=None,
+               phase=None,
+               condition=None):
+    """ Waits until the given pod exists and, if given, reaches phase and/or
+        condition. See waitForResource.
 
     Parameters:
         podName (str): Pod name.
         kubeconfig (str): Path to kubeconfig file of the being managed cluster.
-        retrials (int): Number of retrials.
-        sleepTime (int): Sleep time in seconds between retrials.
+        retrials (int): Deprecated, deadline is now + retrials * sleepTime.
+        sleepTime (int): Deprecated, see retrials.
+        deadline (float): Absolute time (epoch seconds) to wait until.
+        phase (str): Phase to wait for, i.e. 'Running' or 'Succeeded'.
+        condition (str): Condition to wait for, i.e. 'Ready'.
 
     Returns:
-        bool: True in case the pod was deployed, False otherwise
+        float: Timestamp at which the pod was seen ready, False otherwise.
     """
 
-    if retrials is None:
-        retrials = 2
-    if sleepTime is None:
-        sleepTime = 2
-    for i in range(retrials):
-        cmd = "get pod %s" % podName
-        if kubectlCLI(cmd, kubeconfig=kubeconfig, hideLogs=True) == 0:
+    return waitForResource(podName,
+                           Type.pod,
+                           kubeconfig,
+                           retrials=retrials,
+                           sleepTime=sleepTime,
+                           deadline=deadline,
+                           phase=phase,
+                           condition=condition)
+
+
+def newFetchStats():
+    """ Returns the counters used to account for the work done while fetching
+        results: readiness polls, execs on the pod, pod events received from
+        the watch, copy retries and bytes and seconds spent copying.
+
+    Returns:
+        dict: Counters, all set to 0.
+    """
+
+    return {"polls": 0,
+            "execs": 0,
+            "events": 0,
+            "retries": 0,
+            "bytes": 0,
+            "seconds": 0}
+
+
+def podTerminated(pod):
+    """ Checks whether all the containers of a pod are terminated, in which
+        case nothing can be run on (or copied from) it anymore.
+
+    Parameters:
+        pod (V1Pod): Pod object as returned by the API.
+
+    Returns:
+        bool: True in case no container of the pod can be exec'd anymore.
+    """
+
+    if pod.status.phase in ("Succeeded", "Failed"):
+        return True
+    statuses = pod.status.container_statuses or []
+    if not statuses:
+        return False
+    for status in statuses:
+        if status.state is None or status.state.terminated is None:
+            return False
+    return True
+
+
+def podReadyByProbe(pod):
+    """ Checks whether the pod declares a readiness probe and reports Ready.
+        Test pods can use a probe on their results file as completion signal,
+        which avoids exec'ing into them to check for it.
+
+    Parameters:
+        pod (V1Pod): Pod object as returned by the API.
+
+    Returns:
+        bool: True in case the pod has a readiness probe and it passed.
+    """
+
+    if not any(c.readiness_probe for c in pod.spec.containers):
+        return False
+    for condition in pod.status.conditions or []:
+        if condition.type == "Ready" and condition.status == "True":
             return True
-        print("Pod %s not ready yet..." % podName)
-        time.sleep(sleepTime)
     return False
 
 
-def fetchResults(resDir, kubeconfig, podName, source, file, toLog):
-    """ Fetch tests results file from pod.
+def waitForPodEvent(coreV1, podName, namespace, resourceVersion, timeout, stats):
+    """ Blocks until the pod changes (any event newer than resourceVersion) or
+        the timeout expires, whatever happens first. If the watch can't be
+        used, sleeps for the whole timeout (plain backoff).
+
+    Parameters:
+        coreV1 (CoreV1Api): API object to use.
+        podName (str): Pod name.
+        namespace (str): Namespace of the pod.
+        resourceVersion (str): Only events newer than this one wake us up.
+        timeout (int): Maximum time to block, in seconds.
+        stats (dict): Fetch counters, see newFetchStats().
+    """
+
+    start = time.time()
+    w = watch.Watch()
+    try:
+        for event in w.stream(coreV1.list_namespaced_pod,
+                              namespace,
+                              field_selector="metadata.name=%s" % podName,
+                              resource_version=resourceVersion,
+                              timeout_seconds=int(timeout),
+                              _request_timeout=int(timeout) + 10):
+            stats["events"] += 1
+            w.stop()
+            return
+    except BaseException as ex:
+        print("Watch on pod %s failed, backing off: %s" % (podName, ex))
+    remaining = timeout - (time.time() - start)
+    if remaining > 0: # watch closed early: do not poll faster than backoff
+        time.sleep(remaining)
+
+
+def waitForResultOnPod(podName, pathOnPod, kubeconfig, stats, namespace=None,
+                       doneMarker=None):
+    """ Blocks until the results file is ready on the pod. Readiness is given
+        by the pod's readiness probe (if any) or by the done-marker file (by
+        default the results file itself) being present and not empty. Between
+        checks, waits on a watch of the pod -so container terminations or
+        condition changes are seen immediately- with exponential backoff.
+
+    Parameters:
+        podName (str): Pod name.
+        pathOnPod (str or Array<str>): Location of the results file(s) on
+                                       the pod.
+        kubeconfig (str or ApiClient): Kubeconfig file or client of the cluster.
+        stats (dict): Fetch counters, see newFetchStats().
+        namespace (str): Namespace of the pod.
+        doneMarker (str): File on the pod signaling the results are complete.
+
+    Returns:
+        bool: True when the results are ready, False if they never will be
+              (pod deleted or all its containers terminated).
+    """
+
+    if namespace is None:
+        namespace = "default"
+    if doneMarker is None:
+        doneMarker = pathOnPod
+    if isinstance(doneMarker, str):
+        doneMarker = [doneMarker]
+    checkCMD = " && ".join("test -s %s" % marker for marker in doneMarker)
+    coreV1 = client.CoreV1Api(getApiClient(kubeconfig))
+    sleepTime = fetchBackoffStart
+
+    while True:
+        stats["polls"] += 1
+        try:
+            pod = getPod(podName, kubeconfig, namespace=namespace)
+            if pod is None:
+                return False
+        except BaseException:
+            pod = None # transient API error: retry after backoff
+        if pod is not None:
+            if podTerminated(pod):
+                return False
+            if podReadyByProbe(pod):
+                return True
+            if pod.status.phase == "Running":
+                stats["execs"] += 1
+                if kubectl(Action.exec,
+                           kubeconfig,
+                           name=podName,
+                           cmd=checkCMD,
+                           namespace=namespace) == 0:
+                    return True
+            waitForPodEvent(coreV1,
+                            podName,
+                            namespace,
+                            pod.metadata.resource_version,
+                            sleepTime,
+                            stats)
+        else:
+            time.sleep(sleepTime)
+        sleepTime = min(sleepTime * 2, fetchBackoffMax)
+
+
+@traced("fetch", label="podName")
+def fetchResults(resDir, kubeconfig, podName, source, file, toLog,
+                 doneMarker=None, stats=None):
+    """ Fetch tests results file from pod. Blocks until the file is ready on
+        the pod (see waitForResultOnPod) and then copies it.
 
     Parameters:
         resDir (str): Path to the results dir for the current run.
@@ -141,20 +721,171 @@ def fetchResults(resDir, kubeconfig, podName, source, file, toLog):
         source (str): Location of the results file on the pod.
         file (str): Name to be given to the file.
         toLog (str): Path to the log file to which logs have to be sent
+        doneMarker (str): File on the pod signaling the results are complete.
+        stats (dict): Fetch counters to update, see newFetchStats().
+
+    Returns:
+        dict: Fetch counters, see newFetchStats().
     """
 
-    source = "%s:%s" % (podName,source)
-    while os.path.exists(resDir + "/" + file) is False:
-        if checkPodAlive(podName,
-                         resDir,
-                         toLog,
-                         file,
-                         kubeconfig) is False: return
-        with contextlib.redirect_stdout(io.StringIO()):  # to hide logs
-            print("Fetching results...")
-            kubectl(Action.cp, kubeconfig, podPath=source, localPath="%s/%s" %
-                    (resDir, file), fetch=True)
-    writeToFile(toLog, file + " fetched!", True)
+    if stats is None:
+        stats = newFetchStats()
+    destination = "%s/%s" % (resDir, file)
+
+    if waitForResultOnPod(podName,
+                          source,
+                          kubeconfig,
+                          stats,
+                          doneMarker=doneMarker) is False:
+        writeFail(resDir,
+                  file,
+                  "%s pod was destroyed (did not fetch %s)" % (podName, file),
+                  toLog)
+        return stats
+
+    sleepTime = fetchBackoffStart
+    for attempt in range(fetchRetries):
+        copyStats = {}
+        kubectl(Action.cp,
+                kubeconfig,
+                podPath="%s:%s" % (podName, source),
+                localPath=destination,
+                fetch=True,
+                toLog=toLog,
+                stats=copyStats)
+        if os.path.exists(destination):
+            stats["bytes"] += copyStats["bytes"]
+            stats["seconds"] += copyStats["seconds"]
+            writeToFile(toLog,
+                        "%s fetched! (%.2f MB at %.2f MB/s, polls: %s, execs: %s)" %
+                        (file,
+                         copyStats["bytes"] / 1024 / 1024,
+                         copyStats["throughput"],
+                         stats["polls"],
+                         stats["execs"]),
+                        True)
+            return stats
+        stats["retries"] += 1
+        time.sleep(sleepTime)
+        sleepTime = min(sleepTime * 2, fetchBackoffMax)
+
+    writeFail(resDir,
+              file,
+              "Failed to copy %s from pod %s" % (file, podName),
+              toLog)
+    return stats
+
+
+@traced("fetch", label="podName")
+def fetchResultsBatch(resDir, kubeconfig, podName, files, toLog,
+                      doneMarker=None, stats=None, slot=None, resumable=None):
+    """ Fetch several results files from a pod in a single tar session. Blocks
+        until all of them are ready on the pod (see waitForResultOnPod), then
+        streams them to resDir, retrying only the ones that failed.
+
+    Parameters:
+        resDir (str): Path to the results dir for the current run.
+        kubeconfig (str): Path to kubeconfig file of the being managed cluster.
+        podName (str): Pod name.
+        files (Array<tuple>): (location on the pod, name to be given to the
+                              file) pairs.
+        toLog (str): Path to the log file to which logs have to be sent
+        doneMarker (str): File on the pod signaling the results are complete.
+        stats (dict): Fetch counters to update, see newFetchStats().
+        slot (function): Given the kubeconfig, returns a context manager held
+                         while copying. Used to bound parallel copies.
+        resumable (Array<str>): Locations on the pod of (big) files to be
+                                fetched in byte ranges: if the transfer drops,
+                                the next attempt resumes where it stopped.
+
+    Returns:
+        dict: Fetch counters, see newFetchStats(). Its 'files' object holds
+              the bytes, seconds and SHA-256 of each fetched file.
+    """
+
+    if stats is None:
+        stats = newFetchStats()
+    stats.setdefault("files", {})
+    pending = {source: "%s/%s" % (resDir, file) for source, file in files}
+
+    if waitForResultOnPod(podName,
+                          list(pending),
+                          kubeconfig,
+                          stats,
+                          doneMarker=doneMarker) is False:
+        for source, file in files:
+            writeFail(resDir,
+                      file,
+                      "%s pod was destroyed (did not fetch %s)" % (podName, file),
+                      toLog)
+        return stats
+
+    if slot is None:
+        slot = lambda kubeconfig: contextlib.nullcontext()
+    if resumable is None:
+        resumable = []
+    sleepTime = fetchBackoffStart
+    for attempt in range(fetchRetries):
+        copyStats = {"files": {}}
+        res = {}
+        copyStart = None
+        try:
+            with slot(kubeconfig):
+                copyStart = time.time()
+                coreV1 = getStreamApi(getApiClient(kubeconfig))
+                streamed = {source: destination
+                            for source, destination in pending.items()
+                            if source not in resumable}
+                if streamed:
+                    res = copyManyFromPod(coreV1,
+                                          podName,
+                                          "default",
+                                          streamed,
+                                          stats=copyStats)
+                for source in pending:
+                    if source in resumable:
+                        rangeStats = {}
+                        res[source] = copyRangesFromPod(coreV1,
+                                                        podName,
+                                                        "default",
+                                                        source,
+                                                        pending[source],
+                                                        stats=rangeStats)
+                        if res[source] is True:
+                            copyStats["files"][source] = rangeStats
+        except transientErrors as ex: # i.e. the exec websocket dropped
+            print("Fetching results from %s failed: %s" % (podName, ex))
+        except BaseException as ex:
+            print("Fetching results from %s failed: %s" % (podName, ex))
+            break
+        finally:
+            # once per attempt: the seconds of each file count from the
+            # start of the session
+            if copyStart is not None:
+                stats["seconds"] += round(time.time() - copyStart, 3)
+        for fileStats in copyStats["files"].values():
+            stats["bytes"] += fileStats["bytes"]
+        for source, fileStats in copyStats["files"].items():
+            file = os.path.basename(pending[source])
+            stats["files"][file] = fileStats
+            writeToFile(toLog, "%s fetched! (%.2f MB in %.1fs)" %
+                        (file, fileStats["bytes"] / 1024 / 1024,
+                         fileStats["seconds"]), True)
+        for source, done in res.items():
+            if done is True:
+                pending.pop(source)
+        if not pending:
+            return stats
+        stats["retries"] += 1
+        time.sleep(sleepTime)
+        sleepTime = min(sleepTime * 2, fetchBackoffMax)
+
+    for source, destination in pending.items():
+        writeFail(resDir,
+                  os.path.basename(destination),
+                  "Failed to copy %s from pod %s" % (source, podName),
+                  toLog)
+    return stats
 
 
 def copyToPodAndRun(
@@ -166,7 +897,9 @@ def copyToPodAndRun(
         localPath,
         cmd,
         resultFile,
-        resultOnPod):
+        resultOnPod,
+        fetch=True,
+        stats=None):
     """ Copy from local FS to pod, run and fetch results.
 
     Parameters:
@@ -179,34 +912,65 @@ def copyToPodAndRun(
         cmd (str): Command to be run.
         resultFile (str): Name of the results file for the current test.
         resultOnPod (str): Path to the result file on the pod.
+        fetch (bool): If False, do not fetch the results after running.
+        stats (dict): If given, filled with the upload counters (see
+                      uploadToPod) and the upload retries.
+
+    Returns:
+        dict: Fetch counters (see newFetchStats) or None if the run failed.
+              If fetch is False, True if the script ran, None otherwise.
     """
 
-    with contextlib.redirect_stdout(io.StringIO()):  # to hide logs
-        while True:
-            if checkPodAlive(podName,
-                             resDir,
-                             toLog,
-                             resultFile,
-                             kubeconfig) is False: return
-            if kubectl(Action.cp,
-                      kubeconfig,
-                      podPath=podPath,
-                      localPath=localPath,
-                      fetch=False) == 0:
-                break
+    sleepTime = fetchBackoffStart
+    for attempt in range(uploadRetries):
+        if checkPodAlive(podName,
+                         resDir,
+                         toLog,
+                         resultFile,
+                         kubeconfig) is False: return
+        uploadStats = {}
+        if kubectl(Action.cp,
+                   kubeconfig,
+                   podPath=podPath,
+                   localPath=localPath,
+                   fetch=False,
+                   toLog=toLog,
+                   stats=uploadStats) == 0:
+            if stats is not None:
+                stats.update(uploadStats, retries=attempt)
+            break
+        time.sleep(sleepTime)
+        sleepTime = min(sleepTime * 2, fetchBackoffMax)
+    else:
+        writeFail(resDir,
+                  resultFile,
+                  "Error copying %s to pod %s" % (localPath, podName),
+                  toLog)
+        return
+    if uploadStats.get("sent") == 0:
+        writeToFile(toLog, "%s already on pod %s, not sent" %
+                    (os.path.basename(localPath), podName), True)
     if kubectl(Action.exec, kubeconfig, name=podName, cmd=cmd) != 0:
         writeFail(resDir,
                   resultFile,
                   "Error running script test on pod %s" % podName,
                   toLog)
+    elif fetch is False:
+        return True
     else:
-        fetchResults(resDir,kubeconfig,podName,resultOnPod,resultFile,toLog)
+        return fetchResults(resDir,
+                            kubeconfig,
+                            podName,
+                            resultOnPod,
+                            resultFile,
+                            toLog)
 
 
-def checkDestinationIsDir(podName, pathOnPod, namespace=None):
+def checkDestinationIsDir(apiClient, podName, pathOnPod, namespace=None):
     """ Checks -in the case of copy to pod- if the destination is a directory.
 
     Parameters:
+        apiClient (ApiClient): Client of the cluster, see getApiClient().
         podName (str): Name of the pod to which the file has to be sent
         pathOnPod (str): Path within the pod to locate the file
         namespace (str): Kubernetes namespace where the pod is deployed
@@ -219,7 +983,7 @@ def checkDestinationIsDir(podName, pathOnPod, namespace=None):
         namespace = "default"
     cmd = "test -d %s ; echo $?" % pathOnPod
     resp = stream(
-        client.CoreV1Api().connect_get_namespaced_pod_exec,
+        getStreamApi(apiClient).connect_get_namespaced_pod_exec,
         podName,
         namespace,
         command=[
@@ -235,21 +999,7 @@ def checkDestinationIsDir(podName, pathOnPod, namespace=None):
     return True
 
 
-def reset(tarinfo):
-    """ Resets tar file's user related metadata (uid and name).
-
-    Parameters:
-        tarinfo (TarInfo): TarInfo object.
-
-    Returns:
-        TarInfo: returns the modified TarInfo object received.
-    """
-
-    tarinfo.uid = tarinfo.gid = 0
-    tarinfo.uname = tarinfo.gname = "root"
-    return tarinfo
-
-
+@traced("k8s", label="action")
 def kubectl(
         action,
         kubeconfig,
@@ -262,7 +1012,9 @@ def kubectl(
         localPath=None,
         fetch=None,
         toLog=None,
-        ignoreErr=None):
+        ignoreErr=None,
+        compress=None,
+        stats=None):
     """ Manage stuff on a Kubernetes cluster.
 
     Parameters:
@@ -271,27 +1023,31 @@ def kubectl(
         name (str): Resource name.
         file (str): YAML defining the resource to create in case of 'create'.
         cmd (str): Command to be run in case of 'exec'.
-        kubeconfig (str): Path to kubeconfig file of the being managed cluster.
+        kubeconfig (str or ApiClient): Kubeconfig file or client of the
+                                       being managed cluster.
         namespace (str): Namespace on which to carry the action.
         podPath (str): Pod path in case of 'cp'
         localPath (str): Local path in case of 'cp'
         fetch (bool): True indicates copy from pod to local, False vice versa.
         toLog (str): Path to the log file to which logs have to be sent
         ignoreErr (bool): If True, catch exception and continue (if errors)
+        compress (bool): If True, 'cp' gzips the stream while transferring.
+        stats (dict): If given, 'cp' fills it with the size, duration,
+                      throughput (MB/s) and SHA-256 of the transfer.
 
     Returns:
         int: 0 for success, 1 for failure
     """
 
     res = True
-    config.load_kube_config(config_file=kubeconfig)
+    apiClient = getApiClient(kubeconfig)
 
     if namespace is None:
         namespace = "default"
 
     if action is Action.create:
         try:
-            utils.create_from_yaml(client.api_client.ApiClient(), file)
+            utils.create_from_yaml(apiClient, file)
             if toLog:
                 writeToFile(toLog, "Created resource from file '%s'" %
                             file, True)
@@ -299,7 +1055,7 @@ def kubectl(
             with open(file, 'r') as inputfile:
                 body = yaml.load(inputfile, Loader=yaml.FullLoader)
             try:
-                client.CustomObjectsApi().create_namespaced_custom_object(
+                client.CustomObjectsApi(apiClient).create_namespaced_custom_object(
                     'kubeflow.org',
                     'v1alpha2',
                     namespace,
@@ -322,14 +1078,14 @@ def kubectl(
     elif action is Action.delete:
         try:
             if type is Type.pod:
-                client.CoreV1Api().delete_namespaced_pod(
+                client.CoreV1Api(apiClient).delete_namespaced_pod(
                     name=name, namespace=namespace)
             elif type is Type.daemonset:
-                client.AppsV1Api().delete_namespaced_daemon_set(
+                client.AppsV1Api(apiClient).delete_namespaced_daemon_set(
                     name=name, namespace=namespace)
             elif type is Type.mpijob:
                 try:
-                    client.CustomObjectsApi().delete_namespaced_custom_object(
+                    client.CustomObjectsApi(apiClient).delete_namespaced_custom_object(
                         'kubeflow.org',
                         'v1alpha2',
                         namespace,
@@ -340,10 +1096,10 @@ def kubectl(
                     print(ex)
                     res = False
             elif type is Type.configmap:
-                client.CoreV1Api().delete_namespaced_config_map(
+                client.CoreV1Api(apiClient).delete_namespaced_config_map(
                     name=name, namespace=namespace)
             elif type is Type.pv:
-                client.CoreV1Api().delete_persistent_volume(name=name)
+                client.CoreV1Api(apiClient).delete_persistent_volume(name=name)
         except BaseException:
             res = False
 
@@ -352,7 +1108,7 @@ def kubectl(
             # w/a to get the exit code
             cmd = "(%s) &> /dev/null ; echo $?" % cmd
             resp = stream(
-                client.CoreV1Api().connect_get_namespaced_pod_exec,
+                getStreamApi(apiClient).connect_get_namespaced_pod_exec,
                 name,
                 namespace,
                 command=[
@@ -382,65 +1138,35 @@ def kubectl(
         localPath = re.sub("[/]$", "", localPath)
 
         try:
-            with NamedTemporaryFile() as tarBuffer:
-                if fetch:
-                    # copy from pod: compress on pod
-                    execCommand = ['tar', 'cf', '-', pathOnPod]
+            coreV1 = getStreamApi(apiClient)
+            if fetch:
+                res = copyFromPod(coreV1,
+                                  podName,
+                                  namespace,
+                                  pathOnPod,
+                                  localPath,
+                                  compress=compress is True,
+                                  stats=stats)
+            else:
+                if checkDestinationIsDir(apiClient, podName, pathOnPod) is False:
+                    fileNameOnDest = pathOnPod.split('/')[-1]
+                    pathOnPod = os.path.dirname(pathOnPod)
                 else:
-                    if checkDestinationIsDir(podName, pathOnPod) is False:
-                        fileNameOnDest = pathOnPod.split('/')[-1]
-                        pathOnPod = os.path.dirname(pathOnPod)
-                    else:
-                        fileNameOnDest = Path(localPath).name
-                    # copy to pod: extract on pod
-                    execCommand = ['tar', 'xf', '-', '-C', pathOnPod]
-
-                    with tarfile.open(fileobj=tarBuffer, mode='w') as tar:
-                        tar.add(localPath, arcname=fileNameOnDest, filter=reset)
-                    tarBuffer.seek(0)
-                    commands = [tarBuffer.read()]
-
-                resp = stream(
-                    client.CoreV1Api().connect_get_namespaced_pod_exec,
-                    podName,
-                    namespace,
-                    command=execCommand,
-                    stderr=True,
-                    stdin=True,
-                    stdout=True,
-                    tty=False,
-                    _preload_content=False)
-
-                while resp.is_open():
-                    resp.update(timeout=1)
-                    if resp.peek_stdout():
-                        if fetch:
-                            tarBuffer.write(resp.read_stdout().encode())
-                        else:
-                            print("STDOUT: %s" % resp.read_stdout())
-                    if not fetch and commands:
-                        resp.write_stdin(commands.pop(0).decode())
-                resp.close()
-
-                tarBuffer.flush()
-                tarBuffer.seek(0)
-
-                if fetch:
-                    tar = tarfile.open(tarBuffer.name)
-                    try:
-                        member = tar.getmembers()[0]
-                        member.name = os.path.basename(member.name)
-                        # check if localPath is a locally existing directory.
-                        if os.path.isdir(localPath) is False:
-                            member.name = os.path.basename(localPath)
-                            localPath = os.path.dirname(localPath)
-                        tar.extract(member, localPath)
-                        tar.close()
-                    except IndexError as e:  # File not found
-                        print(e)
-                        res = False
+                    fileNameOnDest = Path(localPath).name
+                res = uploadToPod(coreV1,
+                                  podName,
+                                  namespace,
+                                  localPath,
+                                  pathOnPod,
+                                  fileNameOnDest,
+                                  compress=compress is True,
+                                  stats=stats)
         except BaseException as e:
-            print(e)
+            if toLog:
+                writeToFile(toLog, "Copy of %s failed: %s" % (podPath, e),
+                            True)
+            else:
+                print(e)
             res = False
 
     return 0 if res is True else 1
@@ -475,17 +1201,16 @@ def getGpusPerNode(kubeconfig):
         Integer: Number of GPUs each node has.
     """
 
-    cmd = "get nodes"
-    options = "-ojson | jq '.items[0].status.allocatable.\"nvidia.com/gpu\"'"
     gpusPerNode = 0
     tries = 60
     while gpusPerNode == 0 and tries != 0:
         time.sleep(2)
-        kubectlResponse = kubectlCLI(cmd, kubeconfig, options=options, read=True) # "kubectl get nodes -ojson | jq '.items[0].status.allocatable.\"nvidia.com/gpu\"'"
-        print("From kubectl: %s" % str(kubectlResponse))
         try:
-            gpusPerNode = int(kubectlResponse.replace("\"",""))
-        except ValueError:
+            nodes = listNodes(kubeconfig)
+            allocatable = nodes[0].status.allocatable or {}
+            gpusPerNode = int(allocatable.get("nvidia.com/gpu", 0))
+        except BaseException as ex:
+            print("Could not get the allocatable GPUs: %s" % ex)
             gpusPerNode = 0
         print("End of attempt %s: %s" % (tries, str(gpusPerNode)))
         tries -= 1
@@ -507,4 +1232,6 @@ def updateKubeconfig(masterIP, kubeconfig):
     address = "https://%s:6443"
     kubeconfigContent["clusters"][0]["cluster"]["server"] = address % masterIP
 
-    yaml.dump(kubeconfigContent, open(kubeconfig, 'w'))
+    with open(kubeconfig, 'w') as outfile:
+        yaml.dump(kubeconfigContent, outfile)
+    dropApiClient(kubeconfig)
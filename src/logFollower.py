@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import time
+    import threading
+    from collections import deque
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from aux import *
+from kubernetesFunctions import *
+
+
+logChunkSize = 64 * 1024 # bytes read from a log stream at once
+livenessWindow = 60 # seconds over which the output rates are computed
+logSilenceWarning = 900 # seconds without output before warning on the log
+reconnectSleep = 2 # seconds between reconnections to a log stream
+
+
+class ContainerLog:
+    """ Follows the log of a container of a pod into a file. Log chunks are
+        written as they arrive, so memory does not grow with the output. If
+        the container restarts, the tail of the previous instance is
+        recovered and the new instance is followed after a marker line.
+    """
+
+    def __init__(self, podLogs, podName, container, path):
+        self.podLogs = podLogs
+        self.podName = podName
+        self.container = container
+        self.path = path
+        self.restarts = 0
+        self.written = 0 # bytes written for the current container instance
+        self.thread = threading.Thread(target=self.follow, daemon=True)
+        self.thread.start()
+
+    def stream(self, coreV1, previous=False):
+        """ Appends the log of the container to the file, skipping what was
+            already written for this instance.
+
+        Returns:
+            bool: True if the stream ended, False if it was stopped.
+        """
+
+        resp = coreV1.read_namespaced_pod_log(self.podName,
+                                              self.podLogs.namespace,
+                                              container=self.container,
+                                              follow=not previous,
+                                              previous=previous,
+                                              _preload_content=False)
+        try:
+            with open(self.path, 'ab') as f:
+                skip = self.written
+                for chunk in resp.stream(logChunkSize):
+                    if self.podLogs.stopped.is_set():
+                        return False
+                    if skip > 0:
+                        dropped = min(skip, len(chunk))
+                        chunk = chunk[dropped:]
+                        skip -= dropped
+                        if not chunk:
+                            continue
+                    f.write(chunk)
+                    f.flush()
+                    self.written += len(chunk)
+                    self.podLogs.record(len(chunk), chunk.count(b"\n"))
+        finally:
+            resp.release_conn()
+        return True
+
+    def status(self, pod):
+        """ Returns the status of the followed container, None if missing. """
+
+        for status in (pod.status.container_statuses or []):
+            if status.name == self.container:
+                return status
+        return None
+
+    def restarted(self, coreV1, status):
+        """ Recovers the tail of the previous instance of the container and
+            marks the restart on the file. The new instance starts empty.
+        """
+
+        try:
+            self.stream(coreV1, previous=True) # tail we missed
+        except (ApiException,) + transientErrors:
+            pass
+        self.restarts = status.restart_count
+        self.written = 0
+        with open(self.path, 'ab') as f:
+            f.write(("---- container %s restarted (%d) ----\n" % (
+                self.container, self.restarts)).encode())
+
+    def follow(self):
+        coreV1 = client.CoreV1Api(getApiClient(self.podLogs.kubeconfig))
+        while not self.podLogs.stopped.is_set():
+            try:
+                if self.stream(coreV1) is False:
+                    return
+            except ApiException as ex:
+                if ex.status == 404: # pod deleted
+                    return
+            except transientErrors as ex:
+                print("Log stream of %s dropped: %s" % (self.podName, ex))
+
+            # stream ended: dropped, container restarted or pod finished.
+            # The container is checked again before reopening its log: if it
+            # restarted meanwhile, the stream would be of the new instance.
+            waited = False
+            while not self.podLogs.stopped.is_set():
+                try:
+                    pod = getPod(self.podName, self.podLogs.kubeconfig,
+                                 namespace=self.podLogs.namespace)
+                except (ApiException,) + transientErrors as ex:
+                    print("Can't check pod %s: %s" % (self.podName, ex))
+                    self.podLogs.stopped.wait(reconnectSleep)
+                    continue
+                status = None if pod is None else self.status(pod)
+                if status is None:
+                    return
+                if status.restart_count > self.restarts:
+                    self.restarted(coreV1, status)
+                    break
+                if pod.status.phase in ("Succeeded", "Failed"):
+                    return
+                if waited is True:
+                    break # same instance: the connection dropped
+                # terminated but may be restarted, or the connection dropped
+                self.podLogs.stopped.wait(reconnectSleep)
+                waited = True
+
+
+class PodLogs:
+    """ Follows the logs of a pod, or of all the pods matching a label
+        selector (i.e. launcher and workers of an MPIJob), into
+        resDir/logs/<pod>.log. Pods are picked up as they appear. Keeps
+        the output rates as a liveness signal and warns on the test log if
+        the pods stay silent for too long.
+    """
+
+    def __init__(self, kubeconfig, resDir, toLog, podName=None,
+                 labelSelector=None, namespace=None):
+        self.kubeconfig = kubeconfig
+        self.logDir = os.path.join(resDir, "logs")
+        self.toLog = toLog
+        self.namespace = "default" if namespace is None else namespace
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.start = time.time()
+        self.bytes = 0
+        self.lines = 0
+        self.lastOutput = None
+        self.samples = deque(maxlen=1024) # (timestamp, bytes, lines)
+        if podName is not None:
+            self.selector = {"field_selector": "metadata.name=%s" % podName}
+        else:
+            self.selector = {"label_selector": labelSelector}
+        os.makedirs(self.logDir, exist_ok=True)
+        self.watcher = threading.Thread(target=self.watchPods, daemon=True)
+        self.watcher.start()
+        self.watchdog = threading.Thread(target=self.checkSilence, daemon=True)
+        self.watchdog.start()
+
+    def record(self, size, lines):
+        now = time.time()
+        with self.lock:
+            self.bytes += size
+            self.lines += lines
+            self.lastOutput = now
+            self.samples.append((now, self.bytes, self.lines))
+
+    def liveness(self):
+        """ Output rates of the followed pods over the last livenessWindow
+            seconds.
+
+        Returns:
+            dict: bytesPerSecond, linesPerSecond and secondsSinceOutput.
+        """
+
+        now = time.time()
+        with self.lock:
+            recent = [s for s in self.samples if now - s[0] <= livenessWindow]
+            last = self.lastOutput
+            if recent:
+                previous = [s for s in self.samples if now - s[0] > livenessWindow]
+                if previous:
+                    base = previous[-1]
+                elif len(self.samples) == self.samples.maxlen: # older dropped
+                    base = recent[0]
+                else:
+                    base = (self.start, 0, 0)
+                bytesNow, linesNow = recent[-1][1], recent[-1][2]
+            else:
+                base = bytesNow = linesNow = None
+        if base is None:
+            return {"bytesPerSecond": 0,
+                    "linesPerSecond": 0,
+                    "secondsSinceOutput": None if last is None
+                    else round(now - last, 1)}
+        elapsed = max(min(now - base[0], livenessWindow), 1e-6)
+        return {"bytesPerSecond": round((bytesNow - base[1]) / elapsed, 1),
+                "linesPerSecond": round((linesNow - base[2]) / elapsed, 2),
+                "secondsSinceOutput": round(now - last, 1)}
+
+    def addPod(self, pod):
+        for status in (pod.status.container_statuses or []):
+            if status.state.waiting is not None and status.restart_count == 0:
+                continue # nothing to read yet
+            key = (pod.metadata.name, status.name)
+            if key in self.containers:
+                continue
+            single = len(pod.spec.containers) == 1
+            fileName = "%s.log" % pod.metadata.name if single \
+                else "%s.%s.log" % (pod.metadata.name, status.name)
+            self.containers[key] = ContainerLog(self,
+                                                pod.metadata.name,
+                                                status.name,
+                                                os.path.join(self.logDir,
+                                                             fileName))
+
+    def watchPods(self):
+        coreV1 = client.CoreV1Api(getApiClient(self.kubeconfig))
+        while not self.stopped.is_set():
+            try:
+                pods = coreV1.list_namespaced_pod(self.namespace,
+                                                  **self.selector)
+                for pod in pods.items:
+                    self.addPod(pod)
+                for event in watch.Watch().stream(
+                        coreV1.list_namespaced_pod,
+                        self.namespace,
+                        resource_version=pods.metadata.resource_version,
+                        timeout_seconds=livenessWindow,
+                        **self.selector):
+                    if self.stopped.is_set():
+                        return
+                    if event["type"] in ("ADDED", "MODIFIED"):
+                        self.addPod(event["object"])
+            except (ApiException,) + transientErrors as ex:
+                print("Watching pods for logs failed: %s" % ex)
+                self.stopped.wait(reconnectSleep)
+
+    def checkSilence(self):
+        warned = False
+        while not self.stopped.wait(livenessWindow):
+            last = self.lastOutput if self.lastOutput else self.start
+            silent = time.time() - last
+            if silent > logSilenceWarning and not warned:
+                writeToFile(self.toLog, "No output from %s for %d minutes" % (
+                    ", ".join(sorted(set(pod for pod, c in list(self.containers))))
+                    or "the test pods", silent / 60), True)
+            warned = silent > logSilenceWarning
+
+    def stop(self):
+        """ Stops following the logs.
+
+        Returns:
+            dict: bytes and lines received, seconds followed, restarts seen
+                  and the liveness rates at the end.
+        """
+
+        stats = self.liveness()
+        self.stopped.set()
+        stats.update({"bytes": self.bytes,
+                      "lines": self.lines,
+                      "seconds": round(time.time() - self.start, 1),
+                      "restarts": sum(c.restarts
+                                      for c in self.containers.values())})
+        return stats
+
+
+def followLogs(kubeconfig, resDir, toLog, podName=None, labelSelector=None,
+               namespace=None):
+    """ Starts following the logs of the pods of a test into resDir/logs.
+
+    Parameters:
+        kubeconfig (str): Path to kubeconfig file of the cluster.
+        resDir (str): Path to the results folder for the current run.
+        toLog (str): Path to the log file of the test.
+        podName (str): Pod to follow.
+        labelSelector (str): If no podName, follow the pods matching it.
+        namespace (str): Namespace of the pods.
+
+    Returns:
+        PodLogs: Call stop() on it once the test is done.
+    """
+
+    return PodLogs(kubeconfig,
+                   resDir,
+                   toLog,
+                   podName=podName,
+                   labelSelector=labelSelector,
+                   namespace=namespace)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import json
+    import time
+    import queue
+    import atexit
+    import threading
+    import multiprocessing
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+
+logFlushInterval = 0.5 # seconds a buffered line can wait to be written
+logBufferSize = 64 * 1024 # bytes buffered per log file before writing them
+logDir = "src/logging" # only files in it are buffered, others are written now
+
+writer = None # LogWriter of the run, see startLogging
+
+
+class LogWriter:
+    """ Writes the log files of the run (src/logging/<cluster>, header,
+        footer...) from a single thread of the main process. Every file is
+        a channel with its own buffer, written out every logFlushInterval
+        seconds or once it holds logBufferSize bytes, so chatty phases don't
+        pay an open (or a shell) per line. Processes forked from the main
+        one (i.e. the provisioning pool) send their lines through a queue
+        to it. Lines can also be sent to a JSON-lines sink, one object per
+        line with its time, process and channel.
+    """
+
+    def __init__(self, jsonPath=None):
+        self.owner = os.getpid()
+        self.logDir = os.path.abspath(logDir)
+        self.queue = multiprocessing.get_context("fork").Queue()
+        self.lock = threading.Lock()
+        self.buffers = {} # path: [mode, lines, size]
+        self.jsonPath = None if jsonPath is None else os.path.abspath(jsonPath)
+        self.jsonLines = []
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def write(self, path, content, append=True):
+        """ Queues content to be written to path. If append is False, the
+            file is overwritten (lines still buffered for it are dropped).
+        """
+
+        line = (time.time(), os.getpid(), os.path.abspath(path), content,
+                append)
+        if os.getpid() != self.owner:
+            self.queue.put(line)
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.add(line)
+
+    def add(self, line):
+        when, pid, path, content, append = line
+        text = content + "\n"
+        with self.lock:
+            buffer = self.buffers.get(path)
+            if append is False or buffer is None:
+                buffer = ['a' if append is True else 'w', [], 0]
+                self.buffers[path] = buffer
+            buffer[1].append(text)
+            buffer[2] += len(text)
+            if self.jsonPath is not None:
+                self.jsonLines.append(json.dumps(
+                    {"time": when,
+                     "pid": pid,
+                     "channel": os.path.basename(path),
+                     "text": content}) + "\n")
+            full = buffer[2] >= logBufferSize
+        if full is True:
+            self.flush(path)
+
+    def flush(self, path=None):
+        """ Writes out the lines buffered for path, or for every file. """
+
+        with self.lock:
+            paths = list(self.buffers) if path is None else [path]
+            for toWrite in paths:
+                mode, lines, _ = self.buffers.pop(toWrite, ('a', [], 0))
+                if lines or mode == 'w':
+                    with open(toWrite, mode) as f:
+                        f.write("".join(lines))
+            if path is None and self.jsonLines:
+                with open(self.jsonPath, 'a') as f:
+                    f.write("".join(self.jsonLines))
+                self.jsonLines = []
+
+    def drain(self, timeout):
+        """ Takes the lines sent by other processes, waiting up to timeout
+            seconds for the first one.
+        """
+
+        try:
+            line = self.queue.get(timeout=timeout)
+            while True:
+                self.add(line)
+                line = self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def run(self):
+        while not self.stopped.is_set():
+            deadline = time.time() + logFlushInterval
+            while time.time() < deadline and not self.stopped.is_set():
+                self.drain(max(deadline - time.time(), 0))
+            self.flush()
+
+    def stop(self):
+        """ Writes out everything pending. """
+
+        if os.getpid() != self.owner:
+            return
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.drain(0)
+        self.flush()
+
+
+def startLogging(jsonPath=None):
+    """ Routes writeToFile and logger to a LogWriter. Must be called before
+        the provisioning pool is forked, so its processes send their lines
+        to it. Its thread starts with the first line written.
+
+    Parameters:
+        jsonPath (str): If given, every line is also written to this
+                        JSON-lines file.
+    """
+
+    global writer
+    writer = LogWriter(jsonPath)
+    atexit.register(writer.stop)
+
+
+def writeLog(path, content, append=True):
+    """ Writes content to a log file through the writer of the run. Files
+        outside logDir (i.e. main.tf) are not logs: they must be on disk once
+        written, so they are left to the caller.
+
+    Returns:
+        bool: False if there is no writer or path is not a log file.
+    """
+
+    if writer is None or \
+            not os.path.abspath(path).startswith(writer.logDir + os.sep):
+        return False
+    writer.write(path, content, append)
+    return True
@@ -4,7 +4,6 @@ import sys
 try:
     import yaml
     import json
-    from multiprocessing import Process, Queue
     import argparse
     import jsonschema
     import os
@@ -21,7 +20,17 @@ except ModuleNotFoundError as ex:
 
 from checker import *
 from tests import *
+from engine import *
+from journal import *
 import init
+import kubernetesFunctions
+import clusterPool
+from multiTarget import runTargets
+from tracing import startTracing, writeTrace
+from metrics import clusterMetrics, commandMetrics
+import logWriter
+import executor
+import tracing
 
 
 onlyTest = False
@@ -36,11 +45,13 @@ extraInstanceConfig = ""
 dependencies = ""
 credentials = ""
 totalCost = 0
-procs = []
 viaBackend = False
 resultsExist = False
 interactive = True
 retry = None
+resumeRun = None
+usePool = False
+provisionSlots = None
 destroy = None
 destroyOnCompletion = None
 clustersToDestroy = None
@@ -159,6 +170,25 @@ parser.add_argument('--customNodes',
 parser.add_argument('--noWatch', 
                     help='Do not use the watch function.',
                     action='store_true')
+parser.add_argument('--resume',
+                    help='Resume a previous run, skipping what it completed.',
+                    metavar="RUN",
+                    type=str,
+                    dest="resumeRun")
+parser.add_argument('--informerCache',
+                    help='Serve node and pod lookups from watches.',
+                    action='store_true')
+parser.add_argument('--pool',
+                    help='Reuse kept clusters and keep the ones created.',
+                    action='store_true')
+parser.add_argument('--targets',
+                    nargs='+',
+                    help='Run on several providers at once.',
+                    metavar="CONFIGS[:CATALOG]",
+                    type=str)
+parser.add_argument('--provisionSlots', # set by --targets on every target
+                    help=argparse.SUPPRESS,
+                    type=str)
 
 args = parser.parse_args()
 
@@ -176,14 +206,28 @@ if args.customNodes:
     customNodes = args.customNodes
 if args.noTerraform:
     noTerraform = True
+if args.informerCache:
+    kubernetesFunctions.useInformerCache = True
+if args.pool:
+    usePool = True
+if args.provisionSlots:
+    provisionSlots = args.provisionSlots
+if args.targets:
+    internalConfigs = loadFile("src/configurations/internalConfigurations.yaml",
+                               required=True)
+    stop(runTargets(args.targets, sys.argv[1:], baseCWD,
+                    internalConfigs["maxProvisioners"]))
+if args.resumeRun:
+    resumeRun = args.resumeRun
+    retry = True # reuse the terraform files and state of the run
 if args.clustersToDestroy:
     clustersToDestroy = args.clustersToDestroy
     if "all" in clustersToDestroy:
         clustersToDestroy = clusters
     if interactive is False:
-        destroyTF(baseCWD, clusters=clustersToDestroy)
+        destroyTF(clusters=clustersToDestroy)
     elif input(destroyWarning % clustersToDestroy) == "yes":
-        destroyTF(baseCWD, clusters=clustersToDestroy)
+        destroyTF(clusters=clustersToDestroy)
     else:
         print("Aborting operation")
     stop(0)
@@ -213,15 +257,32 @@ if not selectedTests:
                 "No tests selected, nothing to do!", True)
     stop(0)
 
-if retry is True:
+if retry is True and resumeRun is None:
     checkRequiredTFexist(selectedTests)
 
 
 # -----------------CREATE RESULTS FOLDER AND GENERAL FILE------------------
-s3ResDirBase = configs["providerName"] + "/" + str(
-    datetime.datetime.now().strftime("%d-%m-%Y_%H-%M-%S"))
+if resumeRun is None:
+    s3ResDirBase = configs["providerName"] + "/" + str(
+        datetime.datetime.now().strftime("%d-%m-%Y_%H-%M-%S"))
+else: # results/<provider>/<timestamp>, with or without 'results/'
+    s3ResDirBase = os.path.relpath(os.path.abspath(resumeRun),
+                                   os.path.abspath("results")) \
+        if os.path.isdir(resumeRun) else resumeRun.strip("/")
+    if not os.path.isfile("results/%s/journal.jsonl" % s3ResDirBase):
+        writeToFile("src/logging/header",
+                    "ERROR: no run journal found for '%s'" % resumeRun, True)
+        stop(1)
+    if s3ResDirBase.split("/")[0] != configs["providerName"]:
+        writeToFile("src/logging/header",
+                    "ERROR: run '%s' was not done on '%s'" %
+                    (resumeRun, configs["providerName"]), True)
+        stop(1)
 resDir = "results/%s/detailed" % s3ResDirBase
-os.makedirs(resDir)
+os.makedirs(resDir, exist_ok=True)
+journal = RunJournal("results/%s/journal.jsonl" % s3ResDirBase)
+journal.record("run", s3ResDirBase, resumed=resumeRun is not None,
+               tests=selectedTests)
 generalResults = {
     "testing": []
 }
@@ -231,8 +292,25 @@ header(provider=configs["providerName"], results=s3ResDirBase)
 
 
 # -----------------RUN TESTS-----------------------------------------------
-queue = Queue()
-init.queue = queue
+internalConfigs = loadFile("src/configurations/internalConfigurations.yaml",
+                           required=True)
+clusterPool.poolIdleTTL = internalConfigs["poolIdleTTL"]
+startTracing("results/%s/spans" % s3ResDirBase)
+logWriter.logFlushInterval = internalConfigs["logFlushInterval"]
+executor.toolLimits.update(internalConfigs["commandLimits"])
+setupTerraform(internalConfigs["terraformPluginCache"],
+               mirror=internalConfigs["terraformMirror"],
+               pin=internalConfigs["terraformLockPinning"],
+               parallelism=internalConfigs["terraformParallelism"])
+logWriter.startLogging("results/%s/logs.jsonl" % s3ResDirBase
+                       if internalConfigs["jsonLogs"] is True else None)
+engine = startEngine(internalConfigs["runLimits"], journal,
+                     pool=s3ResDirBase if usePool is True else None,
+                     slots=provisionSlots,
+                     quotas=configs.get("quotas"))
+startCollector(internalConfigs["maxParallelFetches"],
+               internalConfigs["maxParallelFetchesPerCluster"],
+               clusters)
 cluster = 1
 
 msgArr = ["CLUSTER %s: (parallel running tests):" % (cluster)]
@@ -240,35 +318,50 @@ for test in testsSharingCluster:
     if testsCatalog[test]["run"] is True:
         msgArr.append(test)
 
+numberOfNodes = None
 if len(msgArr) > 1:
     if customNodes is not None:
         numberOfNodes = customNodes
     else:
         numberOfNodes = len(msgArr) - 1
-    p = Process(target=sharedClusterTests, args=( # shared cluster provisioning
-        msgArr, onlyTest, retry, noTerraform, resDir, numberOfNodes, usePrivateIPs))
-    procs.append(p)
-    p.start()
+    logger(msgArr, "=", "src/logging/shared")
     cluster += 1
 
+customTests = []
 for test in customClustersTests:
     if testsCatalog[test]["run"] is True:
         logger("CLUSTER %s: %s" % (cluster, test),
                "=", "src/logging/%s" % test)
-        p = Process(target=eval(test), args=( # custom clusters provisioning
-            onlyTest, retry, noTerraform, resDir, usePrivateIPs))
-        procs.append(p)
-        p.start()
+        customTests.append(test)
         cluster += 1
 
-for p in procs:  # All tests launched (functions run): wait for completion
-    p.join()
-
-while not queue.empty():
-    entry, cost = queue.get()
-    if entry:
-        generalResults["testing"].append(entry)
-    totalCost += cost
+runGraph = engine.plan(msgArr[1:], customTests, onlyTest, retry, noTerraform,
+                       resDir, numberOfNodes, usePrivateIPs,
+                       resume=resumeRun is not None,
+                       destroy=clustersToDestroy if destroyOnCompletion else [])
+results = engine.run(runGraph) # All steps launched: wait for completion
+released = engine.releasePool()
+if released:
+    writeToFile("src/logging/footer", "Clusters kept for the next runs: %s" %
+                ", ".join(released), True)
+generalResults["testing"] = results.entries
+generalResults["steps"] = runGraph.report()
+generalResults["criticalPath"] = runGraph.criticalPath()
+spans = tracing.loadSpans(tracing.traceDir)
+generalResults["metrics"] = {
+    "clusters": clusterMetrics(generalResults["steps"],
+                               kubernetesFunctions.apiCallsPerCluster(),
+                               spans),
+    "tests": results.metrics,
+    "commands": commandMetrics(spans)}
+totalCost = results.cost
+for step in generalResults["steps"]:
+    if "error" in step:
+        writeToFile("src/logging/header", "%s failed: %s" %
+                    (step["step"], step["error"]), True)
+writeToFile("src/logging/header", "Critical path: %s" % " > ".join(
+    "%s (%.0fs)" % (step["step"], step["seconds"] + step["waited"])
+    for step in generalResults["criticalPath"]), True)
 
 if checkResultsExist(resDir) is True:
     # -----------------CALCULATE COSTS-----------------------------------------
@@ -285,6 +378,10 @@ if checkResultsExist(resDir) is True:
     generalResults["info"] = configs
     generalResults["testsCatalog"] = testsCatalog
 
+    writeTrace("results/%s/trace.json" % s3ResDirBase,
+               otlp=internalConfigs["otlpTrace"],
+               service="eosc-testsuite-%s" % configs["providerName"])
+
     with open("results/" + s3ResDirBase + "/general.json", 'w') as outfile:
         json.dump(generalResults, outfile, indent=4, sort_keys=True)
 
@@ -293,10 +390,14 @@ if checkResultsExist(resDir) is True:
     if viaBackend is True:
         s3Endpoint = "https://s3.cern.ch"
         bucket = "s3://ts-results"
-        pushResults = runCMD(
-            "aws s3 cp --endpoint-url=%s %s %s/%s --recursive > /dev/null" %
-            (s3Endpoint, "results/" + s3ResDirBase, bucket, s3ResDirBase))
-        runCMD("cp results/%s/general.json .. " % s3ResDirBase)
+        pushResults = runCommand(["aws", "s3", "cp",
+                                  "--endpoint-url=%s" % s3Endpoint,
+                                  "results/" + s3ResDirBase,
+                                  "%s/%s" % (bucket, s3ResDirBase),
+                                  "--recursive"],
+                                 hideLogs=True,
+                                 timeout=internalConfigs["resultsUploadTO"])
+        shutil.copy("results/%s/general.json" % s3ResDirBase, "..")
         if pushResults != 0:
             logger("S3 upload failed! Is 'awscli' installed and configured?",
                    "!", "src/logging/footer")
@@ -308,8 +409,10 @@ if checkResultsExist(resDir) is True:
 
     if destroyOnCompletion == True:
         for cluster in clustersToDestroy:
+            if cluster in engine.destroyed:
+                continue # destroyed once its tests were done
             if checkClusterWasProvisioned(cluster, generalResults["testing"]):
-                if destroyTF(baseCWD, clusters=[cluster])[0] != 0:
+                if destroyTF(clusters=[cluster])[0] != 0:
                     msg = "   ...destroy failed. Check 'logs' file for details"
                 else:
                     msg = "   ...cluster destroyed"
@@ -321,7 +424,15 @@ else:
 
     # logo with provider, no results
     header(provider=configs["providerName"])
-    shutil.rmtree("results/" + s3ResDirBase, True)
+    # keep the journal, the run can still be resumed (i.e. no cluster was up)
+    for entry in os.listdir("results/" + s3ResDirBase):
+        path = os.path.join("results", s3ResDirBase, entry)
+        if path == journal.path:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, True)
+        else:
+            os.remove(path)
 
 
 logger("Run completed", "#", "src/logging/end")
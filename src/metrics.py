@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import time
+    import contextlib
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+
+clusterPhases = {"admit": "admission", # step of the run graph: phase
+                 "lease": "lease",
+                 "provision": "provision",
+                 "bootstrap": "bootstrap",
+                 "ready": "readiness",
+                 "stage": "staging",
+                 "check": "readiness",
+                 "teardown": "teardown"}
+
+
+class TestMetrics:
+    """ Durations of the phases of a test -deploy (creating its resources
+        and uploading its inputs), execution (until its results are ready)
+        and fetch (copying them)- and its counters: bytes transferred and
+        retries. Reported through init.queue along with its results.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {"bytesSent": 0, "bytesFetched": 0, "retries": 0}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Adds the time spent inside to the given phase. """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def collected(self, seconds, fetchStats):
+        """ Splits the time spent collecting results (see collectResults)
+            into execution -waiting for them- and fetch.
+
+        Parameters:
+            seconds (float): Time spent collecting results.
+            fetchStats (dict): Fetch counters, see newFetchStats.
+        """
+
+        if not fetchStats:
+            self.add("execution", seconds)
+            return
+        self.add("fetch", fetchStats["seconds"])
+        self.add("execution", max(seconds - fetchStats["seconds"], 0))
+        self.counters["bytesFetched"] += fetchStats["bytes"]
+        self.counters["retries"] += fetchStats["retries"]
+
+    def uploaded(self, seconds, uploadStats):
+        """ Splits the time of copyToPodAndRun into deploy -uploading the
+            inputs- and execution -running the script-.
+        """
+
+        self.add("deploy", uploadStats.get("seconds", 0))
+        self.add("execution", max(seconds - uploadStats.get("seconds", 0), 0))
+        self.counters["bytesSent"] += uploadStats.get("bytes", 0)
+        self.counters["retries"] += uploadStats.get("retries", 0)
+
+    def report(self):
+        """ Returns the phases (seconds) and counters. """
+
+        report = {phase: round(seconds, 1)
+                  for phase, seconds in self.phases.items()}
+        report.update(self.counters)
+        return report
+
+
+def clusterMetrics(steps, apiCalls, spans=()):
+    """ Durations of the phases of every cluster, the requests done to its
+        API server and the Terraform subcommands run or skipped on it.
+
+    Parameters:
+        steps (Array<dict>): Outcome of the steps of the run, see
+                             Scheduler.report.
+        apiCalls (dict): Requests done per cluster, see apiCallsPerCluster.
+        spans (Array<dict>): Spans of the run, see loadSpans.
+
+    Returns:
+        dict: Per cluster, seconds of every phase that ran, apiCalls and
+              terraform: seconds of every subcommand run (phases), those
+              skipped with the seconds they took the last time they ran
+              (skipped) and the sum of the latter (saved).
+    """
+
+    clusters = {}
+    for step in steps:
+        kind, _, cluster = step["step"].partition(":")
+        if kind in clusterPhases and "seconds" in step:
+            phases = clusters.setdefault(cluster, {})
+            phases[clusterPhases[kind]] = step["seconds"]
+    for cluster, calls in apiCalls.items():
+        clusters.setdefault(cluster, {})["apiCalls"] = calls
+    for s in spans:
+        if s["cat"] != "tfphase":
+            continue
+        terraform = clusters.setdefault(s["args"]["cluster"], {}).setdefault(
+            "terraform", {"phases": {}, "skipped": {}, "saved": 0})
+        phase = s["args"]["phase"]
+        if s["args"]["skipped"] is True:
+            terraform["skipped"][phase] = s["args"]["saved"]
+            terraform["saved"] = round(terraform["saved"] +
+                                       (s["args"]["saved"] or 0), 1)
+        else:
+            terraform["phases"][phase] = round(
+                terraform["phases"].get(phase, 0) + s["end"] - s["start"], 1)
+    return clusters
+
+
+def commandMetrics(spans):
+    """ Commands run by the processes of the run (see runCommand).
+
+    Parameters:
+        spans (Array<dict>): Spans of the run, see loadSpans.
+
+    Returns:
+        dict: Per tool, the commands run, seconds spent, failed and timed
+              out (tools), and every command with its seconds and exit
+              status (commands).
+    """
+
+    tools = {}
+    commands = []
+    for s in sorted(spans, key=lambda s: s["start"]):
+        if s["cat"] != "command":
+            continue
+        seconds = round(s["end"] - s["start"], 1)
+        commands.append({"command": s["args"]["command"],
+                         "seconds": seconds,
+                         "exitCode": s["args"]["exitCode"],
+                         "timedOut": s["args"]["timedOut"]})
+        tool = tools.setdefault(s["name"], {"runs": 0, "seconds": 0,
+                                            "failed": 0, "timedOut": 0})
+        tool["runs"] += 1
+        tool["seconds"] = round(tool["seconds"] + seconds, 1)
+        tool["failed"] += s["args"]["exitCode"] != 0
+        tool["timedOut"] += s["args"]["timedOut"] is True
+    return {"tools": tools, "commands": commands}
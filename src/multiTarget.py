@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import time
+    import fcntl
+    import shutil
+    import subprocess
+    import contextlib
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from aux import *
+
+
+targetsRoot = "targets" # working directories of the targets
+slotPoll = 1 # seconds between attempts to take a provisioning slot
+sharedDirs = ["provisionment", "schemas", "configurations"] # read only
+generatedFiles = ["main.tf", "versions.tf", "terraform.tfvars*",
+                  "terraform.tfstate*", ".terraform", ".terraform.lock.hcl",
+                  "terraform.rc", "phases.json", "config", "hosts",
+                  "pool.json", "pool.lock", "__pycache__"]
+
+
+def parseTargets(targets):
+    """ Parses the targets given to --targets.
+
+    Parameters:
+        targets (Array<str>): 'configs' or 'configs:catalog' paths.
+
+    Returns:
+        Array<dict>: name, configs and catalog (absolute paths) of every
+                     target. Names are unique.
+    """
+
+    parsed = []
+    names = set()
+    for target in targets:
+        cfgPath, _, tcPath = target.partition(":")
+        name = os.path.splitext(os.path.basename(cfgPath))[0]
+        unique, i = name, 2
+        while unique in names:
+            unique, i = "%s_%d" % (name, i), i + 1
+        names.add(unique)
+        parsed.append({"name": unique,
+                       "configs": os.path.abspath(cfgPath),
+                       "catalog": os.path.abspath(tcPath if tcPath
+                                                  else "testsCatalog.yaml")})
+    return parsed
+
+
+def prepareWorkdir(name, baseCWD):
+    """ Creates (or refreshes) the working directory of a target. Code and
+        read only files are linked, the test folders -where Terraform
+        files, state and kubeconfigs are written- are copied, and logs and
+        results are its own. Files generated by previous runs of the target
+        are kept, so --retry, --pool and --destroy keep working on it.
+
+    Parameters:
+        name (str): Name of the target.
+        baseCWD (str): Path to the root of the test-suite.
+
+    Returns:
+        str: Path to the working directory.
+    """
+
+    workdir = os.path.join(baseCWD, targetsRoot, name)
+    os.makedirs(os.path.join(workdir, "src", "logging"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+    for entry in os.listdir(os.path.join(baseCWD, "src")):
+        if entry.endswith(".py") or entry in sharedDirs:
+            link = os.path.join(workdir, "src", entry)
+            if not os.path.lexists(link):
+                os.symlink(os.path.join(baseCWD, "src", entry), link)
+    shutil.copytree(os.path.join(baseCWD, "src", "tests"),
+                    os.path.join(workdir, "src", "tests"),
+                    ignore=shutil.ignore_patterns(*generatedFiles),
+                    dirs_exist_ok=True)
+    return workdir
+
+
+def createSlots(count, baseCWD):
+    """ Creates the provisioning slots shared by the targets.
+
+    Parameters:
+        count (int): Terraform/Ansible processes allowed at once.
+        baseCWD (str): Path to the root of the test-suite.
+
+    Returns:
+        str: Path to the folder of the slots.
+    """
+
+    slots = os.path.join(baseCWD, targetsRoot, ".slots")
+    shutil.rmtree(slots, True)
+    os.makedirs(slots)
+    for i in range(count):
+        open(os.path.join(slots, "slot%d" % i), 'w').close()
+    return slots
+
+
+@contextlib.contextmanager
+def provisionSlot(slots):
+    """ Holds one of the provisioning slots shared by the targets (a lock
+        on one of the files of the folder), waiting for one to be free.
+        Nothing is held if slots is None.
+
+    Parameters:
+        slots (str): Path to the folder of the slots.
+    """
+
+    if slots is None:
+        yield
+        return
+    paths = sorted(os.path.join(slots, f) for f in os.listdir(slots))
+    while True:
+        for path in paths:
+            f = open(path, 'w')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            return
+        time.sleep(slotPoll)
+
+
+def withSlot(slots, func, *args):
+    """ Runs func holding a provisioning slot. """
+
+    with provisionSlot(slots):
+        return func(*args)
+
+
+def childArgs(argv):
+    """ Options of the run to be passed to every target: all but the
+        targets, configs and catalog. Targets never prompt.
+    """
+
+    args = []
+    skipping = False
+    for arg in argv:
+        if arg in ("--targets", "-c", "--configs", "-t", "--testsCatalog"):
+            skipping = True
+        elif skipping and not arg.startswith("-"):
+            continue
+        else:
+            skipping = False
+            if arg != "-y":
+                args.append(arg)
+    return args + ["-y"]
+
+
+def latestResults(workdir):
+    """ Returns the results folder of the last run of a target, None if
+        there is none.
+    """
+
+    runs = [os.path.join(provider, run)
+            for provider in os.listdir(os.path.join(workdir, "results"))
+            if os.path.isdir(os.path.join(workdir, "results", provider))
+            for run in os.listdir(os.path.join(workdir, "results", provider))]
+    if not runs:
+        return None
+    return os.path.join(workdir, "results", max(
+        runs, key=lambda r: os.path.getmtime(os.path.join(workdir, "results", r))))
+
+
+def runTargets(targets, argv, baseCWD, provisioners):
+    """ Runs the test-suite on several providers at once: one run per target,
+        each on its own working directory (targetsRoot/<name>), with its own
+        logs and results. Terraform and Ansible processes are limited across
+        all the targets.
+
+    Parameters:
+        targets (Array<str>): 'configs' or 'configs:catalog' paths.
+        argv (Array<str>): Options of the run.
+        baseCWD (str): Path to the root of the test-suite.
+        provisioners (int): Terraform/Ansible processes allowed at once.
+
+    Returns:
+        int: 0 if all the targets succeeded, 1 otherwise.
+    """
+
+    targets = parseTargets(targets)
+    slots = createSlots(provisioners, baseCWD)
+    options = childArgs(argv)
+    running = []
+    for target in targets:
+        workdir = prepareWorkdir(target["name"], baseCWD)
+        with open(os.path.join(workdir, "logs"), 'w') as out:
+            proc = subprocess.Popen([sys.executable, "-B", "-u", "src/main.py",
+                                     "-c", target["configs"],
+                                     "-t", target["catalog"],
+                                     "--provisionSlots", slots] + options,
+                                    cwd=workdir,
+                                    stdout=out,
+                                    stderr=subprocess.STDOUT)
+        running.append((target, workdir, proc, time.time()))
+        writeToFile("src/logging/header", "Target '%s' started, logs on %s" % (
+            target["name"], os.path.relpath(os.path.join(workdir, "src",
+                                                         "logging"))), True)
+
+    res = 0
+    while running:
+        time.sleep(slotPoll)
+        finished = [item for item in running if item[2].poll() is not None]
+        for item in finished:
+            running.remove(item)
+            target, workdir, proc, start = item
+            res = max(res, reportTarget(target, workdir, proc.returncode,
+                                        start))
+    return res
+
+
+def reportTarget(target, workdir, exitCode, start):
+    """ Writes the outcome of a target on the footer.
+
+    Returns:
+        int: 0 if the target succeeded, 1 otherwise.
+    """
+
+    results = latestResults(workdir)
+    writeToFile("src/logging/footer",
+                "Target '%s' %s after %d min, results on %s" % (
+                    target["name"],
+                    "finished" if exitCode == 0 else
+                    "FAILED (exit code %d)" % exitCode,
+                    (time.time() - start) / 60,
+                    os.path.relpath(results) if results else "-"), True)
+    return 0 if exitCode == 0 else 1
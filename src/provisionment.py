@@ -26,6 +26,7 @@ from init import *
 from kubernetesFunctions import *
 from ansibleFunctions import *
 from terraformFunctions import *
+from tracing import traced
 
 
 def provisionAndBootstrap(test,
@@ -70,26 +71,86 @@ def provisionAndBootstrap(test,
     """
 
     if noTerraform is False: # run terraform too
-        res, msg = terraformProvisionment(test,
-                                      nodes,
-                                      flavor,
-                                      extraInstanceConfig,
-                                      toLog,
-                                      configs,
-                                      cfgPath,
-                                      testsRoot,
-                                      retry,
-                                      instanceDefinition,
-                                      credentials,
-                                      dependencies,
-                                      baseCWD,
-                                      extraSupportedClouds,
-                                      usePrivateIPs)
+        res, msg = provision(test,
+                             nodes,
+                             flavor,
+                             extraInstanceConfig,
+                             toLog,
+                             configs,
+                             cfgPath,
+                             testsRoot,
+                             retry,
+                             instanceDefinition,
+                             credentials,
+                             dependencies,
+                             baseCWD,
+                             extraSupportedClouds,
+                             usePrivateIPs)
         if res is False:
             return False, msg
 
     #else: # Only ansible
 
+    res, masterIP = bootstrap(test,
+                              configs,
+                              testsRoot,
+                              baseCWD,
+                              noTerraform,
+                              usePrivateIPs)
+    if res is False:
+        return False, masterIP # error message
+    return waitForCluster(test, toLog, masterIP, baseCWD, usePrivateIPs)
+
+
+def provision(test,
+              nodes,
+              flavor,
+              extraInstanceConfig,
+              toLog,
+              configs,
+              cfgPath,
+              testsRoot,
+              retry,
+              instanceDefinition,
+              credentials,
+              dependencies,
+              baseCWD,
+              extraSupportedClouds,
+              usePrivateIPs):
+    """ Provisions the VMs of a cluster with Terraform (cloud API bound).
+        See provisionAndBootstrap for the parameters.
+
+    Returns:
+        bool: True if the VMs were succesfully provisioned. False otherwise.
+        str: Message informing of the provisionment task result.
+    """
+
+    return terraformProvisionment(test,
+                                  nodes,
+                                  flavor,
+                                  extraInstanceConfig,
+                                  toLog,
+                                  configs,
+                                  cfgPath,
+                                  testsRoot,
+                                  retry,
+                                  instanceDefinition,
+                                  credentials,
+                                  dependencies,
+                                  baseCWD,
+                                  extraSupportedClouds,
+                                  usePrivateIPs)
+
+
+def bootstrap(test, configs, testsRoot, baseCWD, noTerraform, usePrivateIPs):
+    """ Bootstraps the k8s cluster on the VMs with Ansible (SSH bound).
+        See provisionAndBootstrap for the parameters.
+
+    Returns:
+        bool: True if the cluster was succesfully bootstrapped.
+        str: IP of the master node, error message in case of failure.
+    """
+
     mainTfDir = testsRoot + test
     kubeconfig = "%s/src/tests/%s/config" % (baseCWD, test)  # "config"
 
@@ -98,7 +159,6 @@ def provisionAndBootstrap(test,
         os.makedirs(mainTfDir, exist_ok=True)
 
     result, masterIP = ansiblePlaybook(mainTfDir,
-                                       baseCWD,
                                        configs["providerName"],
                                        kubeconfig,
                                        noTerraform, # this is None in terraformFunctions
@@ -107,17 +167,41 @@ def provisionAndBootstrap(test,
                                        usePrivateIPs)
     if result != 0:
         return False, bootstrapFailMsg % test
+    return True, masterIP
+
+
+@traced("k8s", label="test")
+def waitForCluster(test, toLog, masterIP, baseCWD, usePrivateIPs):
+    """ Updates the kubeconfig file of a bootstrapped cluster and waits for
+        its default service account to be ready (k8s API bound).
+
+    Parameters:
+        test (str): Indicates the test for which the cluster was created.
+        toLog (str): File to which write the log msg.
+        masterIP (str): IP of the master node.
+        baseCWD (str): Path to the base directory.
+        usePrivateIPs (bool): Indicates usage of public or private IPs.
+
+    Returns:
+        bool: True if the cluster is ready. False otherwise.
+        str: Message informing of the provisionment task result.
+    """
+
+    kubeconfig = "%s/src/tests/%s/config" % (baseCWD, test)
 
     # -------- Update kubeconfig files and wait for default SA to be ready
 
     if usePrivateIPs is False:
         updateKubeconfig(masterIP, kubeconfig)
 
-    if waitForResource("default",
-                       Type.sa,
-                       kubeconfig,
-                       retrials=70,
-                       sleepTime=10) is not False:
+    waitStart = time.time()
+    saReady = waitForResource("default",
+                              Type.sa,
+                              kubeconfig,
+                              deadline=waitStart + resourceWaitTimeout)
+    if saReady is not False:
+        writeToFile(toLog, "Service account ready after %.1fs" %
+                    (saReady - waitStart), True)
         writeToFile(toLog, clusterCreatedMsg % (test, masterIP), True)
         return True, ""
 
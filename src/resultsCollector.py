@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import time
+    import threading
+    import contextlib
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import BoundedSemaphore
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from aux import *
+from kubernetesFunctions import *
+
+
+collector = None # ResultsCollector of the run, see startCollector()
+collectorRetries = 3 # job attempts on transient (websocket) failures
+collectorThreads = 32 # jobs mostly wait for results: slots bound the copies
+
+
+class ResultsCollector:
+    """ Runs the result fetch jobs of all the tests. Jobs wait for their
+        results without holding anything, but copies run under two limits: a
+        global one and one per cluster, so the run never opens an unbounded
+        number of exec sessions against an API server. The tests run as
+        threads of the run's process (see RunEngine), so they all share the
+        collector and its limits. Identical jobs in flight are only run
+        once.
+    """
+
+    def __init__(self, maxParallel, maxParallelPerCluster, clusters):
+        self.maxParallelPerCluster = maxParallelPerCluster
+        self.globalSlots = BoundedSemaphore(maxParallel)
+        self.clusterSlots = {cluster: BoundedSemaphore(maxParallelPerCluster)
+                             for cluster in clusters}
+        self.lock = threading.Lock()
+        self.pid = None
+        self.executor = None
+        self.inFlight = {}
+
+    @contextlib.contextmanager
+    def slot(self, kubeconfig):
+        """ Holds a cluster slot and a global slot (in this order). """
+
+        cluster = os.path.basename(os.path.dirname(os.path.abspath(kubeconfig)))
+        with self.lock:
+            if cluster not in self.clusterSlots:
+                self.clusterSlots[cluster] = BoundedSemaphore(
+                    self.maxParallelPerCluster)
+            clusterSlots = self.clusterSlots[cluster]
+        with clusterSlots:
+            with self.globalSlots:
+                yield
+
+    def submit(self, resDir, kubeconfig, podName, files, toLog,
+               doneMarker=None, stats=None, resumable=None):
+        """ Queues a fetch job, see fetchResultsBatch for the parameters.
+
+        Returns:
+            Future: Resolves to the fetch counters of the job. If the same job
+                    is already in flight, its Future is returned instead.
+        """
+
+        key = (os.path.abspath(kubeconfig), podName, tuple(files))
+        with self.lock:
+            if self.pid != os.getpid(): # forked: threads were not inherited
+                self.pid = os.getpid()
+                self.executor = ThreadPoolExecutor(max_workers=collectorThreads)
+                self.inFlight = {}
+            future = self.inFlight.get(key)
+            if future is None:
+                future = self.executor.submit(self.run,
+                                              resDir,
+                                              kubeconfig,
+                                              podName,
+                                              files,
+                                              toLog,
+                                              doneMarker,
+                                              stats,
+                                              resumable)
+                self.inFlight[key] = future
+                future.add_done_callback(lambda f: self.forget(key))
+        return future
+
+    def forget(self, key):
+        with self.lock:
+            self.inFlight.pop(key, None)
+
+    def run(self, resDir, kubeconfig, podName, files, toLog, doneMarker, stats,
+            resumable):
+        """ Runs a fetch job, retrying it on transient failures. """
+
+        if stats is None:
+            stats = newFetchStats()
+        sleepTime = fetchBackoffStart
+        for attempt in range(collectorRetries):
+            try:
+                return fetchResultsBatch(resDir,
+                                         kubeconfig,
+                                         podName,
+                                         files,
+                                         toLog,
+                                         doneMarker=doneMarker,
+                                         stats=stats,
+                                         slot=self.slot,
+                                         resumable=resumable)
+            except transientErrors as ex:
+                print("Fetch job for %s failed, retrying: %s" % (podName, ex))
+                stats["retries"] += 1
+                time.sleep(sleepTime)
+                sleepTime = min(sleepTime * 2, fetchBackoffMax)
+        for source, file in files:
+            writeFail(resDir,
+                      file,
+                      "Failed to fetch %s from pod %s" % (source, podName),
+                      toLog)
+        return stats
+
+
+def startCollector(maxParallel, maxParallelPerCluster, clusters):
+    """ Creates the collector of the run, shared by all the tests. Must be
+        called before they start so they all share its limits.
+
+    Parameters:
+        maxParallel (int): Maximum number of copies running at once.
+        maxParallelPerCluster (int): Same, per cluster.
+        clusters (Array<str>): IDs of the clusters.
+    """
+
+    global collector
+    collector = ResultsCollector(maxParallel, maxParallelPerCluster, clusters)
+
+
+def collectResults(resDir, kubeconfig, podName, files, toLog,
+                   doneMarker=None, stats=None, resumable=None):
+    """ Fetches results files from a pod through the run's collector and
+        waits for the job to finish. See fetchResultsBatch for parameters.
+
+    Returns:
+        dict: Fetch counters, see newFetchStats().
+    """
+
+    if collector is None: # i.e. run without startCollector: no limits
+        startCollector(collectorThreads, collectorThreads, [])
+    return collector.submit(resDir,
+                            kubeconfig,
+                            podName,
+                            files,
+                            toLog,
+                            doneMarker=doneMarker,
+                            stats=stats,
+                            resumable=resumable).result()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import json
+    import time
+    import asyncio
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+from tracing import record
+from aux import writeToFile
+
+
+class Step:
+    """ Node of the run graph. """
+
+    def __init__(self, name, func, inputs, outputs, resource, always, rerun):
+        self.name = name
+        self.func = func # coroutine function, returns False on failure
+        self.inputs = set(inputs)
+        self.outputs = set(outputs)
+        self.resource = resource
+        self.always = always
+        self.rerun = rerun
+        self.dependencies = set()
+        self.status = "pending"
+        self.error = None
+        self.start = None
+        self.end = None
+        self.done = None # asyncio.Event, created by the running loop
+
+
+class NoSlot:
+    """ Slot of the steps that don't use a limited resource. """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class Scheduler:
+    """ Runs the steps of a run as a dependency graph: every step declares the
+        inputs it needs and the outputs it produces, and starts as soon as the
+        steps producing its inputs are done. Steps using the same resource
+        (i.e. cloud API, SSH, k8s API) share its concurrency limit. A step
+        whose inputs failed is skipped, unless it is an 'always' step.
+        If given a journal, the outcome of every step is recorded in it, see
+        resume(). If given a status log, every change of status of a step is
+        written to it, one JSON object per line (see dashboard.py).
+    """
+
+    def __init__(self, limits, journal=None, statusLog=None):
+        self.limits = limits
+        self.journal = journal
+        self.statusLog = statusLog
+        self.steps = {}
+        self.producers = {}
+
+    def add(self, name, func, inputs=(), outputs=(), resource=None,
+            always=False, rerun=False):
+        """ Adds a step to the graph.
+
+        Parameters:
+            name (str): Unique name of the step.
+            func (function): Coroutine function run by the step. The step
+                             fails if it returns False or raises.
+            inputs (Array<str>): Outputs of other steps it depends on.
+            outputs (Array<str>): What it produces.
+            resource (str): Resource it uses, see limits.
+            always (bool): If True, runs even if its inputs failed.
+            rerun (bool): If True, the step is run again when resuming, if
+                          a step depending on it has to (i.e. checks).
+        """
+
+        if name in self.steps:
+            raise ValueError("Duplicated step '%s'" % name)
+        step = Step(name, func, inputs, outputs, resource, always, rerun)
+        for output in step.outputs:
+            if output in self.producers:
+                raise ValueError("'%s' produced by '%s' and '%s'" % (
+                    output, self.producers[output], name))
+            self.producers[output] = name
+        self.steps[name] = step
+
+    def check(self):
+        """ Resolves the dependencies of the steps.
+
+        Raises:
+            ValueError: If an input is not produced by any step or the graph
+                        has cycles.
+        """
+
+        for step in self.steps.values():
+            for needed in step.inputs:
+                if needed not in self.producers:
+                    raise ValueError("Nothing produces '%s' (needed by '%s')"
+                                     % (needed, step.name))
+            step.dependencies = {self.producers[i] for i in step.inputs}
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visiting:
+                raise ValueError("Cycle in run graph at '%s'" % name)
+            if name not in visited:
+                visiting.add(name)
+                for dependency in self.steps[name].dependencies:
+                    visit(dependency)
+                visiting.discard(name)
+                visited.add(name)
+
+        for name in self.steps:
+            visit(name)
+
+    def resume(self, completed):
+        """ Marks as 'resumed' the steps completed by a previous attempt of
+            the run, so they are not run again. Also the steps only needed
+            by resumed steps.
+
+        Parameters:
+            completed (set<str>): Names of the completed steps.
+        """
+
+        self.check()
+        for name in completed:
+            step = self.steps.get(name)
+            if step is None or step.rerun:
+                continue
+            if step.always and not step.dependencies <= completed:
+                continue # has to see the outcome of what is run again
+            step.status = "resumed"
+        changed = True
+        while changed:
+            changed = False
+            for step in self.steps.values():
+                if step.status != "pending":
+                    continue
+                dependents = [s for s in self.steps.values()
+                              if step.name in s.dependencies]
+                if dependents and all(d.status == "resumed"
+                                      for d in dependents):
+                    step.status = "resumed"
+                    changed = True
+
+    def resumed(self):
+        """ Returns the names of the resumed steps. """
+
+        return {s.name for s in self.steps.values() if s.status == "resumed"}
+
+    def publish(self, step):
+        if self.statusLog is not None:
+            writeToFile(self.statusLog,
+                        json.dumps({"time": round(time.time(), 1),
+                                    "step": step.name,
+                                    "status": step.status}),
+                        True)
+
+    async def runStep(self, step, slots):
+        if step.status == "resumed":
+            step.done.set()
+            return
+        dependencies = [self.steps[d] for d in step.dependencies]
+        for dependency in dependencies:
+            await dependency.done.wait()
+        if not step.always and any(d.status not in ("done", "resumed")
+                                   for d in dependencies):
+            step.status = "skipped"
+            step.done.set()
+            self.publish(step)
+            return
+        slot = slots.get(step.resource, NoSlot())
+        try:
+            async with slot:
+                step.start = time.time()
+                step.status = "running"
+                self.publish(step)
+                res = await step.func()
+            step.status = "failed" if res is False else "done"
+        except asyncio.CancelledError:
+            step.status = "cancelled"
+            raise
+        except BaseException as ex:
+            step.status = "failed"
+            step.error = str(ex)
+        finally:
+            step.end = time.time()
+            step.done.set()
+            self.publish(step)
+            if step.start is not None:
+                record(step.name, "step", step.start, step.end, lane=step.name,
+                       args={"resource": step.resource, "status": step.status})
+            if self.journal is not None:
+                self.journal.record("step",
+                                    step.name,
+                                    status=step.status,
+                                    seconds=round(step.end - step.start, 1)
+                                    if step.start is not None else 0,
+                                    error=step.error)
+
+    async def run(self):
+        """ Runs all the steps. Failures do not stop independent steps. """
+
+        self.check()
+        slots = {resource: asyncio.Semaphore(limit)
+                 for resource, limit in self.limits.items()}
+        for step in self.steps.values():
+            step.done = asyncio.Event()
+            self.publish(step) # pending or resumed
+        await asyncio.gather(*[self.runStep(step, slots)
+                               for step in self.steps.values()])
+
+    def report(self):
+        """ Outcome of every step.
+
+        Returns:
+            Array<dict>: step, resource, status, seconds and error if any.
+        """
+
+        report = []
+        for step in self.steps.values():
+            outcome = {"step": step.name,
+                       "resource": step.resource,
+                       "status": step.status}
+            if step.start is not None and step.end is not None:
+                outcome["seconds"] = round(step.end - step.start, 1)
+            if step.error is not None:
+                outcome["error"] = step.error
+            report.append(outcome)
+        return report
+
+    def criticalPath(self):
+        """ Chain of steps that determined the duration of the run: starting
+            from the step finishing last, the dependency finishing last.
+
+        Returns:
+            Array<dict>: step, seconds it ran and seconds it waited for a
+                         slot after its dependencies were done.
+        """
+
+        ran = [s for s in self.steps.values() if s.start is not None]
+        if not ran:
+            return []
+        path = []
+        step = max(ran, key=lambda s: s.end)
+        while step is not None:
+            previous = [self.steps[d] for d in step.dependencies
+                        if self.steps[d].end is not None]
+            previous = max(previous, key=lambda s: s.end) if previous else None
+            ready = previous.end if previous is not None else step.start
+            path.append({"step": step.name,
+                         "seconds": round(step.end - step.start, 1),
+                         "waited": round(max(step.start - ready, 0), 1)})
+            step = previous if previous is not None and \
+                previous.start is not None else None
+        path.reverse()
+        return path
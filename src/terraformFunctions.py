@@ -8,67 +8,278 @@ try:
     from multiprocessing import Process, Queue
     import contextlib
     import io
+    import threading
+    import fcntl
+    import hashlib
 except ModuleNotFoundError as ex:
     print(ex)
     sys.exit(1)
 from aux import *
 from init import *
 from kubernetesFunctions import *
+from tracing import traced, record
 
 
+terraformOutputLock = threading.Lock() # output lines of concurrent runs
+terraformEnv = {} # environment of the Terraform runs, see setupTerraform
+pluginCacheDir = None # provider plugins shared by all clusters and runs
+cliConfigFile = "src/tests/terraform.rc" # written if using a mirror
+locksDir = "src/provisionment/locks" # pinned .terraform.lock.hcl per provider
+pinLocks = False
+applyParallelism = {} # provider: resources created at once by an apply
+phaseHistoryFile = "phases.json" # seconds of the last run of every phase
+initFingerprintFile = ".terraform/eosc-init" # see needsInit
+
+
+def setupTerraform(pluginCache, mirror=None, pin=False, parallelism=None):
+    """ Makes the Terraform runs of all clusters share a plugin cache, so
+        every provider is downloaded once. Must be called before the run
+        starts.
+
+    Parameters:
+        pluginCache (str): Folder of the cache. None to not use one.
+        mirror (str): If given, providers are installed only from this
+                      filesystem mirror (see 'terraform providers mirror'),
+                      without access to the registry.
+        pin (bool): If True, the provider versions selected the first time
+                    a provider is used are pinned (see pinnedLock).
+        parallelism (dict): Resources an apply creates at once, per provider
+                            (and 'default').
+    """
+
+    global pluginCacheDir, pinLocks
+    pinLocks = pin is True
+    applyParallelism.update(parallelism or {})
+    if pluginCache is not None:
+        pluginCacheDir = os.path.abspath(os.path.expanduser(pluginCache))
+        os.makedirs(pluginCacheDir, exist_ok=True)
+        terraformEnv["TF_PLUGIN_CACHE_DIR"] = pluginCacheDir
+    if mirror is not None:
+        with open(cliConfigFile, 'w') as f:
+            f.write("provider_installation {\n"
+                    "  filesystem_mirror {\n"
+                    "    path = \"%s\"\n"
+                    "  }\n"
+                    "}\n" % os.path.abspath(os.path.expanduser(mirror)))
+        terraformEnv["TF_CLI_CONFIG_FILE"] = os.path.abspath(cliConfigFile)
+
+
+@contextlib.contextmanager
+def pluginCacheLock():
+    """ Terraform doesn't support concurrent installs into a plugin cache:
+        inits (of every process and target) take turns.
+    """
+
+    if pluginCacheDir is None:
+        yield
+        return
+    with open(os.path.join(pluginCacheDir, ".lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def pinnedLock(providerName, mainTfDir):
+    """ Pins the versions of the providers of a cloud: the dependency lock
+        file written by the first successful init is kept on locksDir and
+        copied to the folder of every cluster before its init.
+
+    Parameters:
+        providerName (str): Provider name.
+        mainTfDir (str): Path where the .tf file is.
+
+    Returns:
+        bool: True if a pinned lock file was copied.
+    """
+
+    pinned = os.path.join(locksDir, "%s.terraform.lock.hcl" % providerName)
+    if pinLocks is False or not os.path.isfile(pinned):
+        return False
+    shutil.copy(pinned, os.path.join(mainTfDir, ".terraform.lock.hcl"))
+    return True
+
+
+def pinLock(providerName, mainTfDir):
+    """ Keeps the lock file of a successful init as the pinned one of its
+        cloud, if there is none yet (see pinnedLock).
+    """
+
+    pinned = os.path.join(locksDir, "%s.terraform.lock.hcl" % providerName)
+    lockFile = os.path.join(mainTfDir, ".terraform.lock.hcl")
+    if pinLocks is False or os.path.isfile(pinned) or \
+            not os.path.isfile(lockFile): # Terraform < 0.14 writes none
+        return
+    os.makedirs(locksDir, exist_ok=True)
+    partial = "%s.%d.%d" % (pinned, os.getpid(), threading.get_ident())
+    shutil.copy(lockFile, partial)
+    os.replace(partial, pinned)
+
+
+def initFingerprint(mainTfDir):
+    """ Digest of what terraform init depends on: the configuration, the
+        lock file, where providers come from and the Terraform binary.
+    """
+
+    digest = hashlib.sha256()
+    for filename in ("main.tf", ".terraform.lock.hcl"):
+        path = os.path.join(mainTfDir, filename)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    digest.update(json.dumps(terraformEnv, sort_keys=True).encode())
+    binary = shutil.which("terraform")
+    if binary is not None:
+        digest.update(("%s %s" % (binary, os.path.getmtime(binary))).encode())
+    return digest.hexdigest()
+
+
+def needsInit(mainTfDir):
+    """ Whether the folder of a cluster has to be initialized: its providers
+        are not installed, or its configuration or lock file changed since
+        its last init.
+    """
+
+    try:
+        with open(os.path.join(mainTfDir, initFingerprintFile), 'r') as f:
+            return f.read() != initFingerprint(mainTfDir)
+    except FileNotFoundError:
+        return True
+
+
+def phaseHistory(mainTfDir):
+    try:
+        with open(os.path.join(mainTfDir, phaseHistoryFile), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def recordPhase(test, mainTfDir, phase, start, end):
+    """ Records the duration of a Terraform subcommand run on a cluster, on
+        the trace of the run and as the last duration of the phase.
+    """
+
+    history = phaseHistory(mainTfDir)
+    history[phase] = round(end - start, 1)
+    with open(os.path.join(mainTfDir, phaseHistoryFile), 'w') as f:
+        json.dump(history, f)
+    record(phase, "tfphase", start, end,
+           args={"cluster": test, "phase": phase, "skipped": False})
+
+
+def skipPhase(test, mainTfDir, phase):
+    """ Records that a Terraform subcommand was not needed on a cluster and
+        the time saved: what it took the last time it ran, if known.
+    """
+
+    now = time.time()
+    record(phase, "tfphase", now, now,
+           args={"cluster": test, "phase": phase, "skipped": True,
+                 "saved": phaseHistory(mainTfDir).get(phase)})
+
+
+def provisionVMs(test, mainTfDir, providerName, msg, usePrivateIPs,
+                 terraform_cli_vars=None):
+    """ Creates (or updates) the VMs of a cluster: init only if needed (see
+        needsInit), apply with the parallelism of the provider, and refresh
+        only if an IP the hosts file needs is still unknown after the apply
+        (i.e. dynamic public IPs on Azure). The rest of the outputs are read
+        from the state.
+
+    Parameters:
+        test (str): Cluster identification.
+        mainTfDir (str): Path where the .tf file is.
+        providerName (str): Provider name.
+        msg (str): Message to be shown.
+        usePrivateIPs (bool): If True, the hosts file uses the private IPs.
+        terraform_cli_vars (str): CLI vars to be appended to the cmd.
+
+    Returns:
+        int: 0 for success, exit code of the failed subcommand otherwise.
+    """
+
+    toLog = "src/logging/%s" % test
+    parallelism = applyParallelism.get(providerName,
+                                       applyParallelism.get("default", 10))
+    cmds = ["init"] if needsInit(mainTfDir) else []
+    if not cmds:
+        skipPhase(test, mainTfDir, "init")
+    cmds.append("apply -auto-approve -parallelism=%d" % parallelism)
+    exitCode = runTerraform(toLog, cmds, mainTfDir, test, msg,
+                            terraform_cli_vars=terraform_cli_vars)
+    if exitCode != 0:
+        return exitCode
+    if "init" in cmds:
+        with open(os.path.join(mainTfDir, initFingerprintFile), 'w') as f:
+            f.write(initFingerprint(mainTfDir))
+    # same IPs as createHostsFile: getIP is None for resources without them
+    if any(getIP(resource, providerName,
+                 public=usePrivateIPs is not True) == ""
+           for resource in stateResources(mainTfDir)):
+        return runTerraform(toLog, ["refresh"], mainTfDir, test,
+                            "Waiting for the IPs of '%s' VMs..." % test)
+    skipPhase(test, mainTfDir, "refresh")
+    return 0
+
+
+@traced("terraform", label="test")
 def runTerraform(toLog,
-                 cmd,
+                 cmds,
                  mainTfDir,
-                 baseCWD,
                  test,
                  msg,
                  terraform_cli_vars=None):
-    """ Run Terraform cmds.
+    """ Run Terraform cmds on the folder of a cluster, without changing the
+        working directory of the process. Their output is printed prefixed
+        with the cluster ID.
 
     Parameters:
         toLog (str): File to which write the log msg.
-        cmd (str): Command to be run.
+        cmds (Array<str>): Terraform subcommands (i.e. "apply -auto-approve")
+                           run in order, until one fails.
         mainTfDir (str): Path where the .tf file is.
-        baseCWD (str): Path to go back.
         test (str): Cluster identification.
-        msg (str): Message to be shown.
+        msg (str): Message to be shown, None for none.
         terraform_cli_vars (str): CLI vars to be appended to the cmd.
 
     Returns:
-        int: 0 for success, 1 for failure
+        int: 0 for success, exit code of the failed subcommand otherwise.
     """
 
     if terraform_cli_vars is not None:
         with open(mainTfDir + "/terraform.tfvars.json", 'w') as varfile:
             json.dump(terraform_cli_vars, varfile, indent=4, sort_keys=True)
 
-    writeToFile(toLog, msg, True)
-    os.chdir(mainTfDir)
-
-    tfScript = """
-    ((%s) && touch /tmp/validTFrun) |
-
-    while read line; do echo [ %s ] $line; done
-
-    if [ -f /tmp/validTFrun ]; then
-    	rm -f /tmp/validTFrun
-    	exit 0
-    fi
-    exit 1
-    """ % (cmd, test)
-
-    exitCode = runCMD(tfScript)
-    os.chdir(baseCWD)
-    return exitCode
-
-
-def destroyTF(baseCWD, clusters=None):
+    if msg is not None:
+        writeToFile(toLog, msg, True)
+
+    def onLine(line, stream):
+        with terraformOutputLock:
+            print("[ %s ] %s" % (test, line), flush=True)
+
+    for cmd in cmds:
+        phase = cmd.split()[0]
+        with pluginCacheLock() if phase == "init" \
+                else contextlib.nullcontext():
+            start = time.time()
+            exitCode = runCommand(["terraform"] + cmd.split(),
+                                  cwd=mainTfDir,
+                                  env=terraformEnv or None,
+                                  onLine=onLine)
+        recordPhase(test, mainTfDir, phase, start, time.time())
+        if exitCode != 0:
+            return exitCode
+    return 0
+
+
+def destroyTF(clusters=None):
     """ Destroy infrastructure. 'clusters' is an array whose objects specify
         the clusters that should be destroyed. In case no array is given, all
         clusters will be destroyed.
 
     Parameters:
-        baseCWD (str): Path to go back.
         clusters (Array<str>): Clusters to destroy.
 
     Returns:
@@ -83,9 +294,9 @@ def destroyTF(baseCWD, clusters=None):
         toLog = "src/logging/footer"
         msg = "  -Destroying %s cluster..." % cluster
         mainTfDir = "src/tests/%s" % cluster
-        cmd = "terraform destroy -auto-approve"
-        exitCode = runTerraform(toLog, cmd, mainTfDir, baseCWD, cluster, msg)
-        if exitCode is 0:
+        exitCode = runTerraform(toLog, ["destroy -auto-approve"], mainTfDir,
+                                cluster, msg)
+        if exitCode == 0:
             if keepTFfiles is not True:
                 cleanupTF("src/tests/%s/" % cluster)
             else:
@@ -97,13 +308,16 @@ def destroyTF(baseCWD, clusters=None):
     return res
 
 
-def cleanupTF(mainTfDir):
+def cleanupTF(mainTfDir, keepProviders=False):
     """ Delete existing terraform stuff in the specified folder.
 
     Parameters:
         mainTfDir (str): Path to the .tf file.
+        keepProviders (bool): If True, keep the installed providers and the
+                              lock file, so the next init can be skipped.
     """
 
+    kept = (".terraform", ".terraform.lock.hcl") if keepProviders else ()
     for filename in [
         "hosts",
         "config",
@@ -113,7 +327,11 @@ def cleanupTF(mainTfDir):
         "terraform.tfvars.json",
         "terraform.tfstate",
         "terraform.tfstate.backup",
+        ".terraform.lock.hcl",
+        "pool.json",
             ".terraform"]:
+        if filename in kept:
+            continue
         file = "%s/%s" % (mainTfDir, filename)
         if os.path.isfile(file):
             os.remove(file)
@@ -174,7 +392,7 @@ def terraformProvisionment(
         nodeName = getNodeName(configs, test, randomId)
 
         # ---------------- delete TF stuff from previous run if existing
-        cleanupTF(mainTfDir)
+        cleanupTF(mainTfDir, keepProviders=True)
 
         # ---------------- variables
         variables = loadFile(templatesPath_base % "variables.tf",
@@ -283,18 +501,23 @@ def terraformProvisionment(
 
 
         # ---------------- RUN TERRAFORM: provision VMs
-        cmd = "terraform 0.13upgrade -yes && \
-               terraform init && \
-               terraform fmt > /dev/null && \
-               terraform apply -auto-approve && \
-               terraform refresh"
-        if runTerraform("src/logging/%s" % test,
-                        cmd,
+        pinnedLock(configs["providerName"], mainTfDir)
+        if provisionVMs(test,
                         mainTfDir,
-                        baseCWD,
-                        test,
+                        configs["providerName"],
                         "Provisioning %d '%s' VMs..." % (nodes, flavor),
+                        usePrivateIPs,
                         terraform_cli_vars=terraform_cli_vars) != 0:
             return False, provisionFailMsg
 
+        pinLock(configs["providerName"], mainTfDir)
         return True, ""
+
+    # ---------------- retry: reuse main.tf, variables and state
+    if provisionVMs(test,
+                    mainTfDir,
+                    configs["providerName"],
+                    "Reusing '%s' VMs..." % test,
+                    usePrivateIPs) != 0:
+        return False, provisionFailMsg
+    return True, ""
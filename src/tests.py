@@ -2,7 +2,6 @@
 
 import sys
 try:
-    from multiprocessing import Process, Queue
     import contextlib
     import io
 except ModuleNotFoundError as ex:
@@ -11,82 +10,137 @@ except ModuleNotFoundError as ex:
 from checker import *
 from provisionment import *
 from kubernetesFunctions import *
+from resultsCollector import *
+from logFollower import *
+from metrics import TestMetrics
 from aux import *
 import init
 
 
-def sharedClusterTests(msgArr,
-                       onlyTest,
-                       retry,
-                       noTerraform,
-                       resDir,
-                       numberOfNodes,
-                       usePrivateIPs):
-    """ Runs the test that share the general purpose cluster.
+clusterResultFiles = {"shared": "sharedCluster_result.json",
+                      "dlTest": "bb_train_history.json",
+                      "proGANTest": "proGANTest.json",
+                      "hpcTest": "hpcTest_result.json"}
+
+
+# results a test must have left to be complete (not optional ones, i.e.
+# the fakesLast.png image of proGANTest)
+testArtifacts = {"s3Test": ["s3Test.json"],
+                 "dataRepatriationTest": ["data_repatriation_test.json"],
+                 "cpuBenchmarking": ["cpu_benchmarking.json"],
+                 "perfsonarTest": ["perfsonar_results.json"],
+                 "dodasTest": ["dodas_results.json"],
+                 "dlTest": ["bb_train_history.json",
+                            "m0_bb_train_history.model",
+                            "m1_bb_train_history.model"],
+                 "proGANTest": ["network-final.pkl", "log.txt"],
+                 "hpcTest": ["hpcTest_result.json"]}
+failStubSize = 4096 # bytes: bigger artifacts can't be writeFail stubs
+
+
+def testCompleted(test, resDir):
+    """ Checks whether the results of a test are in the results folder and
+        none of them is a failure (see writeFail).
 
     Parameters:
-        msgArray (Array<str>): Stuff to show on the banner. Contains the
-                               tests to be deployed on the shared cluster.
-        onlyTest (bool): If true, skip provisioning phase.
-        retry (bool): If true, try to reuse existing infrastructure.
-        noTerraform (bool): Specifies whether current run uses terraform.
-        resDir (str): Path to the results folder for the current run.
-        numberOfNodes (int): Number of nodes to provision.
-        usePrivateIPs (bool): Indicates usage of private or public IPs.
+        test (str): Name of the test.
+        resDir (str): Path to the results folder of the run.
 
     Returns:
-        None: In case of errors the function stops (returns None)
+        bool: True if the test doesn't need to be run again.
     """
 
-    start = time.time()
-    sharedClusterProcs = []
-    testCost = 0
-    logger(msgArr, "=", "src/logging/shared")
+    for artifact in testArtifacts[test]:
+        path = os.path.join(resDir, artifact)
+        if not os.path.isfile(path):
+            return False
+        # failures are written under the artifact's name, whatever its type
+        if artifact.endswith(".json") or \
+                os.path.getsize(path) <= failStubSize:
+            try:
+                with open(path, 'r') as f:
+                    if json.load(f).get("result") == "fail":
+                        return False
+            except (ValueError, AttributeError, UnicodeDecodeError):
+                pass # not a failure file
+    return True
+
+
+def clusterSpec(cluster, noTerraform, sharedNodes=None):
+    """ Describes the VMs of the cluster of a test.
 
-    if noTerraform is True:
-        flavor = None
-    else:
-        flavor = init.configs["flavor"]
+    Parameters:
+        cluster (str): Cluster ID (shared or the name of the test).
+        noTerraform (bool): Specifies whether current run uses terraform.
+        sharedNodes (int): Number of nodes of the shared cluster.
 
-    if onlyTest is False:
-        prov, msg = provisionAndBootstrap("shared",
-                                          numberOfNodes,
-                                          flavor,
-                                          None,
-                                          "src/logging/shared",
-                                          init.configs,
-                                          init.cfgPath,
-                                          testsRoot,
-                                          retry,
-                                          instanceDefinition,
-                                          credentials,
-                                          dependencies,
-                                          baseCWD,
-                                          extraSupportedClouds,
-                                          noTerraform,
-                                          usePrivateIPs)
-        if prov is False:
-            toPut = {"test": "shared", "deployed": False}
-            if "provision" in msg:
-                toPut["reason"] = "ProvisionFailed"
-            writeFail(resDir, "sharedCluster_result.json",
-                      msg, "src/logging/shared")
-            init.queue.put((toPut, testCost))
-            return
+    Returns:
+        int: Number of nodes.
+        str: Flavor of the VMs, None if not using terraform.
+        str: Extra HCL code to configure the VMs.
+    """
+
+    if cluster == "shared":
+        nodes, extra = sharedNodes, None
+        flavorSource = init.configs
     else:
-        if not checkCluster("shared"):
-            return # Cluster not reachable, do not add cost for this test
-    for test in msgArr[1:]:
-        p = Process(target=eval(test), args=(resDir,))
-        sharedClusterProcs.append(p)
-        p.start()
-    for p in sharedClusterProcs:
-        p.join()
-    if init.obtainCost is True: # duration * instancePrice * numberOfInstances
-        testCost = ((time.time() - start) / 3600) * \
-            init.configs["costCalculation"]["generalInstancePrice"] * \
-            len(msgArr[1:])
-    init.queue.put((None, testCost))
+        flavorSource = init.testsCatalog[cluster]
+        nodes = 1 if cluster == "proGANTest" else flavorSource["nodes"]
+        extra = None if cluster == "hpcTest" else extraInstanceConfig
+    flavor = None if noTerraform is True else flavorSource["flavor"]
+    return nodes, flavor, extra
+
+
+def clusterFailed(cluster, msg, resDir):
+    """ Records the failure to provision or bootstrap the cluster of a test.
+
+    Parameters:
+        cluster (str): Cluster ID (shared or the name of the test).
+        msg (str): Message describing the failure.
+        resDir (str): Path to the results folder for the current run.
+    """
+
+    toPut = {"test": cluster, "deployed": False}
+    if "provision" in msg:
+        toPut["reason"] = "ProvisionFailed"
+    writeFail(resDir, clusterResultFiles[cluster], msg,
+              "src/logging/%s" % cluster)
+    init.queue.put((toPut, 0))
+
+
+def provisionCluster(cluster, retry, noTerraform, usePrivateIPs,
+                     sharedNodes=None):
+    """ Provisions and bootstraps the cluster of a test.
+
+    Parameters:
+        cluster (str): Cluster ID (shared or the name of the test).
+        retry (bool): If true, try to reuse existing infrastructure.
+        noTerraform (bool): Specifies whether current run uses terraform.
+        usePrivateIPs (bool): Indicates usage of private or public IPs.
+        sharedNodes (int): Number of nodes of the shared cluster.
+
+    Returns:
+        bool: True if the cluster was succesfully provisioned. False otherwise.
+        str: Message informing of the provisionment task result.
+    """
+
+    nodes, flavor, extra = clusterSpec(cluster, noTerraform, sharedNodes)
+    return provisionAndBootstrap(cluster,
+                                 nodes,
+                                 flavor,
+                                 extra,
+                                 "src/logging/%s" % cluster,
+                                 init.configs,
+                                 init.cfgPath,
+                                 testsRoot,
+                                 retry,
+                                 instanceDefinition,
+                                 credentials,
+                                 dependencies,
+                                 baseCWD,
+                                 extraSupportedClouds,
+                                 noTerraform,
+                                 usePrivateIPs)
 
 
 def runTest(definition,
@@ -125,15 +179,24 @@ def runTest(definition,
     start = time.time() # For tests with additional resources (i.e S3 bucket)
     #---------------------------------------------------------------------------
 
-    if kubectl(Action.create,
-               kubeconfig,
-               file=definition,
-               toLog=toLog) != 0:
-        init.queue.put(({"test": testName, "deployed": False}, testCost))
+    metrics = TestMetrics()
+    with metrics.phase("deploy"):
+        created = kubectl(Action.create,
+                          kubeconfig,
+                          file=definition,
+                          toLog=toLog)
+    if created != 0:
+        init.queue.put(({"test": testName, "deployed": False}, testCost,
+                        metrics.report()))
         writeFail(resDir, resultFile, "%s pod deploy failed." % podName, toLog)
     else:
+        fetchStats = None
+        ran = True
+        podLogs = followLogs(kubeconfig, resDir, toLog, podName=podName)
         if copyToPodAndRun_flag is True:
-            copyToPodAndRun(
+            uploadStats = {}
+            runStart = time.time()
+            ran = copyToPodAndRun(
                 podName,
                 kubeconfig,
                 resDir,
@@ -142,9 +205,20 @@ def runTest(definition,
                 localPath,
                 cmd,
                 resultFile,
-                resultOnPod)
-        else:
-            fetchResults(resDir,kubeconfig,podName,resultOnPod,resultFile,toLog)
+                resultOnPod,
+                fetch=False,
+                stats=uploadStats)
+            metrics.uploaded(time.time() - runStart, uploadStats)
+        if ran is True:
+            collectStart = time.time()
+            fetchStats = collectResults(resDir,
+                                        kubeconfig,
+                                        podName,
+                                        [(resultOnPod, resultFile)],
+                                        toLog)
+            metrics.collected(time.time() - collectStart, fetchStats)
+
+        logStats = podLogs.stop()
 
         #-----------------------------------------------------------------------
         testDuration = time.time() - start # For tests with additional resources
@@ -157,7 +231,10 @@ def runTest(definition,
         if keepResources is False:
             writeToFile(toLog, "Cluster cleanup...", True)
             kubectl(Action.delete, kubeconfig, type=Type.pod, name=podName)
-        init.queue.put(({"test": testName, "deployed": True}, testCost))
+        toPut = {"test": testName, "deployed": True, "logs": logStats}
+        if fetchStats is not None:
+            toPut["fetch"] = fetchStats
+        init.queue.put((toPut, testCost, metrics.report()))
 
 
 def s3Test(resDir):
@@ -380,7 +457,39 @@ def dodasTest(resDir):
             cmd=cmd)
 
 
-def dlTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
+def renderDataset():
+    """ Writes the ConfigMap resource file with the data set of dlTest. Does
+        not need the cluster.
+    """
+
+    fullDataset = open("%s/dlTest/fullDataset" % testsRoot, 'r').readlines()
+    selectedDataset = ""
+
+    for f in range(init.testsCatalog["dlTest"]["datasetSize"]):
+        selectedDataset += "%s\\r\\n" % fullDataset[f].replace('\n','')
+
+    with open("%s/dlTest/raw/dataset_raw.yaml" % testsRoot, 'r') as inputfile:
+        with open("%s/dlTest/dataset.yaml" % testsRoot, 'w') as outfile:
+            outfile.write(str(inputfile.read()).replace(
+            "DS_PH", "\"%s\"" % selectedDataset))
+
+
+def stageDataset():
+    """ Creates the data set ConfigMap of dlTest on its cluster.
+
+    Returns:
+        bool: True (an existing ConfigMap is reused).
+    """
+
+    kubectl(Action.create,
+        "src/tests/dlTest/config",
+        file="%sdlTest/dataset.yaml" % testsRoot,
+        ignoreErr=True)
+    return True
+
+
+def dlTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs,
+           start=None, staged=False):
     """ Run Deep Learning test -GAN training- on GPU nodes.
 
     Parameters:
@@ -389,63 +498,34 @@ def dlTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
         noTerraform (bool): Specifies whether current run uses terraform.
         resDir (str): Path to the results folder for the current run.
         usePrivateIPs (bool): Indicates usage of private or public IPs.
+        start (float): When the provisioning of the cluster started, if done
+                       by the caller (for the cost estimation).
+        staged (bool): If True, the data set ConfigMap was already created,
+                       see stageDataset().
 
     Returns:
         None: In case of errors the function stops (returns None)
     """
 
-    start = time.time()
+    start = time.time() if start is None else start
     testCost = 0
     res = False
     dl = init.testsCatalog["dlTest"]
     kubeconfig = "src/tests/dlTest/config"
 
-    if noTerraform is True:
-        flavor = None
-    else:
-        flavor = dl["flavor"]
-
     if onlyTest is False:
-        prov, msg = provisionAndBootstrap("dlTest",
-                                          dl["nodes"],
-                                          flavor,
-                                          extraInstanceConfig,
-                                          "src/logging/dlTest",
-                                          init.configs,
-                                          init.cfgPath,
-                                          testsRoot,
-                                          retry,
-                                          instanceDefinition,
-                                          credentials,
-                                          dependencies,
-                                          baseCWD,
-                                          extraSupportedClouds,
-                                          noTerraform,
-                                          usePrivateIPs)
+        prov, msg = provisionCluster("dlTest", retry, noTerraform, usePrivateIPs)
         if prov is False:
-            toPut = {"test": "dlTest", "deployed": res}
-            if "provision" in msg:
-                toPut["reason"] = "ProvisionFailed"
-            writeFail(resDir, "bb_train_history.json",
-                      msg, "src/logging/dlTest")
-            init.queue.put((toPut, testCost))
+            clusterFailed("dlTest", msg, resDir)
             return
     else:
         if not checkCluster("dlTest"):
             return  # Cluster not reachable, do not add cost for this test
 
-    # 1) Write the ConfigMap (data set) and MPIJob resource files:
+    # 1) Write the MPIJob resource file (the data set one, if not staged):
 
-    fullDataset = open("%s/dlTest/fullDataset" % testsRoot, 'r').readlines()
-    selectedDataset = ""
-
-    for f in range(dl["datasetSize"]):
-        selectedDataset += "%s\\r\\n" % fullDataset[f].replace('\n','')
-
-    with open("%s/dlTest/raw/dataset_raw.yaml" % testsRoot, 'r') as inputfile:
-        with open("%s/dlTest/dataset.yaml" % testsRoot, 'w') as outfile:
-            outfile.write(str(inputfile.read()).replace(
-            "DS_PH", "\"%s\"" % selectedDataset))
+    if staged is False:
+        renderDataset()
 
     mpijobResourceFile = '%s/dlTest/raw/%s_raw.yaml' % (testsRoot, dl["benchmark"])
 
@@ -460,12 +540,19 @@ def dlTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
 
     # 2) Deploy the data set ConfigMap and the MPIJob resource file:
     podName = "train-mpijob-worker-0"
-
-    kubectl(Action.create,
-        kubeconfig,
-        file="%sdlTest/dataset.yaml" % testsRoot,
-        ignoreErr=True)
-
+    fetchStats = newFetchStats()
+    logStats = None
+    metrics = TestMetrics()
+
+    if staged is False:
+        with metrics.phase("deploy"):
+            stageDataset()
+
+    deployTime = time.time()
+    podLogs = followLogs(kubeconfig, # launcher and workers
+                         resDir,
+                         "src/logging/dlTest",
+                         labelSelector="mpi_job_name=train-mpijob")
     if kubectl(Action.create,
                kubeconfig,
                file="%sdlTest/mpiJob.yaml" % testsRoot,
@@ -473,32 +560,40 @@ def dlTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
         writeFail(resDir, "bb_train_history.json",
                   "Error deploying 3D GAN benchmark.", "src/logging/dlTest")
 
-    elif waitForResource(podName, Type.pod, kubeconfig, retrials=70, sleepTime=10) is False:
+    elif waitForPod(podName,
+                    kubeconfig,
+                    deadline=time.time() + resourceWaitTimeout) is False:
         writeFail(resDir,
                   "bb_train_history.json",
                   "Error deploying 3D GAN benchmark: pods were never created",
                   "src/logging/dlTest")
 
     else:
-        fetchResults(resDir,
-                     kubeconfig,
-                     podName,
-                     "/%s/bb_train_history.json" % dl["benchmark"], # Losses
-                     "bb_train_history.json",
-                     "src/logging/dlTest")
-        fetchResults(resDir,
-                     kubeconfig,
-                     podName,
-                     "/%s/m0_bb_train_history.model" % dl["benchmark"], # Discriminator model
-                     "m0_bb_train_history.model",
-                     "src/logging/dlTest")
-        fetchResults(resDir,
-                     kubeconfig,
-                     podName,
-                     "/%s/m1_bb_train_history.model" % dl["benchmark"], # Combined model
-                     "m1_bb_train_history.model",
-                     "src/logging/dlTest")
+        podRunning = waitForPod(podName,
+                                kubeconfig,
+                                deadline=time.time() + resourceWaitTimeout,
+                                phase="Running")
+        if podRunning is not False:
+            writeToFile("src/logging/dlTest", "%s running %.1fs after deploy" %
+                        (podName, podRunning - deployTime), True)
+        metrics.add("deploy", (podRunning or time.time()) - deployTime)
+        collectStart = time.time()
+        collectResults(resDir,
+                       kubeconfig,
+                       podName,
+                       [("/%s/bb_train_history.json" % dl["benchmark"], # Losses
+                         "bb_train_history.json"),
+                        ("/%s/m0_bb_train_history.model" % dl["benchmark"], # Discriminator model
+                         "m0_bb_train_history.model"),
+                        ("/%s/m1_bb_train_history.model" % dl["benchmark"], # Combined model
+                         "m1_bb_train_history.model")],
+                       "src/logging/dlTest",
+                       stats=fetchStats,
+                       resumable=["/%s/m0_bb_train_history.model" % dl["benchmark"],
+                                  "/%s/m1_bb_train_history.model" % dl["benchmark"]])
+        metrics.collected(time.time() - collectStart, fetchStats)
         res = True
+    logStats = podLogs.stop()
 
     # Cost estimation
     if init.obtainCost is True:
@@ -510,10 +605,11 @@ def dlTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
     kubectl(Action.delete, kubeconfig, type=Type.mpijob, name="train-mpijob")
     kubectl(Action.delete, kubeconfig, type=Type.configmap, name="3dgan-datafile-lists")
 
-    init.queue.put(({"test": "dlTest", "deployed": res}, testCost))
+    init.queue.put(({"test": "dlTest", "deployed": res, "fetch": fetchStats,
+                     "logs": logStats}, testCost, metrics.report()))
 
 
-def proGANTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
+def proGANTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs, start=None):
     """ Train a Progressive GAN.
 
     Parameters:
@@ -522,47 +618,24 @@ def proGANTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
         noTerraform (bool): Specifies whether current run uses terraform.
         resDir (str): Path to the results folder for the current run.
         usePrivateIPs (bool): Indicates usage of private or public IPs.
+        start (float): When the provisioning of the cluster started, if done
+                       by the caller (for the cost estimation).
 
     Returns:
         None: In case of errors the function stops (returns None)
     """
 
 
-    start = time.time()
+    start = time.time() if start is None else start
     testCost = 0
     res = False
     proGAN = init.testsCatalog["proGANTest"]
     kubeconfig = "src/tests/proGANTest/config"
 
-    if noTerraform is True:
-        flavor = None
-    else:
-        flavor = proGAN["flavor"]
-
     if onlyTest is False:
-        prov, msg = provisionAndBootstrap("proGANTest",
-                                          1,
-                                          flavor,
-                                          extraInstanceConfig,
-                                          "src/logging/proGANTest",
-                                          init.configs,
-                                          init.cfgPath,
-                                          testsRoot,
-                                          retry,
-                                          instanceDefinition,
-                                          credentials,
-                                          dependencies,
-                                          baseCWD,
-                                          extraSupportedClouds,
-                                          noTerraform,
-                                          usePrivateIPs)
+        prov, msg = provisionCluster("proGANTest", retry, noTerraform, usePrivateIPs)
         if prov is False:
-            toPut = {"test": "proGANTest", "deployed": res}
-            if "provision" in msg:
-                toPut["reason"] = "ProvisionFailed"
-            writeFail(resDir, "proGANTest.json",
-                      msg, "src/logging/proGANTest")
-            init.queue.put((toPut, testCost))
+            clusterFailed("proGANTest", msg, resDir)
             return
     else:
         if not checkCluster("proGANTest"):
@@ -585,6 +658,8 @@ def proGANTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
     # 2) Deploy the Pro-GAN pod:
 
     podName = "progan-pod"
+    fetchStats = newFetchStats()
+    logStats = None
     proganPodResDir = "000-pgan-syn256rgb_conditional-preset-v2-%s-fp32"
 
     if gpusToUse == 1:
@@ -596,38 +671,52 @@ def proGANTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
     else:
         proganPodResDir = proganPodResDir % "8gpus"
 
-    if kubectl(Action.create,
-               kubeconfig,
-               file="%sproGANTest/progan.yaml" % testsRoot,
-               toLog="src/logging/proGANTest") != 0:
+    metrics = TestMetrics()
+    with metrics.phase("deploy"):
+        created = kubectl(Action.create,
+                          kubeconfig,
+                          file="%sproGANTest/progan.yaml" % testsRoot,
+                          toLog="src/logging/proGANTest")
+    if created != 0:
         writeFail(resDir, "progan.json",
                   "Error deploying Pro-GAN benchmark.", "src/logging/proGANTest")
 
     else:
-        fetchResults(resDir,
-                     kubeconfig,
-                     podName,
-                     "/root/CProGAN-ME/results/%s/network-final.pkl" % proganPodResDir,
-                     "network-final.pkl",
-                     "src/logging/proGANTest")
-
+        podLogs = followLogs(kubeconfig,
+                             resDir,
+                             "src/logging/proGANTest",
+                             podName=podName)
         generatedImage = 'fakes%06d.png' % proGAN["kimg"]
-        #fetchResults(resDir,
-        #             kubeconfig,
-        #             podName,
-        #             "/root/CProGAN-ME/results/%s/%s" % (proganPodResDir, generatedImage),
-        #             "fakes.png",
-        #             "src/logging/proGANTest")
-        cmd = "cp progan-pod:/root/CProGAN-ME/results/%s/%s %s/fakesLast.png" % (proganPodResDir, generatedImage, resDir)
-        kubectlCLI(cmd, kubeconfig)
-
-        fetchResults(resDir,
-                     kubeconfig,
-                     podName,
-                     "/root/CProGAN-ME/results/%s/log.txt" % proganPodResDir,
-                     "log.txt",
-                     "src/logging/proGANTest")
+        proganResults = "/root/CProGAN-ME/results/%s/" % proganPodResDir
+        collectStart = time.time()
+        collectResults(resDir,
+                       kubeconfig,
+                       podName,
+                       [(proganResults + "network-final.pkl",
+                         "network-final.pkl"),
+                        (proganResults + "log.txt",
+                         "log.txt")],
+                       "src/logging/proGANTest",
+                       stats=fetchStats,
+                       resumable=[proganResults + "network-final.pkl"])
+        # best effort: the image is only there if the run reached kimg
+        imageStats = {}
+        if kubectl(Action.cp,
+                   kubeconfig,
+                   podPath="%s:%s%s" % (podName, proganResults, generatedImage),
+                   localPath="%s/fakesLast.png" % resDir,
+                   fetch=True,
+                   toLog="src/logging/proGANTest",
+                   stats=imageStats) == 0:
+            fetchStats["bytes"] += imageStats["bytes"]
+            fetchStats["seconds"] += imageStats["seconds"]
+        else:
+            writeToFile("src/logging/proGANTest",
+                        "Warning: %s not found on %s, fakesLast.png not "
+                        "fetched" % (generatedImage, podName), True)
+        metrics.collected(time.time() - collectStart, fetchStats)
         res = True
+        logStats = podLogs.stop()
 
     # Cost estimation
     if init.obtainCost is True:
@@ -637,10 +726,11 @@ def proGANTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
     # cleanup
     #writeToFile("src/logging/proGANTest", "Cluster cleanup...", True)
     kubectl(Action.delete, kubeconfig, type=Type.pod, name=podName)
-    init.queue.put(({"test": "proGANTest", "deployed": res}, testCost))
+    init.queue.put(({"test": "proGANTest", "deployed": res, "fetch": fetchStats,
+                     "logs": logStats}, testCost, metrics.report()))
 
 
-def hpcTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
+def hpcTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs, start=None):
     """ HPC test.
 
     Parameters:
@@ -649,45 +739,22 @@ def hpcTest(onlyTest, retry, noTerraform, resDir, usePrivateIPs):
         noTerraform (bool): Specifies whether current run uses terraform.
         resDir (str): Path to the results folder for the current run.
         usePrivateIPs (bool): Indicates usage of private or public IPs.
+        start (float): When the provisioning of the cluster started, if done
+                       by the caller (for the cost estimation).
 
     Returns:
         None: In case of errors the function stops (returns None)
     """
 
-    start = time.time()
+    start = time.time() if start is None else start
     testCost = 0
     res = False
     hpc = init.testsCatalog["hpcTest"]
 
-    if noTerraform is True:
-        flavor = None
-    else:
-        flavor = hpc["flavor"]
-
     if onlyTest is False:
-        prov, msg = provisionAndBootstrap("hpcTest",
-                                          hpc["nodes"],
-                                          flavor,
-                                          None,
-                                          "src/logging/hpcTest",
-                                          init.configs,
-                                          init.cfgPath,
-                                          testsRoot,
-                                          retry,
-                                          instanceDefinition,
-                                          credentials,
-                                          dependencies,
-                                          baseCWD,
-                                          extraSupportedClouds,
-                                          noTerraform,
-                                          usePrivateIPs)
+        prov, msg = provisionCluster("hpcTest", retry, noTerraform, usePrivateIPs)
         if prov is False:
-            toPut = {"test": "hpcTest", "deployed": res}
-            if "provision" in msg:
-                toPut["reason"] = "ProvisionFailed"
-            writeFail(resDir, "hpcTest_result.json",
-                      msg, "src/logging/hpcTest")
-            init.queue.put((toPut, testCost))
+            clusterFailed("hpcTest", msg, resDir)
             return
     else:
         if not checkCluster("hpcTest"):
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import os
+    import json
+    import time
+    import glob
+    import enum
+    import inspect
+    import functools
+    import threading
+    import contextlib
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+
+traceDir = None # spans of every process go to traceDir/spans.<pid>.jsonl
+traceLock = threading.Lock()
+maxArgLength = 200 # characters kept of every span argument
+
+
+def startTracing(path):
+    """ Starts recording spans. Must be called before the provisioning pool
+        is forked, so its processes record too.
+
+    Parameters:
+        path (str): Folder to which the spans are written.
+    """
+
+    global traceDir
+    os.makedirs(path, exist_ok=True)
+    traceDir = os.path.abspath(path) # whatever the directory of a process
+    with open(os.path.join(path, "mains"), 'a') as f: # one per attempt
+        f.write("%d\n" % os.getpid())
+
+
+def record(name, category, start, end, lane=None, args=None):
+    """ Records a span.
+
+    Parameters:
+        name (str): Name of the span.
+        category (str): Kind of span, i.e. terraform, ansible, k8s or fetch.
+        start (float): Start time (epoch seconds).
+        end (float): End time (epoch seconds).
+        lane (str): Row of the trace to show it on. By default, the thread
+                    recording it.
+        args (dict): Details of the span.
+    """
+
+    if traceDir is None:
+        return
+    line = {"name": name,
+            "cat": category,
+            "start": start,
+            "end": end,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id() if lane is None else lane,
+            "args": args or {}}
+    with traceLock:
+        with open(os.path.join(traceDir, "spans.%d.jsonl" % os.getpid()),
+                  'a') as f:
+            f.write(json.dumps(line, default=str) + "\n")
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    """ Records the span of what runs inside. If it raises, the span gets
+        the error.
+    """
+
+    if traceDir is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    except BaseException as ex:
+        args["error"] = repr(ex)[:maxArgLength]
+        raise
+    finally:
+        record(name, category, start, time.time(), args=args)
+
+
+def spanArgs(func, args, kwargs):
+    """ Arguments of a call worth showing on its span: the scalar ones. """
+
+    try:
+        bound = inspect.signature(func).bind(*args, **kwargs)
+    except TypeError:
+        return {}
+    shown = {}
+    for key, value in bound.arguments.items():
+        if isinstance(value, enum.Enum):
+            value = value.name
+        if isinstance(value, (str, int, float, bool)):
+            shown[key] = value[:maxArgLength] if isinstance(value, str) \
+                else value
+    return shown
+
+
+def traced(category, label=None):
+    """ Decorator recording a span around every call of the function, named
+        after it (and the value of its 'label' argument, if given).
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if traceDir is None:
+                return func(*args, **kwargs)
+            details = spanArgs(func, args, kwargs)
+            name = func.__name__ if details.get(label) is None \
+                else "%s %s" % (func.__name__, details[label])
+            with span(name, category, **details):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def loadSpans(path):
+    spans = []
+    for spansFile in sorted(glob.glob(os.path.join(path, "spans.*.jsonl"))):
+        with open(spansFile, 'r') as f:
+            for line in f:
+                with contextlib.suppress(ValueError): # truncated by a kill
+                    spans.append(json.loads(line))
+    return spans
+
+
+def chromeTrace(spans, mains=()):
+    """ Spans as Chrome trace events (chrome://tracing, Perfetto).
+
+    Parameters:
+        spans (Array<dict>): Spans, see record.
+        mains (Array<int>): PIDs of the main process of the run (one per
+                            attempt, see --resume).
+    """
+
+    events = []
+    lanes = {}
+    for pid in sorted({s["pid"] for s in spans}):
+        events.append({"ph": "M", "name": "process_name", "pid": pid,
+                       "args": {"name": "test-suite %d" % pid if pid in mains
+                                else "provisioner %d" % pid}})
+    for s in spans:
+        tid = s["tid"]
+        if isinstance(tid, str): # named lane, i.e. a step of the run graph
+            if (s["pid"], tid) not in lanes:
+                lanes[(s["pid"], tid)] = len(lanes) + 1
+                events.append({"ph": "M", "name": "thread_name",
+                               "pid": s["pid"], "tid": lanes[(s["pid"], tid)],
+                               "args": {"name": tid}})
+            tid = lanes[(s["pid"], tid)]
+        events.append({"ph": "X",
+                       "name": s["name"],
+                       "cat": s["cat"],
+                       "ts": round(s["start"] * 1e6),
+                       "dur": round((s["end"] - s["start"]) * 1e6),
+                       "pid": s["pid"],
+                       "tid": tid,
+                       "args": s["args"]})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def otlpTrace(spans, service):
+    """ Spans as OTLP/JSON (an ExportTraceServiceRequest), one trace per
+        run.
+    """
+
+    traceId = os.urandom(16).hex()
+
+    def attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    otlpSpans = []
+    for s in spans:
+        attributes = [attribute(k, v) for k, v in s["args"].items()]
+        attributes += [attribute("category", s["cat"]),
+                       attribute("process.pid", s["pid"]),
+                       attribute("thread", s["tid"])]
+        otlpSpans.append({
+            "traceId": traceId,
+            "spanId": os.urandom(8).hex(),
+            "name": s["name"],
+            "kind": 1, # internal
+            "startTimeUnixNano": str(round(s["start"] * 1e9)),
+            "endTimeUnixNano": str(round(s["end"] * 1e9)),
+            "attributes": attributes,
+            "status": {"code": 2, "message": s["args"]["error"]}
+            if "error" in s["args"] else {"code": 1}})
+    return {"resourceSpans": [{
+        "resource": {"attributes": [attribute("service.name", service)]},
+        "scopeSpans": [{"scope": {"name": "eosc-testsuite"},
+                        "spans": otlpSpans}]}]}
+
+
+def writeTrace(path, otlp=False, service="eosc-testsuite"):
+    """ Writes the spans recorded by all the processes of the run.
+
+    Parameters:
+        path (str): Chrome trace file to write (i.e. results/.../trace.json).
+        otlp (bool): If True, also write them as OTLP/JSON to
+                     <path without .json>.otlp.json.
+        service (str): Service name of the OTLP resource.
+
+    Returns:
+        int: Number of spans written.
+    """
+
+    if traceDir is None:
+        return 0
+    spans = loadSpans(traceDir)
+    with open(os.path.join(traceDir, "mains"), 'r') as f:
+        mains = [int(pid) for pid in f.read().split()]
+    with open(path, 'w') as f:
+        json.dump(chromeTrace(spans, mains), f)
+    if otlp is True:
+        with open(os.path.splitext(path)[0] + ".otlp.json", 'w') as f:
+            json.dump(otlpTrace(spans, service), f)
+    return len(spans)
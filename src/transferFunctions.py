@@ -0,0 +1,665 @@
+#!/usr/bin/env python3
+
+import sys
+try:
+    import base64
+    import hashlib
+    import json
+    import os
+    import re
+    import shlex
+    import tarfile
+    import time
+    from kubernetes.stream import stream
+
+except ModuleNotFoundError as ex:
+    print(ex)
+    sys.exit(1)
+
+
+transferChunkSize = 3 * 256 * 1024 # multiple of 3: base64 chunks concatenate
+endOfTransfer = "__EOSC_TS_EOT__" # sentinel closing the stdin of uploads
+sha256Line = re.compile(r"^([0-9a-f]{64})\s+\*?(.+)$")
+rangeChunkMB = 64 # size of the byte ranges of resumable transfers
+
+
+class PodReader:
+    """ File-like object over the stdout of an exec session. The pod sends
+        base64 text (the exec websocket only carries text), which is decoded
+        here chunk by chunk: only one chunk is held in memory at a time.
+    """
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.buffer = bytearray()
+        self.pending = ""
+        self.stderr = ""
+        self.wireBytes = 0
+
+    def decode(self, text, final=False):
+        """ Decodes the complete base64 quads, keeps the rest for later. """
+
+        text = self.pending + "".join(text.split())
+        cut = len(text) if final else len(text) - len(text) % 4
+        self.pending = text[cut:]
+        if cut > 0:
+            decoded = base64.b64decode(text[:cut])
+            self.wireBytes += len(decoded)
+            self.buffer.extend(decoded)
+
+    def fill(self):
+        """ Reads the next stdout chunk from the session.
+
+        Returns:
+            bool: False once the session is closed and drained.
+        """
+
+        while True:
+            if self.resp.peek_stdout():
+                self.decode(self.resp.read_stdout())
+                return True
+            if self.resp.peek_stderr():
+                self.stderr += self.resp.read_stderr()
+            if not self.resp.is_open():
+                if self.pending:
+                    self.decode("", final=True)
+                    return True
+                return False
+            self.resp.update(timeout=1)
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and self.fill():
+            pass
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def drain(self):
+        """ Consumes whatever is left on the session (i.e. tar padding). """
+
+        while self.fill():
+            self.buffer.clear()
+
+
+class PodWriter:
+    """ File-like object over the stdin of an exec session. Written bytes are
+        base64 encoded and sent in chunks of transferChunkSize bytes.
+    """
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.buffer = bytearray()
+        self.wireBytes = 0
+
+    def send(self, data):
+        self.resp.write_stdin(base64.encodebytes(data).decode())
+        self.wireBytes += len(data)
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= transferChunkSize:
+            self.send(bytes(self.buffer[:transferChunkSize]))
+            del self.buffer[:transferChunkSize]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """ Sends the remaining bytes and the end of transfer sentinel. """
+
+        if self.buffer:
+            self.send(bytes(self.buffer))
+            self.buffer.clear()
+        self.resp.write_stdin("%s\n" % endOfTransfer)
+
+
+def sha256sum(path):
+    """ Computes the SHA-256 of a local file, reading it in chunks.
+
+    Parameters:
+        path (str): Path to the file.
+
+    Returns:
+        str: Hex digest of the file.
+    """
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(transferChunkSize), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def localDigests(localPath, arcname):
+    """ Computes the SHA-256 of every file under localPath, naming them as
+        they will be named on the pod.
+
+    Parameters:
+        localPath (str): Local file or directory.
+        arcname (str): Name given to localPath on the destination.
+
+    Returns:
+        dict: Relative path on destination -> hex digest.
+    """
+
+    if os.path.isfile(localPath):
+        return {arcname: sha256sum(localPath)}
+    digests = {}
+    for dirpath, dirnames, files in os.walk(localPath):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, localPath)
+            digests[os.path.join(arcname, rel)] = sha256sum(path)
+    return digests
+
+
+def parseDigests(text):
+    """ Parses sha256sum output.
+
+    Parameters:
+        text (str): Output of sha256sum.
+
+    Returns:
+        dict: Path (without leading '/' or './') -> hex digest.
+    """
+
+    digests = {}
+    for line in text.splitlines():
+        match = sha256Line.match(line.strip())
+        if match:
+            digests[re.sub("^(\\./|/)+", "", match.group(2))] = match.group(1)
+    return digests
+
+
+def reset(tarinfo):
+    """ Resets tar file's user related metadata (uid and name).
+
+    Parameters:
+        tarinfo (TarInfo): TarInfo object.
+
+    Returns:
+        TarInfo: returns the modified TarInfo object received.
+    """
+
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = "root"
+    return tarinfo
+
+
+def transferStats(stats, size, wireBytes, start, digests):
+    """ Fills the stats object of a transfer.
+
+    Parameters:
+        stats (dict): Object to fill, ignored if None.
+        size (int): Bytes of file content transferred.
+        wireBytes (int): Bytes of the (maybe compressed) tar stream.
+        start (float): Timestamp at which the transfer started.
+        digests (dict): SHA-256 of the transferred files.
+    """
+
+    if stats is None:
+        return
+    elapsed = max(time.time() - start, 1e-6)
+    stats["bytes"] = size
+    stats["wireBytes"] = wireBytes
+    stats["seconds"] = round(elapsed, 3)
+    stats["throughput"] = round(size / elapsed / 1024 / 1024, 3) # MB/s
+    if len(digests) == 1:
+        stats["sha256"] = list(digests.values())[0]
+
+
+def copyManyFromPod(coreV1, podName, namespace, targets, compress=False,
+                    stats=None):
+    """ Streams several files or directories from a pod to the local FS in a
+        single exec session. The pod sends the SHA-256 of every file (on
+        stderr) and then one tar stream with all the sources, which is
+        extracted member by member as it arrives. Files are written with a
+        '.part' suffix and renamed once their checksum was verified.
+
+    Parameters:
+        coreV1 (CoreV1Api): API object to use.
+        podName (str): Pod name.
+        namespace (str): Namespace of the pod.
+        targets (dict): Path on the pod -> local destination path.
+        compress (bool): If True, gzip the stream on the pod.
+        stats (dict): If given, filled with bytes, seconds and throughput
+                      (MB/s) of the session and a 'files' object holding the
+                      bytes, seconds (since the session started) and SHA-256
+                      of each source.
+
+    Returns:
+        dict: Path on the pod -> True if it was copied and verified.
+    """
+
+    start = time.time()
+    roots = {re.sub("^/+", "", path): path for path in targets}
+    quoted = " ".join(shlex.quote(root) for root in roots)
+    cmd = "cd / ; find %s -type f -exec sha256sum {} + >&2 ; " \
+          "tar c%sf - %s | base64" % (quoted, "z" if compress else "", quoted)
+    resp = stream(coreV1.connect_get_namespaced_pod_exec,
+                  podName,
+                  namespace,
+                  command=['/bin/sh', '-c', cmd],
+                  stderr=True,
+                  stdin=False,
+                  stdout=True,
+                  tty=False,
+                  _preload_content=False)
+
+    reader = PodReader(resp)
+    digests = {}
+    written = {root: [] for root in roots}
+    files = {}
+    try:
+        with tarfile.open(fileobj=reader,
+                          mode="r|gz" if compress else "r|") as tar:
+            for member in tar:
+                root = next((r for r in roots if member.name == r or
+                             member.name.startswith(r + "/")), None)
+                if root is None:
+                    continue # never write outside of the destinations
+                dest = os.path.join(targets[roots[root]],
+                                    member.name[len(root):].lstrip("/"))
+                if member.isdir():
+                    os.makedirs(dest, exist_ok=True)
+                elif member.isfile():
+                    if os.path.dirname(dest):
+                        os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    sha = hashlib.sha256()
+                    src = tar.extractfile(member)
+                    with open(dest + ".part", 'wb') as out:
+                        for chunk in iter(lambda: src.read(transferChunkSize), b''):
+                            sha.update(chunk)
+                            out.write(chunk)
+                    digests[member.name] = sha.hexdigest()
+                    written[root].append((member.name, dest))
+                    fileStats = files.setdefault(roots[root], {"bytes": 0})
+                    fileStats["bytes"] += member.size
+                    fileStats["seconds"] = round(time.time() - start, 3)
+                    if member.name == root:
+                        fileStats["sha256"] = digests[member.name]
+        reader.drain()
+    except tarfile.TarError as ex:
+        print("Error reading tar stream from %s: %s" % (podName, ex))
+    finally:
+        resp.close()
+
+    expected = parseDigests(reader.stderr)
+    res = {}
+    for root, path in roots.items():
+        res[path] = len(written[root]) > 0 and all(
+            digests[name] == expected.get(name) for name, dest in written[root])
+        for name, dest in written[root]:
+            if res[path] is True:
+                os.replace(dest + ".part", dest)
+            elif os.path.exists(dest + ".part"):
+                os.remove(dest + ".part")
+        if res[path] is False:
+            files.pop(path, None)
+            print("Copy of %s:%s failed or checksum mismatch." %
+                  (podName, path))
+    if False in res.values():
+        print(reader.stderr.strip())
+
+    transferStats(stats,
+                  sum(f["bytes"] for f in files.values()),
+                  reader.wireBytes,
+                  start,
+                  digests)
+    if stats is not None:
+        stats["files"] = files
+    return res
+
+
+def copyFromPod(coreV1, podName, namespace, pathOnPod, localPath,
+                compress=False, stats=None):
+    """ Streams a file or directory from a pod to the local FS, verifying the
+        SHA-256 of every file. See copyManyFromPod.
+
+    Parameters:
+        coreV1 (CoreV1Api): API object to use.
+        podName (str): Pod name.
+        namespace (str): Namespace of the pod.
+        pathOnPod (str): Path of the file or directory on the pod.
+        localPath (str): Local destination. If an existing directory, the
+                         source keeps its name inside it.
+        compress (bool): If True, gzip the stream on the pod.
+        stats (dict): If given, filled with bytes, seconds, throughput (MB/s)
+                      and the SHA-256 in case of a single file.
+
+    Returns:
+        bool: True if everything was copied and verified, False otherwise.
+    """
+
+    if os.path.isdir(localPath):
+        localPath = os.path.join(localPath, os.path.basename(pathOnPod))
+    res = copyManyFromPod(coreV1,
+                          podName,
+                          namespace,
+                          {pathOnPod: localPath},
+                          compress=compress,
+                          stats=stats)
+    if stats is not None:
+        stats.pop("files", None)
+    return res[pathOnPod]
+
+
+def execOnPod(coreV1, podName, namespace, cmd):
+    """ Runs a shell command on a pod and returns its output.
+
+    Parameters:
+        coreV1 (CoreV1Api): API object to use.
+        podName (str): Pod name.
+        namespace (str): Namespace of the pod.
+        cmd (str): Command to be run by /bin/sh.
+
+    Returns:
+        str: stdout of the command.
+        str: stderr of the command.
+    """
+
+    resp = stream(coreV1.connect_get_namespaced_pod_exec,
+                  podName,
+                  namespace,
+                  command=['/bin/sh', '-c', cmd],
+                  stderr=True,
+                  stdin=False,
+                  stdout=True,
+                  tty=False,
+                  _preload_content=False)
+    out = err = ""
+    try:
+        while resp.is_open():
+            resp.update(timeout=1)
+            if resp.peek_stdout():
+                out += resp.read_stdout()
+            if resp.peek_stderr():
+                err += resp.read_stderr()
+        if resp.peek_stdout():
+            out += resp.read_stdout()
+        if resp.peek_stderr():
+            err += resp.read_stderr()
+    finally:
+        resp.close()
+    return out, err
+
+
+def loadManifest(manifestPath, source, size, sha256, chunkSize):
+    """ Loads the manifest of a partial download. It is only valid if it
+        describes the same source file (path, size and checksum).
+
+    Parameters:
+        manifestPath (str): Path to the manifest.
+        source (str): Path of the file on the pod.
+        size (int): Current size of the file on the pod.
+        sha256 (str): Current SHA-256 of the file on the pod.
+        chunkSize (int): Size of the ranges, in bytes.
+
+    Returns:
+        dict: The manifest, a new one if not found or not valid.
+    """
+
+    manifest = {"source": source,
+                "size": size,
+                "sha256": sha256,
+                "chunkSize": chunkSize,
+                "chunks": []}
+    try:
+        with open(manifestPath, 'r') as f:
+            found = json.load(f)
+        if all(found.get(key) == manifest[key]
+               for key in ("source", "size", "sha256", "chunkSize")):
+            return found
+    except (OSError, ValueError):
+        pass
+    return manifest
+
+
+def saveManifest(manifestPath, manifest):
+    """ Writes the manifest of a partial download atomically. """
+
+    with open(manifestPath + ".tmp", 'w') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+
+def copyRangesFromPod(coreV1, podName, namespace, pathOnPod, localPath,
+                      stats=None):
+    """ Downloads a file from a pod in byte ranges of rangeChunkMB, so an
+        interrupted download can be resumed. Ranges are read on the pod with
+        dd, written to localPath + '.part' and, once their SHA-256 is checked
+        against the pod's, recorded in localPath + '.manifest.json'. A later
+        call resumes from the last verified range, as long as the file on the
+        pod did not change. The whole file checksum is verified at the end.
+
+    Parameters:
+        coreV1 (CoreV1Api): API object to use.
+        podName (str): Pod name.
+        namespace (str): Namespace of the pod.
+        pathOnPod (str): Path of the file on the pod.
+        localPath (str): Local destination file.
+        stats (dict): If given, filled with bytes, seconds, throughput (MB/s),
+                      SHA-256 and the offset the download resumed from.
+
+    Returns:
+        bool: True if the file was copied and verified, False otherwise.
+              Exceptions (i.e. the websocket dropped) are raised, the
+              download can be resumed by calling this again.
+    """
+
+    start = time.time()
+    quoted = shlex.quote(pathOnPod)
+    out, err = execOnPod(coreV1,
+                         podName,
+                         namespace,
+                         "stat -c %%s %s && sha256sum %s" % (quoted, quoted))
+    try:
+        size, sha256 = out.split()[:2]
+        size = int(size)
+    except ValueError:
+        print("Can't read %s on %s: %s" % (pathOnPod, podName, err.strip()))
+        return False
+
+    chunkSize = rangeChunkMB * 1024 * 1024
+    partPath = localPath + ".part"
+    manifestPath = localPath + ".manifest.json"
+    manifest = loadManifest(manifestPath, pathOnPod, size, sha256, chunkSize)
+    resumedFrom = len(manifest["chunks"]) * chunkSize
+    if resumedFrom > 0 and not os.path.exists(partPath):
+        manifest["chunks"] = []
+        resumedFrom = 0
+    wireBytes = 0
+
+    with open(partPath, 'r+b' if resumedFrom > 0 else 'wb') as part:
+        part.truncate(resumedFrom) # drop whatever wasn't verified
+        part.seek(resumedFrom)
+        for i in range(len(manifest["chunks"]), -(-size // chunkSize)):
+            dd = "dd if=%s bs=1M skip=%d count=%d 2>/dev/null" % (
+                quoted, i * rangeChunkMB, rangeChunkMB)
+            resp = stream(coreV1.connect_get_namespaced_pod_exec,
+                          podName,
+                          namespace,
+                          command=['/bin/sh',
+                                   '-c',
+                                   "%s | sha256sum >&2 ; %s | base64" % (dd, dd)],
+                          stderr=True,
+                          stdin=False,
+                          stdout=True,
+                          tty=False,
+                          _preload_content=False)
+            reader = PodReader(resp)
+            sha = hashlib.sha256()
+            try:
+                for chunk in iter(lambda: reader.read(transferChunkSize), b''):
+                    sha.update(chunk)
+                    part.write(chunk)
+            finally:
+                resp.close()
+            wireBytes += reader.wireBytes
+            expected = sha256Line.match(reader.stderr.strip())
+            if expected is None or expected.group(1) != sha.hexdigest():
+                part.truncate(i * chunkSize)
+                print("Range %d of %s:%s failed verification" %
+                      (i, podName, pathOnPod))
+                transferStats(stats, wireBytes, wireBytes, start, {})
+                return False
+            part.flush()
+            os.fsync(part.fileno())
+            manifest["chunks"].append(sha.hexdigest())
+            saveManifest(manifestPath, manifest)
+
+    res = sha256sum(partPath) == sha256
+    if res is True:
+        os.replace(partPath, localPath)
+    else:
+        print("Checksum of %s:%s does not match" % (podName, pathOnPod))
+        os.remove(partPath)
+    if os.path.exists(manifestPath):
+        os.remove(manifestPath)
+    transferStats(stats, size - resumedFrom, wireBytes, start, {pathOnPod: sha256})
+    if stats is not None:
+        stats["resumedFrom"] = resumedFrom
+    return res
+
+
+def remoteDigests(coreV1, podName, namespace, destDir, arcname):
+    """ Asks a pod for the SHA-256 of every file under destDir/arcname.
+
+    Parameters:
+        coreV1 (CoreV1Api): API object to use.
+        podName (str): Pod name.
+        namespace (str): Namespace of the pod.
+        destDir (str): Directory on the pod.
+        arcname (str): File or directory inside destDir.
+
+    Returns:
+        dict: Relative path on destination -> hex digest. Empty if nothing
+              is there yet.
+    """
+
+    out, err = execOnPod(coreV1,
+                         podName,
+                         namespace,
+                         "cd %s 2>/dev/null && "
+                         "find %s -type f -exec sha256sum {} + 2>/dev/null" % (
+                             shlex.quote(destDir),
+                             shlex.quote(arcname)))
+    return parseDigests(out)
+
+
+def copyToPod(coreV1, podName, namespace, localPath, destDir, arcname,
+              compress=False, stats=None, only=None):
+    """ Streams a local file or directory to a pod. The tar stream is built
+        while it is sent, so memory does not grow with the size of the input.
+        The pod answers with the SHA-256 of the extracted files.
+
+    Parameters:
+        coreV1 (CoreV1Api): API object to use.
+        podName (str): Pod name.
+        namespace (str): Namespace of the pod.
+        localPath (str): Local file or directory to copy.
+        destDir (str): Directory on the pod to extract to.
+        arcname (str): Name given to localPath inside destDir.
+        compress (bool): If True, gzip the stream (decompressed on the pod).
+        stats (dict): If given, filled with bytes, seconds, throughput (MB/s)
+                      and the SHA-256 in case of a single file.
+        only (Array<str>): If given, only these files (relative paths on the
+                           destination, see localDigests) are sent.
+
+    Returns:
+        bool: True if everything was copied and verified, False otherwise.
+    """
+
+    start = time.time()
+    expected = localDigests(localPath, arcname)
+    if only is None:
+        members = [(localPath, arcname)]
+        size = sum(os.path.getsize(os.path.join(dirpath, name))
+                   for dirpath, dirnames, files in os.walk(localPath)
+                   for name in files) if os.path.isdir(localPath) \
+            else os.path.getsize(localPath)
+    else:
+        members = [(os.path.join(localPath, os.path.relpath(name, arcname)),
+                    name) for name in only]
+        size = sum(os.path.getsize(path) for path, name in members)
+    cmd = "awk '/^%s$/{exit} {print}' | base64 -d | tar x%sf - -C %s && " \
+          "cd %s && find %s -type f -exec sha256sum {} +" % (
+              endOfTransfer,
+              "z" if compress else "",
+              shlex.quote(destDir),
+              shlex.quote(destDir),
+              shlex.quote(arcname))
+    resp = stream(coreV1.connect_get_namespaced_pod_exec,
+                  podName,
+                  namespace,
+                  command=['/bin/sh', '-c', cmd],
+                  stderr=True,
+                  stdin=True,
+                  stdout=True,
+                  tty=False,
+                  _preload_content=False)
+
+    writer = PodWriter(resp)
+    out = ""
+    try:
+        with tarfile.open(fileobj=writer,
+                          mode="w|gz" if compress else "w|") as tar:
+            for path, name in members:
+                tar.add(path, arcname=name, filter=reset)
+        writer.close()
+        while resp.is_open():
+            resp.update(timeout=1)
+            if resp.peek_stdout():
+                out += resp.read_stdout()
+            if resp.peek_stderr():
+                print("STDERR: %s" % resp.read_stderr())
+        if resp.peek_stdout():
+            out += resp.read_stdout()
+    finally:
+        resp.close()
+
+    remote = parseDigests(out)
+    # files already on the pod which are not local ones are left alone
+    res = all(remote.get(name) == digest for name, digest in expected.items())
+    if res is False:
+        print("Copy of %s to %s failed or checksum mismatch." %
+              (localPath, podName))
+    transferStats(stats, size, writer.wireBytes, start, expected)
+    return res
+
+
+def uploadToPod(coreV1, podName, namespace, localPath, destDir, arcname,
+                compress=False, stats=None):
+    """ Content addressed copy to a pod: only the files whose SHA-256 differs
+        from the one of the file at the destination (or that are missing
+        there) are sent. See copyToPod for the parameters.
+
+    Returns:
+        bool: True if the destination matches localPath, False otherwise.
+    """
+
+    start = time.time()
+    expected = localDigests(localPath, arcname)
+    remote = remoteDigests(coreV1, podName, namespace, destDir, arcname)
+    changed = [name for name, digest in expected.items()
+               if remote.get(name) != digest]
+    if stats is not None:
+        stats["skipped"] = len(expected) - len(changed)
+        stats["sent"] = len(changed)
+    if not changed:
+        transferStats(stats, 0, 0, start, expected)
+        return True
+    return copyToPod(coreV1,
+                     podName,
+                     namespace,
+                     localPath,
+                     destDir,
+                     arcname,
+                     compress=compress,
+                     stats=stats,
+                     only=None if os.path.isfile(localPath) else changed)